@@ -0,0 +1,71 @@
+"""
+Syscalls per MB, ACKs per MB and throughput of a ReliableUDPSocket transfer over loopback, for
+several receive batch caps and delayed ACK policies
+
+Run from the repository root:
+    PYTHONPATH=reliable_socket python -m benchmarks.recv_batch [-s MB] [-b BATCH ...] [-a N ...]
+"""
+import argparse
+import os
+import time
+from threading import Thread
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+
+HOST = '127.0.0.1'
+
+
+def transfer(size, **kwargs):
+    """
+    Sends `size` bytes from a client to a server
+    :return: (seconds, syscalls of both ends, ACKs sent by the receiver)
+    """
+    server = ReliableUDPSocket(**kwargs)
+    server.bind((HOST, 0))
+    server.listen()
+    data = os.urandom(size)
+    connections = []
+
+    def receive():
+        conn, _ = server.accept()
+        connections.append(conn)
+        buffer = memoryview(bytearray(65536))
+        received = 0
+        while received < size:
+            received += conn.recv_into(buffer)
+
+    receiver = Thread(target=receive)
+    receiver.start()
+    client = ReliableUDPSocket(**kwargs)
+    client.connect(server.getsockname())
+    start = time.perf_counter()
+    client.send(data)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    client.close()
+
+    ends = [client] + connections
+    syscalls = sum(end.recv_syscalls + end.send_syscalls for end in ends)
+    acks = sum(conn.send_syscalls for conn in connections)
+    return elapsed, syscalls, acks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--size', type=int, default=16, help="MB to transfer")
+    parser.add_argument('-b', '--batch', type=int, nargs='+', default=[1, 8, ReliableUDPSocket.RECV_BATCH])
+    parser.add_argument('-a', '--ack-every', type=int, nargs='+', default=[ReliableUDPSocket.ACK_EVERY])
+    parser.add_argument('-P', '--protocol', choices=['gbn', 'sr'], default='gbn')
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    for ack_every in args.ack_every:
+        for batch in args.batch:
+            elapsed, syscalls, acks = transfer(size, arq=args.protocol, recv_batch=batch,
+                                               ack_every=ack_every)
+            print(f"ack every {ack_every:>2}, batch {batch:>4}: {syscalls / args.size:>8.0f} syscalls/MB "
+                  f"{acks / args.size:>8.0f} ACKs/MB {args.size / elapsed:>8.1f} MB/s")
+
+
+if __name__ == '__main__':
+    main()
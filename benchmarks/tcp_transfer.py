@@ -0,0 +1,96 @@
+"""
+GB/s of a file moved over a loopback TCP connection, with the 1 KiB read/send/recv/write loops
+the TCP server and client used to have against sendfile on the sending end and splice (or
+recv_into a large buffer) on the receiving one
+
+Run from the repository root:
+    python -m benchmarks.tcp_transfer [-s MB] [-b BUFFER_SIZE ...]
+"""
+import argparse
+import os
+import socket
+import tempfile
+import time
+from threading import Thread
+
+from reliable_socket.file_transfer import recv_to_file, FILE_BUFFER_SIZE
+
+HOST = '127.0.0.1'
+LEGACY_BUFFER_SIZE = 1024
+
+
+def send_legacy(sock, file, buffer_size):
+    data = file.read(LEGACY_BUFFER_SIZE)
+    while data:
+        sock.send(data)
+        data = file.read(LEGACY_BUFFER_SIZE)
+
+
+def recv_legacy(sock, file, buffer_size):
+    while True:
+        data = sock.recv(LEGACY_BUFFER_SIZE)
+        if not data:
+            break
+        file.write(data)
+
+
+def send_kernel(sock, file, buffer_size):
+    sock.sendfile(file)
+
+
+def recv_kernel(sock, file, buffer_size):
+    recv_to_file(sock, file, buffer_size=buffer_size)
+
+
+def recv_buffered(sock, file, buffer_size):
+    # recv_into fallback, the path taken without splice
+    sock.settimeout(60)
+    recv_to_file(sock, file, buffer_size=buffer_size)
+
+
+def transfer(path, send, recv, buffer_size):
+    """
+    Sends the file at `path` through a loopback connection into a temporary file
+    :return: seconds
+    """
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind((HOST, 0))
+    server.listen()
+
+    def receive():
+        conn, _ = server.accept()
+        with conn, tempfile.TemporaryFile() as file:
+            recv(conn, file, buffer_size)
+
+    receiver = Thread(target=receive)
+    receiver.start()
+    start = time.perf_counter()
+    with socket.create_connection(server.getsockname()) as client, open(path, 'rb') as file:
+        send(client, file, buffer_size)
+    receiver.join()
+    elapsed = time.perf_counter() - start
+    server.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--size', type=int, default=512, help="MB to transfer")
+    parser.add_argument('-b', '--buffer-size', type=int, nargs='+', default=[FILE_BUFFER_SIZE])
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile() as source:
+        source.write(os.urandom(args.size * 1024 * 1024))
+        source.flush()
+        gigabytes = args.size / 1024
+        elapsed = transfer(source.name, send_legacy, recv_legacy, LEGACY_BUFFER_SIZE)
+        print(f"{'read/send + recv/write':<28} {LEGACY_BUFFER_SIZE:>8}: {gigabytes / elapsed:>6.2f} GB/s")
+        for buffer_size in args.buffer_size:
+            for name, recv in (('sendfile + recv_into', recv_buffered),
+                               ('sendfile + splice', recv_kernel)):
+                elapsed = transfer(source.name, send_kernel, recv, buffer_size)
+                print(f"{name:<28} {buffer_size:>8}: {gigabytes / elapsed:>6.2f} GB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""
+Packages per second that UDPPacket can build, encode and decode
+
+Run from the repository root:
+    python -m benchmarks.udp_packet [-n PACKAGES]
+"""
+import argparse
+import time
+
+from reliable_socket.utils import UDPPacket
+
+# Same as reliable_transfer_protocol.MAX_PACKET_SIZE, which needs the package directory in sys.path
+MAX_PACKET_SIZE = 1500
+
+PAYLOAD = bytes(MAX_PACKET_SIZE - UDPPacket.HEADER_SIZE)
+
+
+def bench(name, fn, n):
+    start = time.perf_counter()
+    fn(n)
+    elapsed = time.perf_counter() - start
+    print(f"{name:<10} {n / elapsed:>12,.0f} packages/s")
+
+
+def create(n):
+    for seq_n in range(n):
+        UDPPacket.create_data(seq_n, 0, PAYLOAD)
+
+
+def encode(n):
+    for seq_n in range(n):
+        UDPPacket.create_data(seq_n, 0, PAYLOAD).to_buffers()
+
+
+def decode(n):
+    datagram = UDPPacket.create_data(1, 0, PAYLOAD).to_bytes()
+    for _ in range(n):
+        UDPPacket.from_bytes(datagram).is_data()
+
+
+def ack_roundtrip(n):
+    for seq_n in range(n):
+        UDPPacket.from_bytes(UDPPacket.create_ack(0, seq_n).to_bytes()).is_ack()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-n', '--packages', type=int, default=200000)
+    args = parser.parse_args()
+
+    bench('create', create, args.packages)
+    bench('encode', encode, args.packages)
+    bench('decode', decode, args.packages)
+    bench('ack', ack_roundtrip, args.packages)
+
+
+if __name__ == '__main__':
+    main()
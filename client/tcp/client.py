@@ -1,19 +1,27 @@
+import sys
 import socket
 import json
 import os
 from tqdm import tqdm
+# file_transfer is shared with reliable_socket. Appended, so the modules of this directory
+# aren't shadowed by the ones there with the same name (client, server)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                             'reliable_socket'))
+from file_transfer import recv_to_file, FILE_BUFFER_SIZE
 
-BUFFER_SIZE = 1024
+BUFFER_SIZE = 1024  # Control messages
 MODE_UPLOAD = 'upload'
 MODE_DOWNLOAD = 'download'
 
 class ClientTCP():
-    def __init__(self, dest_path, filename, host, port=6000):
+    def __init__(self, dest_path, filename, host, port=6000, buffer_size=FILE_BUFFER_SIZE):
         self.host = host
         self.port = port
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.dest_path = dest_path
         self.filename = filename
+        # Bytes of file data moved per call
+        self.buffer_size = buffer_size
 
     def __connect(self):
         self.socket.connect((self.host, self.port))
@@ -45,18 +53,12 @@ class ClientTCP():
         if(res_mode['code'] == res_filename['code'] == res_file_size['code'] == 200):
             # file_to_send = open(f"{self.dest_path}/{self.filename}", 'rb')
             progress_bar = tqdm(total = size)
-            while(True):
-                file_buffered = file_to_send.read(BUFFER_SIZE)
-                while(file_buffered):
-                    self.socket.send(file_buffered)
-                    progress_bar.update(len(file_buffered))
-                    # print(progress_bar)
-                    file_buffered = file_to_send.read(BUFFER_SIZE)
-                if not file_buffered:
-                    progress_bar.close()
-                    file_to_send.close()
-                    print("Sending finished: closing connection")
-                    break
+            # os.sendfile: the file goes from the page cache to the socket inside the kernel
+            sent = self.socket.sendfile(file_to_send)
+            progress_bar.update(sent)
+            progress_bar.close()
+            file_to_send.close()
+            print("Sending finished: closing connection")
         self.socket.close()
 
     def download(self):
@@ -68,17 +70,10 @@ class ClientTCP():
             self.socket.send("OK".encode())
             with open(f"{self.dest_path}/{self.filename}", 'wb') as recieved_file:
                 progress_bar = tqdm(total = res_filename['msg'])
-                while True:
-                    data = self.socket.recv(BUFFER_SIZE)
-                    if progress_bar.n < res_filename['msg']:
-                        progress_bar.update(len(data))
-                        # print(progress_bar)
-                    if not data:
-                        recieved_file.close()
-                        progress_bar.close()
-                        break
-
-                    recieved_file.write(data)
+                # Spliced from the socket into the file inside the kernel, until the server closes
+                recv_to_file(self.socket, recieved_file, buffer_size=self.buffer_size,
+                             callback=progress_bar.update)
+                progress_bar.close()
 
         elif(res_mode['code'] == "400"):
             print(f"File: {self.filename} not found")
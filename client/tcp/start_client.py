@@ -1,6 +1,7 @@
 import argparse
 import socket
 from client import ClientTCP
+from file_transfer import FILE_BUFFER_SIZE
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-v', '--verbose', help="increase output verbosity", action="store_true")
@@ -11,11 +12,12 @@ parser.add_argument('-H', '--host', help="host server IP address", default=socke
 parser.add_argument('-d', '--dst', help="destination file path")
 parser.add_argument('-n', '--name', help="file name")
 parser.add_argument('-m', '--mode', help="download / upload", default = 'download')
+parser.add_argument('-b', '--buffer-size', help="bytes of file data moved per call", type=int, default=FILE_BUFFER_SIZE)
 
 args = parser.parse_args()
 
 if((args.dst is not None) and (args.name is not None) and (args.port is not None) and (args.host is not None)):
-    a = ClientTCP(args.dst, args.name, args.host, args.port)
+    a = ClientTCP(args.dst, args.name, args.host, args.port, args.buffer_size)
     getattr(a, args.mode)()
 else:
     print("Paramters missing")
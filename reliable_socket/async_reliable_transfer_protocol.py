@@ -0,0 +1,501 @@
+"""
+asyncio implementation of the Reliable Transfer Protocol
+
+Speaks exactly the same protocol as ReliableUDPSocket, but instead of listening and retransmission
+threads it is driven by the event loop: packages arrive through a DatagramProtocol and every
+timeout is a `loop.call_at`. Servers always demultiplex: every connection shares the listening
+endpoint.
+"""
+import asyncio
+import logging
+import socket
+import time
+
+from reliable_transfer_protocol import (ReliableSocket, WINDOW_SIZE, RTO, MIN_RTO, MAX_RTO,
+                                        ACK_EVERY, ACK_DELAY, ARQ_GO_BACK_N,
+                                        ARQ_SELECTIVE_REPEAT, STATUS_SYN, STATUS_ESTABLISHED)
+from utils import (UDPPacket, RTTEstimator, ByteQueue, chunked, OPTION_SEGMENT_ACK,
+                   SEQ_N_OPTION)
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - [%(threadName)s] - %(message)s')
+logger.setLevel(logging.ERROR)
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Hands every datagram received by the endpoint to its AsyncReliableUDPSocket
+    """
+    def __init__(self, owner):
+        self.owner = owner
+
+    def datagram_received(self, data, addr):
+        self.owner._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        # i.e. ICMP port unreachable, the retransmissions will take care of it
+        logger.debug(f"[{self.owner.id}] error received: {exc}")
+
+    def connection_lost(self, exc):
+        self.owner._shutdown()
+
+
+class AsyncReliableUDPSocket(ReliableSocket):
+    """
+    Reliable Socket using UDP Protocol, for asyncio applications
+
+    `connect`, `listen`, `accept`, `send`, `recv` and `close` are coroutines
+    """
+    MAX_PACKET_SIZE = 1500
+    WINDOW_SIZE = 64
+    RTO = 1  # Seconds
+    MIN_RTO = 0.2
+    MAX_RTO = 60
+    ACK_EVERY = 2
+    ACK_DELAY = 0.04
+
+    def __init__(self, window_size=WINDOW_SIZE, rto=RTO, arq=ARQ_GO_BACK_N, min_rto=MIN_RTO,
+                 max_rto=MAX_RTO, ack_every=ACK_EVERY, ack_delay=ACK_DELAY):
+        """
+        `ack_every` and `ack_delay` are the delayed ACK policy, see `ReliableUDPSocket`
+        """
+        assert arq in (ARQ_GO_BACK_N, ARQ_SELECTIVE_REPEAT)
+        self.sock = None
+        self.transport = None
+        self.id = None
+        self.server_mode = None
+        self.listening = False
+        # Listening socket only: connections indexed by the remote address
+        self.connections = {}
+        self.new_connections_queue = asyncio.Queue()
+        # Accepted connections only: the remote address and the listening socket they belong
+        self.peer_address = None
+        self.listener = None
+        self.connection_status = None
+        self.gbn_window = []
+        self.seq_n = 0
+        self.r_seq_n = 0
+        # Selective Repeat only: segments received ahead of r_seq_n, indexed by their seq_n
+        self.out_of_order_buffer = {}
+        # Delayed ACK: segments received in order since the last ACK was sent
+        self.unacked_segments = 0
+        self.receiving_gap = False
+        self.app_recv_buffer = ByteQueue()  # Info to be read by the app
+        # Set whenever the app may continue: data to read, window space or connection closed
+        self.recv_event = asyncio.Event()
+        self.window_event = asyncio.Event()
+        self.established = None
+        self.finished = None
+        self.rtx_timer = None
+        self.linger_timer = None
+        self.ack_timer = None
+        self.stop_transmission = False
+        self.closed = False
+        self.desconnected_timeouts = 3
+        # Configurable Attributes
+        self.window_size = window_size
+        self.rtt_estimator = RTTEstimator(rto, min_rto, max_rto)
+        self.arq = arq
+        self.ack_every = min(ack_every, window_size)
+        self.ack_delay = ack_delay
+
+    @property
+    def rto(self):
+        """
+        Current Retransmission Timeout, in seconds
+        """
+        return self.rtt_estimator.rto
+
+    def bind(self, addr):
+        """
+        Binds the socket to a local address. Non-Blocking
+        """
+        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(addr)
+
+    async def listen(self):
+        """
+        Enable the server to accept new connections
+        """
+        self.id = 'Main'
+        self.server_mode = True
+        self.listening = True
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self), sock=self.sock)
+
+    async def accept(self):
+        """
+        Waits until a new connection is received
+        :return: (conn, address)
+        """
+        return await self.new_connections_queue.get()
+
+    async def connect(self, address):
+        """
+        Connect to a remote socket at `address`. Returns once the connection has been established
+        """
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(
+            lambda: _DatagramProtocol(self), remote_addr=address)
+        local_address = self.getsockname()
+        self.id = f"Client: {local_address[0]}:{local_address[1]}"
+        self.server_mode = False
+        self.connection_status = STATUS_SYN
+        self.established = loop.create_future()
+
+        package = UDPPacket.create_syn()
+        self.gbn_window.append(package)
+        package.tick()
+        self._send(package)
+        self._arm_retransmission_timer()
+
+        await self.established
+
+    async def connect_ex(self, address):
+        await self.connect(address)
+
+    async def send(self, data: bytes):
+        """
+        Send data to the socket.
+
+        Waits for space in the window instead of buffering, so the app can't get ahead of the
+        network
+        """
+        assert isinstance(data, bytes)
+        for chunk in chunked(data, self.MAX_PACKET_SIZE - UDPPacket.HEADER_SIZE):
+            while len(self.gbn_window) >= self.window_size and not self.closed:
+                self.window_event.clear()
+                await self.window_event.wait()
+            if self.closed:
+                raise ConnectionError(f"Connection {self.id} is closed")
+            self.seq_n += 1
+            pkg = UDPPacket.create_data(self.seq_n, self.r_seq_n, chunk)
+            self.gbn_window.append(pkg)
+            self._send(pkg)
+            self._arm_retransmission_timer()
+        return len(data)
+
+    async def recv(self, bufsize: int):
+        """
+        Receive data from socket
+
+        Waits until the receive buffer has data. Returns b'' once the connection is closed
+        """
+        await self._wait_readable()
+        return self.app_recv_buffer.read(bufsize)
+
+    async def recv_into(self, buffer, nbytes=0):
+        """
+        Receive up to `nbytes` (or `len(buffer)` if 0) bytes from socket into `buffer`. Returns the
+        amount of bytes received
+        """
+        await self._wait_readable()
+        return self.app_recv_buffer.read_into(buffer, nbytes)
+
+    async def _wait_readable(self):
+        while not self.app_recv_buffer and not self.closed:
+            self.recv_event.clear()
+            await self.recv_event.wait()
+
+    async def close(self):
+        if self.listening:
+            self._shutdown()
+            return
+
+        while self.gbn_window and not self.closed:
+            self.window_event.clear()
+            await self.window_event.wait()
+        if self.closed:
+            return
+
+        if self.unacked_segments:
+            # The delayed ACK would be cancelled with the connection: the peer would keep
+            # retransmitting the last segments it sent
+            self._send_ack()
+        package = UDPPacket.create_fin()
+        self.gbn_window.append(package)
+        package.tick()
+        self._send(package)
+        self._arm_retransmission_timer()
+
+        # Client must notify the server, but server is not obliged to recieve FIN+ACK
+        if not self.server_mode:
+            self.finished = asyncio.get_running_loop().create_future()
+            logger.info("Waiting for connection closure")
+            await self.finished
+            logger.info("Connection Finished")
+
+    def getpeername(self):
+        """
+        Returns the address of the remote host
+        """
+        if self.peer_address:
+            return self.peer_address
+        return self.transport.get_extra_info('peername') if self.transport else None
+
+    def getsockname(self):
+        """
+        Returns the addres the sock is binded to
+        """
+        return self.transport.get_extra_info('sockname') if self.transport else None
+
+    def _send(self, package):
+        if not self.closed:
+            self.transport.sendto(package.to_bytes(), self.peer_address)
+
+    def _datagram_received(self, data, address):
+        try:
+            packet = UDPPacket.from_bytes(data)
+        except ValueError as e:
+            logger.debug(f"Discarding datagram from {address}: {e}")
+            return
+        logger.info("Received from %r, packet %r", address, packet)
+        if not self.listening:
+            self._handle_packet(packet)
+            return
+
+        conn = self.connections.get(address)
+        if conn:
+            conn._handle_packet(packet)
+        elif packet.is_syn():
+            conn = self._new_connection(address)
+            conn._open()
+            self.new_connections_queue.put_nowait((conn, address))
+        else:
+            logger.info("Packet is not SYN, therefore should not be able to set a connection")
+
+    def _new_connection(self, remote_address):
+        """
+        Returns a new connection with `remote_address` served through the listening endpoint
+        """
+        estimator = self.rtt_estimator
+        conn = AsyncReliableUDPSocket(window_size=self.window_size, rto=estimator.initial_rto,
+                                      arq=self.arq, min_rto=estimator.min_rto,
+                                      max_rto=estimator.max_rto, ack_every=self.ack_every,
+                                      ack_delay=self.ack_delay)
+        conn.transport = self.transport
+        conn.peer_address = remote_address
+        conn.listener = self
+        conn.server_mode = True
+        conn.id = f"Server: {remote_address[0]}:{remote_address[1]}"
+        self.connections[remote_address] = conn
+        return conn
+
+    def _open(self):
+        """
+        Server: a client sent a SYN, we must send the due SYN+ACK
+        """
+        self.connection_status = STATUS_SYN
+        synack_pkg = UDPPacket.create_synack()
+        self._send(synack_pkg)
+        logger.info("sent SYN+ACK package %r", synack_pkg)
+
+    def _handle_packet(self, packet):
+        """
+        Connection's state machine, processes a package received from the remote host
+        """
+        if self.closed:
+            return
+
+        if self.server_mode and packet.is_syn() and self.connection_status == STATUS_SYN:
+            # Duplicate SYN, our SYN+ACK might have been lost
+            self._send(UDPPacket.create_synack())
+        elif self.server_mode and packet.is_ack() and packet.ack_n == 0 and self.connection_status == STATUS_SYN:
+            # Server receives an ACK (to its SYN+ACK)
+            self.connection_status = STATUS_ESTABLISHED
+        elif not self.server_mode and packet.is_synack() and self.connection_status == STATUS_SYN:
+            # Client receives a SYN+ACK
+            syns = [p for p in self.gbn_window if p.is_syn()]
+            for pkg in syns:
+                self.gbn_window.remove(pkg)
+                if not pkg.retransmitted:
+                    self.rtt_estimator.sample(time.time() - pkg.time)
+            self.connection_status = STATUS_ESTABLISHED
+            self._send(UDPPacket.create_ack(0, 0))
+            if not self.established.done():
+                self.established.set_result(None)
+        elif packet.is_ack() and self.connection_status == STATUS_ESTABLISHED:
+            self._handle_ack(packet)
+        elif packet.is_data():
+            if self.connection_status == STATUS_SYN and self.server_mode:
+                # We might have lost the client's ACK of the three way handshake
+                if packet.seq_n != 1:
+                    return
+                self.connection_status = STATUS_ESTABLISHED
+            self._handle_data(packet)
+        elif self.server_mode and packet.is_fin() and self.connection_status == STATUS_ESTABLISHED:
+            # Server receives a FIN
+            self._send(UDPPacket.create_finack())
+            self._finish_transmission()
+        elif not self.server_mode and packet.is_finack() and self.connection_status == STATUS_ESTABLISHED:
+            # Client receives FIN+ACK
+            fins = [p for p in self.gbn_window if p.is_fin()]
+            if not fins:
+                return
+            self.gbn_window.remove(fins[0])
+            self._finish_transmission()
+            if self.finished and not self.finished.done():
+                self.finished.set_result(None)
+        else:
+            logger.debug("Bad Package")
+
+    def _handle_ack(self, packet):
+        """
+        ACKs are cumulative, every package up to `ack_n` is acknowledged. Selective Repeat
+        receivers also acknowledge on its own the package received out of order that triggered
+        the ACK
+        """
+        segment = packet.options.get(OPTION_SEGMENT_ACK)
+        if segment is not None:
+            seq_n, = SEQ_N_OPTION.unpack(segment)
+            for pkg in self.gbn_window:
+                if pkg.seq_n == seq_n and pkg.is_data():
+                    pkg.acked = True
+                    break
+        acked = []
+        for pkg in self.gbn_window:
+            if pkg.seq_n > packet.ack_n:
+                break
+            if not pkg.is_data() or pkg.acked:
+                continue
+            pkg.acked = True
+            acked.append(pkg)
+        if not acked:
+            return
+
+        # Karn's rule, retransmitted packages are ambiguous and can't be sampled
+        sampled = [p for p in acked if p.seq_n == packet.ack_n and not p.retransmitted]
+        if sampled:
+            self.rtt_estimator.sample(time.time() - sampled[0].time)
+
+        while self.gbn_window and self.gbn_window[0].acked:
+            self.gbn_window.pop(0)
+        self.window_event.set()
+        self._arm_retransmission_timer()
+
+    def _handle_data(self, packet):
+        """
+        ACKs are cumulative. Every `ack_every` segments received in order are acknowledged, or
+        `ack_delay` after the first of them. Gap fills, already processed packages (our ACK might
+        have been lost) and the ones out of order are acknowledged right away
+        """
+        segment = None
+        if self.r_seq_n + 1 == packet.seq_n:
+            self.r_seq_n += 1
+            self.unacked_segments += 1
+            self.app_recv_buffer.append(packet.payload)
+            # Selective Repeat: the package may fill a gap
+            while self.r_seq_n + 1 in self.out_of_order_buffer:
+                self.r_seq_n += 1
+                self.app_recv_buffer.append(self.out_of_order_buffer.pop(self.r_seq_n))
+            self.recv_event.set()
+            if self.receiving_gap:
+                self.receiving_gap = False
+            elif self.unacked_segments < self.ack_every:
+                if self.ack_timer is None:
+                    loop = asyncio.get_running_loop()
+                    self.ack_timer = loop.call_later(self.ack_delay, self._on_ack_timeout)
+                return
+        elif packet.seq_n > self.r_seq_n + 1:
+            if self.arq == ARQ_SELECTIVE_REPEAT:
+                if packet.seq_n > self.r_seq_n + self.window_size:
+                    return
+                # Kept until the gap is filled, and acknowledged on its own so the sender doesn't
+                # retransmit it
+                self.out_of_order_buffer[packet.seq_n] = packet.payload
+                segment = packet.seq_n
+            self.receiving_gap = True
+        self._send_ack(segment)
+
+    def _send_ack(self, segment=None):
+        """
+        Acknowledges every package received in order so far and, on its own, the `segment`
+        received out of order if there's one. There are no SACK blocks
+        """
+        self.unacked_segments = 0
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        options = {OPTION_SEGMENT_ACK: SEQ_N_OPTION.pack(segment)} if segment is not None else None
+        self._send(UDPPacket.create_ack(self.seq_n, self.r_seq_n, options))
+
+    def _on_ack_timeout(self):
+        self.ack_timer = None
+        if not self.closed and self.unacked_segments:
+            self._send_ack()
+
+    def _retransmission_deadline(self):
+        pending = [p.time for p in self.gbn_window if not p.acked]
+        if not pending:
+            return None
+        return min(pending) + self.rto
+
+    def _arm_retransmission_timer(self):
+        """
+        Makes sure the retransmission timer fires no later than the oldest unacknowledged package
+        expires. A timer firing earlier than needed just re-arms itself
+        """
+        deadline = self._retransmission_deadline()
+        if deadline is None or self.closed:
+            return
+        loop = asyncio.get_running_loop()
+        when = loop.time() + max(0, deadline - time.time())
+        if self.rtx_timer is not None:
+            if not self.rtx_timer.cancelled() and self.rtx_timer.when() <= when:
+                return
+            self.rtx_timer.cancel()
+        self.rtx_timer = loop.call_at(when, self._on_retransmission_timeout)
+
+    def _on_retransmission_timeout(self):
+        self.rtx_timer = None
+        rto = self.rto
+        pending = [p for p in self.gbn_window if not p.acked]
+        if self.arq == ARQ_SELECTIVE_REPEAT:
+            to_retransmit = [p for p in pending if p.expired(rto)]
+        elif any(p.expired(rto) for p in pending):
+            to_retransmit = pending
+        else:
+            to_retransmit = []
+
+        for packet in to_retransmit:
+            logger.debug(f'[{self.id}] retransmitting %r due to timeout', packet)
+            packet.tick()
+            packet.retransmitted = True
+            self._send(packet)
+        if to_retransmit:
+            self.rtt_estimator.backoff()
+        self._arm_retransmission_timer()
+
+    def _finish_transmission(self):
+        """
+        The server keeps answering retransmitted FINs for a while, the client is done
+        """
+        self.stop_transmission = True
+        if self.linger_timer is None:
+            lingering_timeouts = self.desconnected_timeouts if self.server_mode else 0
+            loop = asyncio.get_running_loop()
+            self.linger_timer = loop.call_later(lingering_timeouts * self.rto, self._shutdown)
+
+    def _shutdown(self):
+        """
+        Stops the connection: cancels its timers, releases the endpoint and wakes up the app
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for timer in (self.rtx_timer, self.linger_timer, self.ack_timer):
+            if timer is not None:
+                timer.cancel()
+        if self.listener:
+            self.listener.connections.pop(self.peer_address, None)
+        elif self.transport:
+            self.transport.close()
+        for conn in list(self.connections.values()):
+            conn._shutdown()
+        self.recv_event.set()
+        self.window_event.set()
+        for future in (self.established, self.finished):
+            if future is not None and not future.done():
+                future.set_exception(ConnectionError(f"Connection {self.id} is closed"))
@@ -0,0 +1,228 @@
+"""
+Content-addressed storage: files are split into chunks at boundaries set by their content, and
+every chunk is stored once, named by its hash
+
+Boundaries come from a gear rolling hash (FastCDC): a chunk ends where the hash of its last bytes
+matches a mask, so an insertion only changes the chunks around it and the same content makes the
+same chunks in any file. A stored file is a manifest, the list of its chunks. Uploads offer the
+hashes of their chunks first and only send the ones the store lacks.
+"""
+import io
+import os
+import mmap
+import json
+import zlib
+import struct
+import hashlib
+from bisect import bisect_right
+from itertools import accumulate
+from threading import get_ident
+
+CHUNKS_DIR = '.chunks'
+MANIFESTS_DIR = '.manifests'
+MIN_CHUNK_SIZE = 16 * 1024  # Bytes
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+HASH_SIZE = 32  # SHA-256
+MAX_CHUNKS = 1 << 20  # Per file, longer chunk lists are rejected
+
+# Chunk list of an upload: size of the file and amount of chunks, then hash and length of each
+CHUNK_LIST_HEADER = struct.Struct('!QI')
+CHUNK_ENTRY = struct.Struct(f'!{HASH_SIZE}sI')
+# Chunks the server lacks: their amount, then the index of each one in the chunk list
+CHUNK_INDEX = struct.Struct('!I')
+
+# Random value per byte, the same everywhere so the same content is always cut the same way
+GEAR = [int.from_bytes(hashlib.blake2b(bytes([byte]), digest_size=8).digest(), 'big')
+        for byte in range(256)]
+HASH_MASK = (1 << 64) - 1
+# Normalized chunking: harder to cut before the average size, easier after it
+MASK_SMALL = ((1 << 18) - 1) << 46
+MASK_LARGE = ((1 << 14) - 1) << 50
+
+
+def chunk_hash(data):
+    return hashlib.sha256(data).digest()
+
+
+def cut_point(data):
+    """
+    Length of the chunk at the start of `data`, at most MAX_CHUNK_SIZE bytes of the file
+    """
+    size = len(data)
+    if size <= MIN_CHUNK_SIZE:
+        return size
+    normal = min(size, AVG_CHUNK_SIZE)
+    limit = min(size, MAX_CHUNK_SIZE)
+    gear_hash = 0
+    # The bytes before the minimum size can't end a chunk, they aren't hashed
+    for position in range(MIN_CHUNK_SIZE, normal):
+        gear_hash = ((gear_hash << 1) + GEAR[data[position]]) & HASH_MASK
+        if not gear_hash & MASK_SMALL:
+            return position + 1
+    for position in range(normal, limit):
+        gear_hash = ((gear_hash << 1) + GEAR[data[position]]) & HASH_MASK
+        if not gear_hash & MASK_LARGE:
+            return position + 1
+    return limit
+
+
+def chunk_file(file):
+    """
+    Chunks of `file`, opened in binary mode
+    :return: list of (offset, length, hash)
+    """
+    size = os.fstat(file.fileno()).st_size
+    if not size:
+        return []
+    chunks = []
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        offset = 0
+        while offset < size:
+            # Sliced into bytes, iterating them is much faster than indexing the mapping
+            data = mapping[offset:offset + MAX_CHUNK_SIZE]
+            length = cut_point(data)
+            chunks.append((offset, length, chunk_hash(data[:length])))
+            offset += length
+    return chunks
+
+
+class ChunkStore:
+    """
+    Chunks and manifests of the files stored under `root`
+    """
+    def __init__(self, root):
+        self.chunks_dir = os.path.join(root, CHUNKS_DIR)
+        self.manifests_dir = os.path.join(root, MANIFESTS_DIR)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+
+    def chunk_path(self, digest):
+        name = digest.hex()
+        return os.path.join(self.chunks_dir, name[:2], name[2:])
+
+    def manifest_path(self, name):
+        return os.path.join(self.manifests_dir, os.path.basename(name) + '.json')
+
+    def missing(self, chunks):
+        """
+        Indexes of the `chunks`, (hash, length), that aren't stored. Repeated chunks only once
+        """
+        missing = []
+        seen = set()
+        for index, (digest, _) in enumerate(chunks):
+            if digest not in seen and not os.path.exists(self.chunk_path(digest)):
+                missing.append(index)
+            seen.add(digest)
+        return missing
+
+    def put(self, digest, data):
+        """
+        Stores the chunk. Raises ValueError if `data` doesn't match `digest`
+        """
+        if chunk_hash(data) != digest:
+            raise ValueError(f"Chunk {digest.hex()} doesn't match its hash")
+        path = self.chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written aside, another upload may be storing the same chunk
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, 'wb') as chunk:
+            chunk.write(data)
+        os.replace(tmp_path, path)
+
+    def read(self, digest):
+        with open(self.chunk_path(digest), 'rb') as chunk:
+            return chunk.read()
+
+    def save_manifest(self, name, size, chunks):
+        """
+        Stores the file `name` as the list of its `chunks`, (hash, length)
+        """
+        manifest = {"size": size, "chunks": [[digest.hex(), length] for digest, length in chunks]}
+        path = self.manifest_path(name)
+        tmp_path = f"{path}.{os.getpid()}.{get_ident()}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, path)
+
+    def remove_manifest(self, name):
+        """
+        Forgets the file `name`, its chunks stay for other files
+        """
+        try:
+            os.remove(self.manifest_path(name))
+        except FileNotFoundError:
+            pass
+
+    def open(self, name):
+        """
+        ChunkedFile to read the file `name`, None if it isn't stored
+        """
+        try:
+            with open(self.manifest_path(name)) as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            return None
+        chunks = [(bytes.fromhex(digest), length) for digest, length in manifest["chunks"]]
+        return ChunkedFile(self, manifest["size"], chunks)
+
+    def prefix_matches(self, name, length, crc):
+        """
+        Whether the first `length` bytes of the file `name` have the given CRC-32
+        """
+        file = self.open(name)
+        if file is None or file.size < length:
+            return False
+        computed = 0
+        with file:
+            while length:
+                data = file.read(length)
+                computed = zlib.crc32(data, computed)
+                length -= len(data)
+        return computed == crc
+
+
+class ChunkedFile(io.RawIOBase):
+    """
+    Read-only file rebuilt from its chunks as it is read, one chunk in memory at a time
+    """
+    def __init__(self, store, size, chunks):
+        super().__init__()
+        self.store = store
+        self.size = size
+        self.chunks = chunks  # [(hash, length)]
+        self.offsets = list(accumulate((length for _, length in chunks), initial=0))
+        self.position = 0
+        self.current = (None, b'')  # Index and data of the chunk read last
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.position = offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size:
+            return 0
+        index = bisect_right(self.offsets, self.position) - 1
+        if self.current[0] != index:
+            self.current = (index, self.store.read(self.chunks[index][0]))
+        data = self.current[1]
+        start = self.position - self.offsets[index]
+        nbytes = min(len(buffer), len(data) - start)
+        buffer[:nbytes] = data[start:start + nbytes]
+        self.position += nbytes
+        return nbytes
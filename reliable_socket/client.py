@@ -1,13 +1,25 @@
-from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket, ReliableTCPSocket
-import json
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket, ReliableTCPSocket, \
+    ARQ_SELECTIVE_REPEAT
+from reliable_socket.async_reliable_transfer_protocol import AsyncReliableUDPSocket
+from reliable_socket.file_transfer import recv_to_file, recv_exact, recv_range, \
+    FILE_BUFFER_SIZE
+from reliable_socket.resume import PartialFile, OFFSET, prefix_matches, load_state
+from reliable_socket.striping import split_ranges, open_striped, STRIPE_CHUNK_SIZE, STRIPED_SUFFIX
+from reliable_socket.compression import send_compressed, recv_compressed
+from reliable_socket.delta import Signature, send_delta
+from reliable_socket.chunk_store import chunk_file, CHUNK_LIST_HEADER, CHUNK_ENTRY, CHUNK_INDEX
+from reliable_socket.directory import scan, pack_manifest, recv_manifest, recv_indexes, \
+    send_entries, recv_entries
+from reliable_socket.protocol import Request, Response, OP_UPLOAD, OP_DOWNLOAD, \
+    OP_UPLOAD_RANGE, OP_DOWNLOAD_RANGE, OP_UPLOAD_DELTA, OP_UPLOAD_CHUNKS, OP_STAT, OP_UPLOAD_DIR, OP_DOWNLOAD_DIR, OP_BYE
+from threading import Thread, Lock
+from contextlib import contextmanager
 import os
 from tqdm import tqdm
 import logging
 
 
-BUFFER_SIZE = 1024
-MODE_UPLOAD = 'upload'
-MODE_DOWNLOAD = 'download'
+BUFFER_SIZE = 1024  # Bytes of file data per send of the asyncio client
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - [%(threadName)s] - %(message)s')
@@ -16,89 +28,529 @@ logger.setLevel(logging.ERROR)
 
 
 class Client():
-    def __init__(self, path, filename, host, port=6000):
+    def __init__(self, path, filename, host, port=6000, buffer_size=FILE_BUFFER_SIZE, stripes=1,
+                 chunk_size=STRIPE_CHUNK_SIZE, compression=None, delta=False,
+                 dedup=False):
         self.host = host
         self.port = port
-        self.socket = ReliableTCPSocket()
+        # Opens the sockets of the transfer, more than one if it's striped
+        self.new_socket = ReliableTCPSocket
+        self.socket = self.new_socket()
         self.path = path
         self.filename = filename
+        # Bytes of file data moved per call
+        self.buffer_size = buffer_size
+        # Connections of the transfer, each one moves a range of the file
+        self.stripes = stripes
+        self.chunk_size = chunk_size
+        # Codec offered to the server, None to send the data raw
+        self.compression = compression
+        # Uploads send the delta against the copy of the server
+        self.delta = delta
+        # Uploads offer the chunks of the file, and send the ones the server lacks
+        self.dedup = dedup
+        # Transfers share the connection of the session while it's open
+        self.in_session = False
 
     def set_sw_socket(self):
-        self.socket = ReliableUDPSocket(window_size = 1)
+        self.new_socket = lambda: ReliableUDPSocket(window_size = 1)
+        self.socket = self.new_socket()
 
     def set_gbn_socket(self):
-        self.socket = ReliableUDPSocket(window_size = 4)
+        self.new_socket = ReliableUDPSocket
+        self.socket = self.new_socket()
+
+    def set_sr_socket(self):
+        self.new_socket = lambda: ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT)
+        self.socket = self.new_socket()
 
     def __connect(self):
         self.socket.connect((self.host, self.port))
 
-    def __close_conection(self):
-        self.socket.close()
+    def __hang_up(self, sock):
+        """
+        Tells the server the session of `sock` is over, then closes it
+        """
+        try:
+            Request(OP_BYE).send(sock)
+        except OSError:
+            logger.info("Connection lost before ending the session")
+        sock.close()
+
+    def open(self):
+        """
+        Opens a session: the transfers that follow share its connection until `close`
+        """
+        self.__connect()
+        self.in_session = True
+
+    def close(self):
+        """
+        Ends the session. The client can open another one
+        """
+        if self.in_session:
+            self.in_session = False
+            self.__hang_up(self.socket)
+            self.socket = self.new_socket()
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
 
-    def __send_message(self, message):
-        self.socket.send(message.encode())
-        rcv_packet = self.socket.recv(BUFFER_SIZE)
-        response = json.loads(rcv_packet.decode())
-        return response
+    @contextmanager
+    def __transfer(self):
+        """
+        Connection of a transfer: the one of the session, or a session of its own
+        """
+        if self.in_session:
+            yield
+            return
+        self.open()
+        try:
+            yield
+        finally:
+            self.close()
+
+    def __request(self, op, size=0, offset=0, sock=None, **options):
+        """
+        Sends the request for the file and waits for its response, a single round trip
+        """
+        sock = sock or self.socket
+        Request(op, self.filename, size, offset, options).send(sock)
+        return Response.recv(sock)
+
+    def __run_stripes(self, target, stripes):
+        """
+        Runs `target(sock, index)` for every stripe, each one on its own thread. The first stripe
+        goes on the connection of the session, the rest on connections of their own
+        """
+        def run_stripe(index):
+            if index == 0:
+                return target(self.socket, index)
+            sock = self.new_socket()
+            try:
+                sock.connect((self.host, self.port))
+                target(sock, index)
+            finally:
+                self.__hang_up(sock)
+
+        threads = [Thread(target=run_stripe, args=(index,), name=f"Stripe-{index}")
+                   for index in range(stripes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
 
     def __open_file(self):
+        path = f"{self.path}/{self.filename}"
         try:
-            path = f"{self.path}/{self.filename}"
-            file_to_send = open(path, 'rb')
-            return file_to_send
+            return open(path, 'rb')
         except FileNotFoundError:
-            logger.info(f"File not found at {path}. Won't connect to server.")
-            exit()
+            logger.info(f"File not found at {path}. Won't upload it.")
+            return None
 
-    def upload(self):
+    def __resume_offset(self, response):
+        """
+        Byte the upload starts at: where the partial copy of the server ends, as long as it is a
+        prefix of our file
+        """
+        offset, crc = response.offset, response.options.get("crc", 0)
+        if offset and prefix_matches(f"{self.path}/{self.filename}", offset, crc):
+            return offset
+        return 0
+
+    def upload(self, filename=None):
+        """
+        Uploads the file, `filename` if given, on the connection of the session if one is open
+        """
+        if filename is not None:
+            self.filename = filename
         file_to_send = self.__open_file()
+        if file_to_send is None:
+            return
+        size = os.fstat(file_to_send.fileno()).st_size
+        ranges = split_ranges(size, self.stripes, self.chunk_size)
+        if not (self.delta or self.dedup) and len(ranges) > 1:
+            file_to_send.close()
+            return self.__upload_striped(size, ranges)
 
-        self.__connect()
-        res_mode = self.__send_message(MODE_UPLOAD)  # seteo modo
-        res_filename = self.__send_message(self.filename)  # mando nombre
-        size = os.path.getsize(f"{self.path}/{self.filename}")
-        res_file_size = self.__send_message(str(size))  # mando tamaño
+        with file_to_send, self.__transfer():
+            if self.delta:
+                self.__upload_delta(file_to_send, size)
+            elif not (self.dedup and self.__upload_chunks(file_to_send, size)):
+                self.__upload_whole(file_to_send, size)
 
-        if(res_mode['code'] == res_filename['code'] == res_file_size['code'] == 200):
-            # file_to_send = open(f"{self.path}/{self.filename}", 'rb')
+    def __upload_whole(self, file_to_send, size):
+        options = {"compression": [self.compression]} if self.compression else {}
+        response = self.__request(OP_UPLOAD, size, **options)
+
+        if response.ok:
+            offset = self.__resume_offset(response)
+            codec = response.options.get("compression")
+            logger.info(f"Uploading from byte {offset}")
+            self.socket.sendall(OFFSET.pack(offset))
+            progress_bar = tqdm(total = size, initial = offset)
+            if codec:
+                stats = send_compressed(self.socket, file_to_send, codec, offset,
+                                        callback=progress_bar.update)
+                progress_bar.set_postfix(ratio=f"{stats.ratio:.2f}")
+                logger.info(f"Upload: {stats}")
+            else:
+                # The socket reads the file itself, without going through a buffer of ours
+                sent = self.socket.sendfile(file_to_send, offset)
+                progress_bar.update(sent)
+            progress_bar.close()
+            logger.info(f"Sending of {self.filename} finished")
+        else:
+            logger.info(f"Upload rejected: {response.message}")
+
+    def __upload_delta(self, file_to_send, size):
+        """
+        Uploads the file as a delta against the copy of the server: the blocks it already has
+        are referenced instead of sent
+        """
+        response = self.__request(OP_UPLOAD_DELTA, size)
+
+        if response.ok:
+            # The signature of the copy of the server, empty if it has none
+            signature = Signature.recv(self.socket)
             progress_bar = tqdm(total = size)
-            while(True):
+            literal, copied = send_delta(self.socket, file_to_send, signature,
+                                         progress_bar.update)
+            progress_bar.close()
+            response = Response.recv(self.socket)
+            if response.ok:
+                logger.info(f"Delta upload finished: {literal} bytes sent, {copied} copied")
+            else:
+                logger.info(f"Delta upload failed: {response.message}")
+
+    def __upload_chunks(self, file_to_send, size):
+        """
+        Uploads the file to the deduplicating storage of the server: lists the chunks of the file
+        along with the request and sends only the ones the storage lacks, consecutive ones in a
+        single sendfile. Returns False if the server doesn't take chunks
+        """
+        chunks = chunk_file(file_to_send)
+        Request(OP_UPLOAD_CHUNKS, self.filename, size).send(self.socket)
+        self.socket.sendall(CHUNK_LIST_HEADER.pack(size, len(chunks)) + b''.join(
+            CHUNK_ENTRY.pack(digest, length) for _, length, digest in chunks))
+        response = Response.recv(self.socket)
+        if not response.ok:
+            logger.info(f"{response.message}, uploading the whole file")
+            # Nor will it for the rest of the files
+            self.dedup = False
+            return False
+
+        count, = CHUNK_INDEX.unpack(recv_exact(self.socket, CHUNK_INDEX.size))
+        missing = [index for index, in CHUNK_INDEX.iter_unpack(
+            recv_exact(self.socket, count * CHUNK_INDEX.size))]
+        progress_bar = tqdm(total = sum(chunks[index][1] for index in missing))
+        # Runs of consecutive chunks, (offset, length)
+        runs = []
+        for index in missing:
+            offset, length, _ = chunks[index]
+            if runs and sum(runs[-1]) == offset:
+                runs[-1] = (runs[-1][0], runs[-1][1] + length)
+            else:
+                runs.append((offset, length))
+        for offset, length in runs:
+            progress_bar.update(self.socket.sendfile(file_to_send, offset, length))
+        progress_bar.close()
+        response = Response.recv(self.socket)
+        if response.ok:
+            logger.info(f"Upload finished: {response.options['sent']} of "
+                        f"{response.options['chunks']} chunks sent")
+        else:
+            logger.info(f"Upload failed: {response.message}")
+        return True
+
+    def __upload_striped(self, size, ranges):
+        """
+        Uploads every range of the file on its own connection. The server puts the file in place
+        once all of them arrived
+        """
+        path = f"{self.path}/{self.filename}"
+        progress_bar = tqdm(total = size)
+
+        def upload_range(sock, index):
+            offset, count = ranges[index]
+            response = self.__request(OP_UPLOAD_RANGE, size, offset, sock, count=count)
+            if not response.ok:
+                logger.info(f"Range [{offset}, {offset + count}) rejected: {response.message}")
+                return
+            with open(path, 'rb') as file:
+                progress_bar.update(sock.sendfile(file, offset, count))
+
+        with self.__transfer():
+            self.__run_stripes(upload_range, len(ranges))
+        progress_bar.close()
+        logger.info(f"Sending of {self.filename} finished")
+
+    def __download_striped(self):
+        """
+        Downloads every stripe of the file on its own connection, all of them requested at once.
+        The server splits the file as `split_ranges` does and answers each one with its range.
+        The first response creates the file, preallocated to the size, that is moved in place
+        once all of them arrived
+        """
+        path = f"{self.path}/{self.filename}"
+        progress_bar = tqdm(total = 0)
+        lock = Lock()
+        fd = file_size = None
+        received = [0] * self.stripes
+
+        def download_stripe(sock, index):
+            nonlocal fd, file_size
+            response = self.__request(OP_DOWNLOAD_RANGE, sock=sock, stripe=index,
+                                      stripes=self.stripes, chunk_size=self.chunk_size)
+            if not response.ok:
+                logger.info(f"File: {self.filename} not found")
+                return
+            with lock:
+                if fd is None:
+                    file_size = response.size
+                    fd = open_striped(path, file_size)
+                    progress_bar.reset(total = file_size)
+            received[index] = recv_range(sock, fd, response.offset, response.options["count"],
+                                         self.buffer_size, progress_bar.update)
+
+        try:
+            with self.__transfer():
+                self.__run_stripes(download_stripe, self.stripes)
+        finally:
+            if fd is not None:
+                os.close(fd)
+            progress_bar.close()
+        if fd is None:
+            return
+        if sum(received) == file_size:
+            os.replace(path + STRIPED_SUFFIX, path)
+        else:
+            logger.info(f"Download interrupted, {sum(received)} of {file_size} bytes received")
+
+    def download(self, filename=None):
+        """
+        Downloads the file, `filename` if given, on the connection of the session if one is open
+        """
+        if filename is not None:
+            self.filename = filename
+        if self.stripes > 1:
+            return self.__download_striped()
+        with self.__transfer():
+            self.__download_whole()
+
+    def stat(self, filename=None):
+        """
+        Size and modification time, in nanoseconds, of the file in the server. None if it has no
+        such file
+        """
+        if filename is not None:
+            self.filename = filename
+        with self.__transfer():
+            response = self.__request(OP_STAT)
+        if not response.ok:
+            return None
+        return response.size, response.options["mtime"]
+
+    def upload_dir(self, dirname=None):
+        """
+        Uploads the directory, `dirname` if given, with every file under it. Only the files the
+        server lacks or has with another size or modification time are sent, all of them in a
+        single stream
+        """
+        if dirname is not None:
+            self.filename = dirname
+        root = f"{self.path}/{self.filename}"
+        if not os.path.isdir(root):
+            logger.info(f"Directory not found at {root}. Won't upload it.")
+            return
+        entries = scan(root)
+        with self.__transfer():
+            # The manifest follows the request in the same write
+            name = os.path.basename(os.path.normpath(self.filename))
+            self.socket.sendall(Request(OP_UPLOAD_DIR, name).to_bytes() + pack_manifest(entries))
+            response = Response.recv(self.socket)
+            if not response.ok:
+                logger.info(f"Upload rejected: {response.message}")
+                return
+            indexes = recv_indexes(self.socket)
+            progress_bar = tqdm(total = sum(entries[index][1] for index in indexes))
+            send_entries(self.socket, root, entries, indexes, progress_bar.update)
+            progress_bar.close()
+            response = Response.recv(self.socket)
+        if response.ok:
+            logger.info(f"Upload of {self.filename} finished: {response.options['files']} of "
+                        f"{len(entries)} files sent")
+        else:
+            logger.info(f"Upload failed: {response.message}")
+
+    def download_dir(self, dirname=None):
+        """
+        Downloads the directory, `dirname` if given, with every file under it. Only the files
+        missing here or with another size or modification time are sent, all of them in a single
+        stream
+        """
+        if dirname is not None:
+            self.filename = dirname
+        root = f"{self.path}/{self.filename}"
+        with self.__transfer():
+            # What we have already follows the request in the same write
+            name = os.path.basename(os.path.normpath(self.filename))
+            self.socket.sendall(Request(OP_DOWNLOAD_DIR, name).to_bytes() +
+                                pack_manifest(scan(root)))
+            response = Response.recv(self.socket)
+            if not response.ok:
+                logger.info(response.message)
+                return
+            entries = recv_manifest(self.socket)
+            progress_bar = tqdm(total = response.size)
+            recv_entries(self.socket, root, entries, range(len(entries)), self.buffer_size,
+                         progress_bar.update)
+            progress_bar.close()
+        logger.info(f"Download of {self.filename} finished: {len(entries)} files received")
+
+    def __download_whole(self):
+        path = f"{self.path}/{self.filename}"
+        # What's left of a previous download, the server resumes from there if the checksum
+        # matches its file
+        options = {"compression": [self.compression]} if self.compression else {}
+        offset = 0
+        state = load_state(path)
+        if state is not None:
+            options["size"], offset, options["crc"] = state
+        response = self.__request(OP_DOWNLOAD, offset=offset, **options)
+
+        if response.ok:
+            filesize, offset = response.size, response.offset
+            codec = response.options.get("compression")
+            partial = PartialFile(path, filesize)
+            logger.info(f"Downloading from byte {offset}")
+            recieved_file = partial.open(offset)
+            progress_bar = tqdm(total = filesize, initial = offset)
+
+            def on_write(nbytes):
+                partial.on_write(nbytes)
+                progress_bar.update(nbytes)
+
+            try:
+                if codec:
+                    stats = recv_compressed(self.socket, recieved_file, filesize - offset, codec,
+                                            on_write)
+                    progress_bar.set_postfix(ratio=f"{stats.ratio:.2f}")
+                    logger.info(f"Download: {stats}")
+                else:
+                    # TCP: spliced from the socket into the file inside the kernel
+                    recv_to_file(self.socket, recieved_file, filesize - offset, self.buffer_size,
+                                 on_write)
+            finally:
+                if not partial.finish():
+                    logger.info(f"Download interrupted, {partial.committed} bytes kept to resume")
+                progress_bar.close()
+        else:
+            logger.info(response.message)
+
+
+class AsyncClient():
+    """
+    asyncio counterpart of Client, `upload` and `download` are coroutines
+    """
+    def __init__(self, path, filename, host, port=6000):
+        self.host = host
+        self.port = port
+        # A connection per transfer, opened anew once the previous one is closed
+        self.new_socket = lambda: AsyncReliableUDPSocket()
+        self.socket = self.new_socket()
+        self.path = path
+        self.filename = filename
+
+    def set_sw_socket(self):
+        self.new_socket = lambda: AsyncReliableUDPSocket(window_size = 1)
+        self.socket = self.new_socket()
+
+    def set_gbn_socket(self):
+        self.new_socket = lambda: AsyncReliableUDPSocket()
+        self.socket = self.new_socket()
+
+    def set_sr_socket(self):
+        self.new_socket = lambda: AsyncReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT)
+        self.socket = self.new_socket()
+
+    async def __request(self, op, size=0, offset=0, **options):
+        await Request(op, self.filename, size, offset, options).send_async(self.socket)
+        return await Response.recv_async(self.socket)
+
+    async def __hang_up(self):
+        """
+        Tells the server the session is over, then closes the connection
+        """
+        try:
+            await Request(OP_BYE).send_async(self.socket)
+        except OSError:
+            logger.info("Connection lost before ending the session")
+        await self.socket.close()
+        self.socket = self.new_socket()
+
+    async def upload(self):
+        path = f"{self.path}/{self.filename}"
+        try:
+            file_to_send = open(path, 'rb')
+        except FileNotFoundError:
+            logger.info(f"File not found at {path}. Won't connect to server.")
+            return
+
+        with file_to_send:
+            await self.socket.connect((self.host, self.port))
+            size = os.path.getsize(path)
+            response = await self.__request(OP_UPLOAD, size)
+
+            if response.ok:
+                offset, crc = response.offset, response.options.get("crc", 0)
+                if not (offset and prefix_matches(path, offset, crc)):
+                    offset = 0
+                await self.socket.send(OFFSET.pack(offset))
+                file_to_send.seek(offset)
+                progress_bar = tqdm(total = size, initial = offset)
                 file_buffered = file_to_send.read(BUFFER_SIZE)
-                while(file_buffered):
-                    self.socket.send(file_buffered)
+                while file_buffered:
+                    await self.socket.send(file_buffered)
                     progress_bar.update(len(file_buffered))
-                    # logger.info(progress_bar)
                     file_buffered = file_to_send.read(BUFFER_SIZE)
-                if not file_buffered:
-                    progress_bar.close()
-                    file_to_send.close()
-                    logger.info("Sending finished: closing connection")
-                    self.__close_conection()
-                    break
-
-    def download(self):
-        self.__connect()
-        res_mode = self.__send_message(MODE_DOWNLOAD) # seteo modo
-        res_filename = self.__send_message(self.filename) # pido nombre
-
-        if(res_mode['code'] == res_filename['code'] == 200):
-            filesize = res_filename['msg']
-            data_downloaded = 0
-            self.socket.send("OK".encode())
-            with open(f"{self.path}/{self.filename}", 'wb') as recieved_file:
-                progress_bar = tqdm(total = res_filename['msg'])
-                while True:
-                    data = self.socket.recv(BUFFER_SIZE)
-                    data_downloaded += len(data)
-                    if progress_bar.n < int(filesize):
-                        progress_bar.update(len(data))
-                        # logger.info(progress_bar)
-                    recieved_file.write(data)
-                    if data_downloaded == filesize:
-                        recieved_file.close()
-                        progress_bar.close()
+                progress_bar.close()
+                logger.info("Sending finished: closing connection")
+        await self.__hang_up()
+
+    async def download(self):
+        await self.socket.connect((self.host, self.port))
+        path = f"{self.path}/{self.filename}"
+        options = {}
+        offset = 0
+        state = load_state(path)
+        if state is not None:
+            options["size"], offset, options["crc"] = state
+        response = await self.__request(OP_DOWNLOAD, offset=offset, **options)
+
+        if response.ok:
+            filesize, data_downloaded = response.size, response.offset
+            partial = PartialFile(path, filesize)
+            recieved_file = partial.open(data_downloaded)
+            progress_bar = tqdm(total = filesize, initial = data_downloaded)
+            try:
+                buffer = memoryview(bytearray(BUFFER_SIZE))
+                while data_downloaded < filesize:
+                    read = await self.socket.recv_into(buffer, min(BUFFER_SIZE, filesize - data_downloaded))
+                    if not read:
                         break
-        elif(res_mode['code'] == "400"):
-            logger.info(f"File: {self.filename} not found")
+                    data_downloaded += read
+                    progress_bar.update(read)
+                    recieved_file.write(buffer[:read])
+                    partial.on_write(read)
+            finally:
+                partial.finish()
+                progress_bar.close()
+        else:
+            logger.info(response.message)
         logger.info("connection closed")
-        self.__close_conection()
+        await self.__hang_up()
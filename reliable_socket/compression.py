@@ -0,0 +1,170 @@
+"""
+Compression of the file data, negotiated per transfer in the request and its response
+
+The data goes as frames: a header with flags and the length of the payload, then the payload,
+compressed with the codec of the transfer or raw. Every frame is compressed on its own, so the
+sender can stop compressing at any point: once the first frames are sampled, the rest go raw if
+the data doesn't compress. Frames are compressed on a worker thread, while the previous ones are
+on their way.
+"""
+import bz2
+import lzma
+import zlib
+import time
+import struct
+from queue import Queue, Empty
+from threading import Thread, Event
+
+from reliable_socket.file_transfer import recv_exact
+
+# name: (compress, decompress). Fast presets, the network shouldn't wait for the CPU
+CODECS = {
+    'zlib': (lambda data: zlib.compress(data, 6), zlib.decompress),
+    'bz2': (lambda data: bz2.compress(data, 1), bz2.decompress),
+    'lzma': (lambda data: lzma.compress(data, preset=1), lzma.decompress),
+}
+CODEC_NAMES = tuple(CODECS)
+
+FRAME = struct.Struct('!BI')  # flags, payload length
+FLAG_COMPRESSED = 1
+COMPRESSION_CHUNK_SIZE = 256 * 1024  # Bytes of the file per frame
+SAMPLE_FRAMES = 4  # Frames sampled before deciding if the data is worth compressing
+MAX_RATIO = 0.9  # Compressed / raw size of the sample above which compression is turned off
+QUEUED_FRAMES = 4  # Frames compressed ahead of the network
+
+
+def choose_codec(offered):
+    """
+    First codec of the ones `offered` by the peer that is known here, None if there's none
+    """
+    for name in offered or ():
+        if name in CODECS:
+            return name
+    return None
+
+
+class TransferStats:
+    """
+    Bytes of a compressed transfer, of the file and on the wire, and its throughput
+    """
+    def __init__(self, codec):
+        self.codec = codec
+        self.raw_bytes = 0
+        self.wire_bytes = 0
+        self.start = time.monotonic()
+        self.elapsed = 0
+
+    def __str__(self):
+        return (f"{self.raw_bytes} bytes in {self.wire_bytes} with {self.codec}, ratio "
+                f"{self.ratio:.2f}, {self.throughput / 1e6:.1f} MB/s")
+
+    def add(self, raw_bytes, wire_bytes):
+        self.raw_bytes += raw_bytes
+        self.wire_bytes += wire_bytes
+        self.elapsed = time.monotonic() - self.start
+
+    @property
+    def ratio(self):
+        """
+        Raw / wire size, how many times smaller the data got
+        """
+        return self.raw_bytes / self.wire_bytes if self.wire_bytes else 1.0
+
+    @property
+    def throughput(self):
+        """
+        Bytes of the file moved per second
+        """
+        return self.raw_bytes / self.elapsed if self.elapsed else 0.0
+
+
+def send_compressed(sock, file, codec, offset=0, count=None, chunk_size=COMPRESSION_CHUNK_SIZE,
+                    callback=None):
+    """
+    Sends `file`, opened in binary mode, from `offset` up to `count` bytes (the end of the file
+    by default) as frames compressed with `codec`. `callback` is called with the amount of bytes
+    of the file of every frame sent. Returns the TransferStats
+    """
+    frames = Queue(QUEUED_FRAMES)
+    stopped = Event()
+    worker = Thread(target=_compress_frames, args=(file, codec, offset, count, chunk_size, frames,
+                                                   stopped), name="Compressor", daemon=True)
+    stats = TransferStats(codec)
+    worker.start()
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            raw_size, frame = item
+            sock.sendall(frame)
+            stats.add(raw_size, len(frame))
+            if callback:
+                callback(raw_size)
+    finally:
+        # Unblocks the worker if sending failed
+        stopped.set()
+        while worker.is_alive():
+            try:
+                frames.get(timeout=0.1)
+            except Empty:
+                pass
+    return stats
+
+
+def recv_compressed(sock, file, count, codec, callback=None):
+    """
+    Writes into `file` the `count` bytes sent by `send_compressed`, or as many as arrive before
+    the connection is closed. `callback` is called with the amount of bytes of every write.
+    Returns the TransferStats
+    """
+    decompress = CODECS[codec][1]
+    stats = TransferStats(codec)
+    while stats.raw_bytes < count:
+        try:
+            flags, length = FRAME.unpack(recv_exact(sock, FRAME.size))
+            payload = recv_exact(sock, length)
+        except ConnectionError:
+            break
+        data = decompress(payload) if flags & FLAG_COMPRESSED else payload
+        file.write(data)
+        stats.add(len(data), FRAME.size + length)
+        if callback:
+            callback(len(data))
+    return stats
+
+
+def _compress_frames(file, codec, offset, count, chunk_size, frames, stopped):
+    """
+    Worker of `send_compressed`: puts (raw size, frame) in `frames`, then None once the file is
+    read
+    """
+    compress = CODECS[codec][0]
+    try:
+        file.seek(offset)
+        remaining = count
+        sampled = sample_raw = sample_wire = 0
+        compressing = True
+        while not stopped.is_set() and (remaining is None or remaining > 0):
+            data = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            flags, payload = 0, data
+            if compressing:
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    flags, payload = FLAG_COMPRESSED, compressed
+                if sampled < SAMPLE_FRAMES:
+                    sampled += 1
+                    sample_raw += len(data)
+                    sample_wire += len(payload)
+                    # Incompressible data, the CPU time would only slow the transfer down
+                    compressing = sampled < SAMPLE_FRAMES or sample_wire <= MAX_RATIO * sample_raw
+            frames.put((len(data), FRAME.pack(flags, len(payload)) + payload))
+        frames.put(None)
+    except Exception as e:
+        frames.put(e)
@@ -0,0 +1,75 @@
+"""
+Congestion Control algorithms for the Reliable Transfer Protocol
+
+A CongestionController decides how many packages may be in flight (`window`), the sender never
+moves more packages from its buffer into the window than that. Windows are measured in packages.
+"""
+from abc import ABC, abstractmethod
+
+INITIAL_CWND = 4  # Packages
+INITIAL_SSTHRESH = 64  # Packages
+MIN_SSTHRESH = 2  # Packages
+
+
+class CongestionController(ABC):
+    """
+    Abstract Class to use as a template on what should a Congestion Control algorithm implement
+    """
+    def __init__(self, initial_cwnd=INITIAL_CWND, initial_ssthresh=INITIAL_SSTHRESH):
+        self.cwnd = initial_cwnd
+        self.ssthresh = initial_ssthresh
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(cwnd={self.cwnd:.2f}, ssthresh={self.ssthresh})"
+
+    @property
+    def window(self):
+        """
+        Amount of packages that may be in flight
+        """
+        return max(1, int(self.cwnd))
+
+    @abstractmethod
+    def on_ack(self, acked):
+        """
+        `acked` packages were acknowledged for the first time
+        """
+        pass
+
+    @abstractmethod
+    def on_timeout(self, in_flight):
+        """
+        The retransmission timer expired with `in_flight` packages unacknowledged
+        """
+        pass
+
+    @abstractmethod
+    def on_duplicate_acks(self, in_flight):
+        """
+        A package was lost, detected by duplicate ACKs, with `in_flight` packages unacknowledged
+        """
+        pass
+
+
+class RenoCongestionControl(CongestionController):
+    """
+    TCP Reno (RFC 5681): slow start, congestion avoidance and multiplicative decrease
+
+     - Slow start: cwnd grows one package per ACK (doubles each RTT) until ssthresh
+     - Congestion avoidance: cwnd grows one package per RTT
+     - Duplicate ACKs: ssthresh and cwnd are halved (fast recovery)
+     - Timeout: ssthresh is halved and cwnd restarts from one package
+    """
+    def on_ack(self, acked):
+        if self.cwnd < self.ssthresh:
+            self.cwnd = min(self.cwnd + acked, max(self.ssthresh, self.cwnd))
+        else:
+            self.cwnd += acked / self.cwnd
+
+    def on_timeout(self, in_flight):
+        self.ssthresh = max(in_flight // 2, MIN_SSTHRESH)
+        self.cwnd = 1
+
+    def on_duplicate_acks(self, in_flight):
+        self.ssthresh = max(in_flight // 2, MIN_SSTHRESH)
+        self.cwnd = self.ssthresh
@@ -0,0 +1,247 @@
+"""
+Delta uploads: only what changed in a file the server already has crosses the wire
+
+The server sends the signature of its copy: the weak checksum (Adler-32) and the strong hash
+(BLAKE2b) of every block. The client slides a window of a block over its file, rolling the weak
+checksum one byte at a time, and looks it up in the signature. When the strong hash matches too,
+it sends a reference to the block of the server instead of its data. The server rebuilds the
+file into a temporary one from its copy and the literal data, checks the hash of the whole file
+and moves it into place.
+"""
+import os
+import mmap
+import zlib
+import struct
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from reliable_socket.file_transfer import recv_exact, FILE_BUFFER_SIZE
+
+DELTA_BLOCK_SIZE = 16 * 1024  # Bytes per block of the signature
+LITERAL_SIZE = 1024 * 1024  # Literal data sent at most per operation
+SIGNATURE_CACHE_SIZE = 64  # Files whose signature the server keeps
+DELTA_SUFFIX = '.delta'
+DIGEST_SIZE = 16
+
+ADLER_MOD = 65521
+# Block size and amount of blocks of a signature, their signatures follow
+SIGNATURE_HEADER = struct.Struct('!II')
+# Weak checksum and strong hash of a block
+BLOCK_SIGNATURE = struct.Struct(f'!I{DIGEST_SIZE}s')
+# Operations of the delta: kind, then the length of the literal data that follows it, or the
+# first block and the amount of blocks to copy. END is followed by the hash of the whole file
+OPERATION = struct.Struct('!BQQ')
+END = 0
+LITERAL = 1
+COPY = 2
+
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
+def roll(weak, out_byte, in_byte, block_size):
+    """
+    Adler-32 of the window moved one byte forward, from the one of the previous window
+    """
+    a = weak & 0xffff
+    b = weak >> 16
+    a = (a - out_byte + in_byte) % ADLER_MOD
+    b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+    return (b << 16) | a
+
+
+class Signature:
+    """
+    Weak checksum and strong hash of every whole block of a file, the last partial one is left
+    out
+    """
+    def __init__(self, block_size, blocks):
+        self.block_size = block_size
+        self.blocks = blocks  # [(weak, strong)]
+        self.index = {}  # weak: {strong: block}
+        for block, (weak, strong) in enumerate(blocks):
+            self.index.setdefault(weak, {}).setdefault(strong, block)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def to_bytes(self):
+        return SIGNATURE_HEADER.pack(self.block_size, len(self.blocks)) + b''.join(
+            BLOCK_SIGNATURE.pack(weak, strong) for weak, strong in self.blocks)
+
+    @classmethod
+    def recv(cls, sock):
+        """
+        Receives from `sock` a signature sent as `to_bytes()`
+        """
+        block_size, blocks = SIGNATURE_HEADER.unpack(recv_exact(sock, SIGNATURE_HEADER.size))
+        data = recv_exact(sock, blocks * BLOCK_SIGNATURE.size)
+        return cls(block_size, list(BLOCK_SIGNATURE.iter_unpack(data)))
+
+    @classmethod
+    def of_file(cls, path, block_size=DELTA_BLOCK_SIZE):
+        """
+        Signature of the file at `path`, empty if there's no such file
+        """
+        blocks = []
+        try:
+            with open(path, 'rb') as file:
+                block = file.read(block_size)
+                while len(block) == block_size:
+                    blocks.append((zlib.adler32(block), strong_hash(block)))
+                    block = file.read(block_size)
+        except FileNotFoundError:
+            pass
+        return cls(block_size, blocks)
+
+
+class SignatureCache:
+    """
+    Signatures of the files of the server, computed again only once a file changes size or
+    modification time
+    """
+    def __init__(self, size=SIGNATURE_CACHE_SIZE):
+        self.size = size
+        self.lock = Lock()
+        self.signatures = OrderedDict()  # path: ((mtime, size, block_size), Signature)
+
+    def get(self, path, block_size=DELTA_BLOCK_SIZE):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return Signature(block_size, [])
+        key = (stat.st_mtime_ns, stat.st_size, block_size)
+        with self.lock:
+            cached_key, signature = self.signatures.get(path, (None, None))
+            if cached_key == key:
+                self.signatures.move_to_end(path)
+                return signature
+        # Hashed without the lock, other files can be served meanwhile
+        signature = Signature.of_file(path, block_size)
+        with self.lock:
+            self.signatures[path] = (key, signature)
+            self.signatures.move_to_end(path)
+            while len(self.signatures) > self.size:
+                self.signatures.popitem(last=False)
+        return signature
+
+
+def send_delta(sock, file, signature, callback=None):
+    """
+    Sends the delta of `file`, opened in binary mode, against the `signature` of the copy of the
+    peer. `callback` is called with the amount of bytes of the file every operation covers.
+    Returns (literal bytes, copied bytes)
+    """
+    size = os.fstat(file.fileno()).st_size
+    if not size:
+        sock.sendall(OPERATION.pack(END, 0, 0) + strong_hash(b''))
+        return 0, 0
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _send_delta(sock, data, size, signature, callback)
+
+
+def _send_delta(sock, data, size, signature, callback):
+    block_size = signature.block_size
+    index = signature.index
+    literal = copied = 0
+    copy_start = copy_count = 0
+    literal_start = position = 0
+
+    def send_literal(end):
+        nonlocal literal
+        if end > literal_start:
+            sock.sendall(OPERATION.pack(LITERAL, end - literal_start, 0) + data[literal_start:end])
+            literal += end - literal_start
+            if callback:
+                callback(end - literal_start)
+
+    def send_copy():
+        nonlocal copied
+        if copy_count:
+            sock.sendall(OPERATION.pack(COPY, copy_start, copy_count))
+            copied += copy_count * block_size
+            if callback:
+                callback(copy_count * block_size)
+
+    weak = zlib.adler32(data[:block_size]) if index and size >= block_size else None
+    while weak is not None:
+        strongs = index.get(weak)
+        block = None
+        if strongs:
+            block = strongs.get(strong_hash(data[position:position + block_size]))
+        if block is not None:
+            send_literal(position)
+            if copy_count and block == copy_start + copy_count:
+                copy_count += 1
+            else:
+                send_copy()
+                copy_start, copy_count = block, 1
+            position += block_size
+            literal_start = position
+            weak = (zlib.adler32(data[position:position + block_size])
+                    if position + block_size <= size else None)
+            continue
+        if position + block_size < size:
+            weak = roll(weak, data[position], data[position + block_size], block_size)
+        else:
+            weak = None
+        position += 1
+        if copy_count:
+            # The run of copied blocks ended, what comes next is literal
+            send_copy()
+            copy_count = 0
+        if position - literal_start >= LITERAL_SIZE:
+            send_literal(position)
+            literal_start = position
+    send_copy()
+    while literal_start < size:
+        end = min(literal_start + LITERAL_SIZE, size)
+        send_literal(end)
+        literal_start = end
+    sock.sendall(OPERATION.pack(END, 0, 0) + strong_hash(data))
+    return literal, copied
+
+
+def apply_delta(sock, basis_fd, file, block_size, callback=None):
+    """
+    Writes into `file` the file rebuilt from the delta received from `sock`, copying blocks of
+    `block_size` bytes from the file descriptor `basis_fd`. `callback` is called with the amount
+    of bytes of every write. Returns (whether the hash of the file matches, literal bytes, copied
+    bytes)
+    """
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    literal = copied = 0
+    while True:
+        kind, first, count = OPERATION.unpack(recv_exact(sock, OPERATION.size))
+        if kind == END:
+            return digest.digest() == recv_exact(sock, DIGEST_SIZE), literal, copied
+        if kind == LITERAL:
+            remaining = first
+            while remaining:
+                data = recv_exact(sock, min(remaining, FILE_BUFFER_SIZE))
+                remaining -= len(data)
+                literal += len(data)
+                _write(file, digest, data, callback)
+        elif kind == COPY:
+            if basis_fd is None:
+                raise ValueError("Delta references blocks of a file that doesn't exist")
+            # Several blocks per read, up to a buffer
+            blocks_per_read = max(FILE_BUFFER_SIZE // block_size, 1)
+            for block in range(first, first + count, blocks_per_read):
+                nbytes = min(blocks_per_read, first + count - block) * block_size
+                data = os.pread(basis_fd, nbytes, block * block_size)
+                if len(data) != nbytes:
+                    raise ValueError(f"Block {block} is past the end of the file")
+                copied += len(data)
+                _write(file, digest, data, callback)
+        else:
+            raise ValueError(f"Unknown delta operation {kind}")
+
+
+def _write(file, digest, data, callback):
+    file.write(data)
+    digest.update(data)
+    if callback:
+        callback(len(data))
@@ -0,0 +1,159 @@
+"""
+Directory transfers: a whole tree of files moved on one connection, without a request per file
+
+The side that has the files lists them in a manifest: the path relative to the directory, the
+size and the modification time of each one. Only the files the other side lacks, or has with a
+different size or modification time, are sent. They go back to back in a single stream, each one
+behind a header with its index in the manifest and its size, as in a tar archive: small files are
+batched into a single write, big ones are sent with sendfile. Received files are written under a
+temporary name, moved into place and given the modification time of the manifest, so the next
+transfer skips them.
+"""
+import os
+import stat
+import struct
+
+from reliable_socket.file_transfer import recv_exact, recv_to_file, FILE_BUFFER_SIZE
+
+# Amount of entries of a manifest, or of indexes of a list of them
+COUNT = struct.Struct('!I')
+# Size, modification time in nanoseconds and length of the path of a file. The path follows
+MANIFEST_ENTRY = struct.Struct('!QQH')
+INDEX = struct.Struct('!I')
+# Index in the manifest and size of the file that follows it in the stream
+ENTRY_HEADER = struct.Struct('!IQ')
+SMALL_FILE_SIZE = 64 * 1024  # Bytes. Files up to it are batched with others into a single write
+RECEIVING_SUFFIX = '.recv'
+
+
+def scan(root):
+    """
+    Regular files under `root`, recursively, sorted by path. Nothing if there's no such directory
+    :return: list of (relative path, size, modification time in nanoseconds)
+    """
+    entries = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            info = os.lstat(path)
+            # Symbolic links and files half received are left out
+            if not stat.S_ISREG(info.st_mode) or name.endswith(RECEIVING_SUFFIX):
+                continue
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            entries.append((relative, info.st_size, info.st_mtime_ns))
+    return entries
+
+
+def local_path(root, relative):
+    """
+    Path of the entry `relative` under `root`. Raises ValueError if it would be out of it
+    """
+    parts = relative.split('/')
+    if any(part in ('', '.', '..') for part in parts) or '\\' in relative:
+        raise ValueError(f"Invalid path in manifest: {relative!r}")
+    return os.path.join(root, *parts)
+
+
+def pack_manifest(entries):
+    data = bytearray(COUNT.pack(len(entries)))
+    for relative, size, mtime in entries:
+        path = relative.encode()
+        data += MANIFEST_ENTRY.pack(size, mtime, len(path)) + path
+    return bytes(data)
+
+
+def recv_manifest(sock):
+    """
+    Receives from `sock` a manifest sent as `pack_manifest()`. It is received whole before its
+    paths are checked, so the stream stays in step if one is invalid (ValueError)
+    """
+    count, = COUNT.unpack(recv_exact(sock, COUNT.size))
+    entries = []
+    for _ in range(count):
+        size, mtime, length = MANIFEST_ENTRY.unpack(recv_exact(sock, MANIFEST_ENTRY.size))
+        entries.append((recv_exact(sock, length).decode(), size, mtime))
+    for relative, _, _ in entries:
+        local_path('', relative)
+    return entries
+
+
+def outdated(entries, existing):
+    """
+    Indexes of the `entries` missing from `existing`, a manifest of what the other side has, or
+    with another size or modification time there
+    """
+    have = {relative: (size, mtime) for relative, size, mtime in existing}
+    return [index for index, (relative, size, mtime) in enumerate(entries)
+            if have.get(relative) != (size, mtime)]
+
+
+def pack_indexes(indexes):
+    return COUNT.pack(len(indexes)) + b''.join(INDEX.pack(index) for index in indexes)
+
+
+def recv_indexes(sock):
+    count, = COUNT.unpack(recv_exact(sock, COUNT.size))
+    return [index for index, in INDEX.iter_unpack(recv_exact(sock, count * INDEX.size))]
+
+
+def send_entries(sock, root, entries, indexes, callback=None):
+    """
+    Sends back to back the files of the `entries` at `indexes`, read from under `root`.
+    `callback` is called with the size of every file sent. Raises ValueError if a file doesn't
+    have the size of its entry any more
+    """
+    batch = bytearray()
+    for index in indexes:
+        relative, size, _ = entries[index]
+        header = ENTRY_HEADER.pack(index, size)
+        with open(local_path(root, relative), 'rb') as file:
+            if size <= SMALL_FILE_SIZE:
+                data = file.read(size)
+                if len(data) != size:
+                    raise ValueError(f"{relative} changed while sending it")
+                batch += header + data
+                if len(batch) >= FILE_BUFFER_SIZE:
+                    sock.sendall(bytes(batch))
+                    batch.clear()
+            else:
+                sock.sendall(bytes(batch + header))
+                batch.clear()
+                if sock.sendfile(file, 0, size) != size:
+                    raise ValueError(f"{relative} changed while sending it")
+        if callback:
+            callback(size)
+    if batch:
+        sock.sendall(bytes(batch))
+
+
+def recv_entries(sock, root, entries, indexes, buffer_size=FILE_BUFFER_SIZE, callback=None):
+    """
+    Writes under `root` the files of the `entries` at `indexes`, sent by `send_entries`.
+    `callback` is called with the size of every file received. Returns the amount of bytes
+    received
+    """
+    received = 0
+    for expected in indexes:
+        index, size = ENTRY_HEADER.unpack(recv_exact(sock, ENTRY_HEADER.size))
+        if index != expected or size != entries[index][1]:
+            raise ValueError(f"Entry {index} of {size} bytes received, expected entry {expected}")
+        relative, _, mtime = entries[index]
+        path = local_path(root, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + RECEIVING_SUFFIX
+        try:
+            with open(tmp_path, 'wb') as file:
+                if size <= SMALL_FILE_SIZE:
+                    file.write(recv_exact(sock, size))
+                elif recv_to_file(sock, file, size, buffer_size) < size:
+                    raise ConnectionError(f"Connection closed while receiving {relative}")
+            os.utime(tmp_path, ns=(mtime, mtime))
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        received += size
+        if callback:
+            callback(size)
+    return received
@@ -0,0 +1,159 @@
+"""
+Moves file data between a socket and a file without going through Python buffers when the
+kernel can do it
+
+Sending is `sock.sendfile(file)`: `os.sendfile` for TCP sockets, the mapped file for
+ReliableUDPSocket. Receiving from a TCP socket uses `os.splice` through a pipe, so the data goes
+from the socket to the page cache inside the kernel. Anything else (ReliableUDPSocket, platforms
+without splice, sockets with a timeout) reads into a single reusable buffer.
+"""
+import os
+import errno
+import socket
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+FILE_BUFFER_SIZE = 1024 * 1024  # Bytes moved per call
+SPLICE = hasattr(os, 'splice')  # Linux, Python 3.10+
+# Linux, not exposed by every Python build
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
+def recv_to_file(sock, file, count=None, buffer_size=FILE_BUFFER_SIZE, callback=None):
+    """
+    Writes what's received from `sock` into `file`, opened in binary mode, until `count` bytes
+    arrive or, if None, the remote host closes the connection. `callback` is called with the
+    amount of bytes of every write. Returns the amount of bytes received
+    """
+    if SPLICE and isinstance(sock, socket.socket) and sock.gettimeout() is None:
+        received = _splice_to_file(sock, file, count, buffer_size, callback)
+        if received is not None:
+            return received
+    return _recv_into_file(sock, file, count, buffer_size, callback)
+
+
+def recv_exact(sock, nbytes):
+    """
+    Receives exactly `nbytes` from `sock`, which may take several calls on a stream. Raises
+    ConnectionError if the connection is closed before
+    """
+    data = bytearray()
+    while len(data) < nbytes:
+        chunk = sock.recv(nbytes - len(data))
+        if not chunk:
+            raise ConnectionError(f"Connection closed after {len(data)} of {nbytes} bytes")
+        data += chunk
+    return bytes(data)
+
+
+async def recv_exact_async(sock, nbytes):
+    """
+    `recv_exact` for AsyncReliableUDPSocket
+    """
+    data = bytearray()
+    while len(data) < nbytes:
+        chunk = await sock.recv(nbytes - len(data))
+        if not chunk:
+            raise ConnectionError(f"Connection closed after {len(data)} of {nbytes} bytes")
+        data += chunk
+    return bytes(data)
+
+
+def recv_range(sock, fd, offset, count, buffer_size=FILE_BUFFER_SIZE, callback=None):
+    """
+    Writes `count` bytes received from `sock` at `offset` of the file descriptor `fd`, with
+    `os.pwrite`, so several connections can fill the same file. `callback` is called with the
+    amount of bytes of every write. Returns the amount of bytes received
+    """
+    buffer = memoryview(bytearray(buffer_size))
+    received = 0
+    while received < count:
+        read = sock.recv_into(buffer, min(buffer_size, count - received))
+        if not read:
+            break
+        written = 0
+        while written < read:
+            written += os.pwrite(fd, buffer[written:read], offset + received + written)
+        received += read
+        if callback:
+            callback(read)
+    return received
+
+
+def preallocate(fd, size):
+    """
+    Sets the size of the file descriptor `fd`, reserving its blocks where the platform can
+    """
+    os.ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            # Not supported by the file system, the file is sparse
+            pass
+
+
+def _recv_into_file(sock, file, count, buffer_size, callback):
+    # A single buffer is reused for the whole file
+    buffer = memoryview(bytearray(buffer_size))
+    received = 0
+    while count is None or received < count:
+        nbytes = buffer_size if count is None else min(buffer_size, count - received)
+        read = sock.recv_into(buffer, nbytes)
+        if not read:
+            break
+        file.write(buffer[:read])
+        received += read
+        if callback:
+            callback(read)
+    return received
+
+
+def _splice_to_file(sock, file, count, buffer_size, callback):
+    """
+    `recv_to_file` through a pipe. Returns None if the socket or the file don't support splice
+    and nothing was moved yet
+    """
+    file.flush()
+    read_fd, write_fd = os.pipe()
+    try:
+        if fcntl is not None:
+            try:
+                # The pipe holds 64 KiB by default, so every call can move a whole buffer
+                fcntl.fcntl(write_fd, F_SETPIPE_SZ, buffer_size)
+            except OSError:
+                pass
+        received = 0
+        while count is None or received < count:
+            nbytes = buffer_size if count is None else min(buffer_size, count - received)
+            try:
+                moved = os.splice(sock.fileno(), write_fd, nbytes)
+            except OSError as e:
+                if e.errno in (errno.EINVAL, errno.ENOSYS) and not received:
+                    return None
+                raise
+            if not moved:
+                break
+            received += moved
+            pending = moved
+            while pending:
+                try:
+                    pending -= os.splice(read_fd, file.fileno(), pending)
+                except OSError as e:
+                    if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise
+                    # The file doesn't support splice: empty the pipe and go on through Python
+                    while pending:
+                        pending -= file.write(os.read(read_fd, pending))
+                    if callback:
+                        callback(moved)
+                    rest = None if count is None else count - received
+                    return received + _recv_into_file(sock, file, rest, buffer_size, callback)
+            if callback:
+                callback(moved)
+        return received
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
@@ -0,0 +1,135 @@
+"""
+Packetization Layer Path MTU Discovery (RFC 8899) for the Reliable Transfer Protocol
+
+Packages start at a size that fits every path. The sender then probes bigger sizes with padding
+only packages, which carry no application data so losing them costs nothing: an acknowledged
+probe raises the package size, a lost one lowers the next probe. If the path narrows later (a
+package rejected with EMSGSIZE, or packages lost time after time as in a black hole) the size
+falls back to the base one and the search starts over. Sizes are measured in bytes of the whole
+datagram (header and payload).
+"""
+import socket
+import sys
+
+BASE_PACKET_SIZE = 1200  # Bytes. Fits every IPv4 path, RFC 8899 BASE_PLPMTU
+MAX_DATAGRAM_SIZE = 65507  # Bytes. Largest UDP payload over IPv4
+MAX_PROBES = 3  # A probe size is considered too big after this many probes are lost
+PROBE_GRANULARITY = 32  # Bytes. The search stops once the bounds are closer than this
+# Retransmission timeouts in a row, with packages above the base size, that mean a black hole
+BLACK_HOLE_TIMEOUTS = 3
+
+# Not every Python build exposes them, the values are the Linux ones
+if sys.platform.startswith('linux'):
+    IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+    IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+else:
+    IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', None)
+    IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', None)
+
+
+def set_dont_fragment(sock):
+    """
+    Sets the Don't Fragment bit on the datagrams sent through `sock`, so the ones that don't fit
+    the path are dropped (or rejected with EMSGSIZE) instead of fragmented. Returns whether it is
+    supported
+    """
+    if IP_MTU_DISCOVER is None or IP_PMTUDISC_DO is None:
+        return False
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    except OSError:
+        return False
+    return True
+
+
+class PathMTUProber:
+    """
+    Searches the biggest package size that goes through the path
+
+    The first probe is `max_size`, so paths such as loopback are done after a single round
+    trip. From then on it is a binary search between the biggest size acknowledged and the
+    smallest one lost.
+    """
+    def __init__(self, base_size=BASE_PACKET_SIZE, max_size=MAX_DATAGRAM_SIZE):
+        self.base_size = base_size
+        # Biggest size known to go through
+        self.size = base_size
+        # Smallest size known not to go through, minus one
+        self.max_size = max_size
+        self.probe_size = None  # Probe in flight
+        self.candidate = None  # Size being probed, it may take several probes
+        self.lost_probes = 0
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(size={self.size}, max_size={self.max_size}, "
+                f"probe_size={self.probe_size})")
+
+    @property
+    def done(self):
+        return self.max_size - self.size < PROBE_GRANULARITY
+
+    def next_probe(self):
+        """
+        Size of the next probe to send, None if a probe is in flight or the search is over
+        """
+        if self.probe_size is not None or self.done:
+            return None
+        if not self.lost_probes:
+            # The biggest size first, then halving the interval
+            if self.candidate is None:
+                self.candidate = self.max_size
+            else:
+                self.candidate = (self.size + self.max_size + 1) // 2
+        self.probe_size = self.candidate
+        return self.probe_size
+
+    def on_probe_acked(self, size):
+        """
+        The probe of `size` bytes went through. Returns whether the package size changed
+        """
+        if size != self.probe_size:
+            # Late answer of a probe already considered lost, it did go through anyway
+            if size <= self.size:
+                return False
+            self.max_size = max(self.max_size, size)
+        else:
+            self.probe_size = None
+            self.lost_probes = 0
+        self.size = max(self.size, size)
+        return True
+
+    def on_probe_lost(self, too_big=False):
+        """
+        The probe in flight was lost. `too_big` means it was rejected locally (EMSGSIZE), there's
+        no need to probe that size again
+        """
+        if self.probe_size is None:
+            return
+        self.lost_probes += 1
+        if too_big or self.lost_probes >= MAX_PROBES:
+            self.max_size = self.probe_size - 1
+            self.lost_probes = 0
+        self.probe_size = None
+
+    def on_packet_too_big(self, size):
+        """
+        A package of `size` bytes was rejected locally (EMSGSIZE): the path got narrower than
+        the size found. Falls back to the base size and searches again below `size`
+        """
+        self._search_again(size - 1)
+
+    def on_black_hole(self):
+        """
+        Packages of the size found keep being lost while smaller ones went through before: the
+        path may drop them without telling. Falls back to the base size and searches again below
+        it
+        """
+        self._search_again(self.size - 1)
+
+    def _search_again(self, max_size):
+        self.size = self.base_size
+        self.max_size = max(max_size, self.base_size)
+        self.probe_size = None
+        self.lost_probes = 0
+        # Halving the interval from the start, the size just given up is probably still too big
+        self.candidate = self.base_size
@@ -0,0 +1,166 @@
+"""
+Requests and responses of the file protocol
+
+A connection is a session: it carries requests one after the other until the client says goodbye.
+A request carries in a single frame everything the server needs to start a transfer: the
+operation, the file name, the size of the file, an offset and the options of the transfer. It is
+answered by a single response frame: a status, a size, an offset and options. Frames are
+prefixed by their length, so they are read whole however the stream was split or coalesced on
+the way. Options are a JSON object, for what only some operations use.
+"""
+import json
+import struct
+
+from reliable_socket.file_transfer import recv_exact, recv_exact_async
+
+FRAME_LENGTH = struct.Struct('!I')
+MAX_FRAME_SIZE = 64 * 1024  # Bytes, longer frames are rejected
+# Operation, size, offset, length of the name. The name and the options follow
+REQUEST_HEADER = struct.Struct('!BQQH')
+# Status, size, offset. The options follow
+RESPONSE_HEADER = struct.Struct('!HQQ')
+
+OP_UPLOAD = 1
+OP_DOWNLOAD = 2
+# Striped transfers, a range of the file per connection
+OP_UPLOAD_RANGE = 3
+OP_DOWNLOAD_RANGE = 4
+# Only the blocks that changed from the copy of the server are sent
+OP_UPLOAD_DELTA = 5
+# Only the chunks the deduplicating storage lacks are sent
+OP_UPLOAD_CHUNKS = 6
+# Size and modification time of a file
+OP_STAT = 7
+# Whole directories: the files the other side lacks, back to back
+OP_UPLOAD_DIR = 9
+OP_DOWNLOAD_DIR = 10
+# Ends the session: a connection carries requests one after the other until this one
+OP_BYE = 8
+
+STATUS_OK = 200
+STATUS_BAD_REQUEST = 400
+STATUS_NOT_FOUND = 404
+
+
+def recv_frame(sock):
+    """
+    Receives the body of the next frame from `sock`
+    """
+    length, = FRAME_LENGTH.unpack(recv_exact(sock, FRAME_LENGTH.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes, the limit is {MAX_FRAME_SIZE}")
+    return recv_exact(sock, length)
+
+
+async def recv_frame_async(sock):
+    """
+    `recv_frame` for AsyncReliableUDPSocket
+    """
+    length, = FRAME_LENGTH.unpack(await recv_exact_async(sock, FRAME_LENGTH.size))
+    if length > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame of {length} bytes, the limit is {MAX_FRAME_SIZE}")
+    return await recv_exact_async(sock, length)
+
+
+class Frame:
+    """
+    Message of the protocol, sent in a frame of its own. Subclasses define its body
+    """
+    def body(self):
+        raise NotImplementedError
+
+    @classmethod
+    def from_body(cls, body):
+        raise NotImplementedError
+
+    def to_bytes(self):
+        body = self.body()
+        return FRAME_LENGTH.pack(len(body)) + body
+
+    def send(self, sock):
+        sock.sendall(self.to_bytes())
+
+    async def send_async(self, sock):
+        await sock.send(self.to_bytes())
+
+    @classmethod
+    def recv(cls, sock):
+        return cls.from_body(recv_frame(sock))
+
+    @classmethod
+    async def recv_async(cls, sock):
+        return cls.from_body(await recv_frame_async(sock))
+
+
+def _encode_options(options):
+    return json.dumps(options).encode() if options else b''
+
+
+def _decode_options(data):
+    return json.loads(data.decode()) if data else {}
+
+
+class Request(Frame):
+    """
+    Operation on the file `name`. The meaning of `size` and `offset` depends on the operation
+    """
+    def __init__(self, op, name='', size=0, offset=0, options=None):
+        self.op = op
+        self.name = name
+        self.size = size
+        self.offset = offset
+        self.options = options or {}
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(op={self.op}, name={self.name!r}, size={self.size}, "
+                f"offset={self.offset}, options={self.options})")
+
+    def body(self):
+        name = self.name.encode()
+        return (REQUEST_HEADER.pack(self.op, self.size, self.offset, len(name)) + name +
+                _encode_options(self.options))
+
+    @classmethod
+    def from_body(cls, body):
+        if len(body) < REQUEST_HEADER.size:
+            raise ValueError(f"Truncated request of {len(body)} bytes")
+        op, size, offset, name_length = REQUEST_HEADER.unpack_from(body)
+        name_end = REQUEST_HEADER.size + name_length
+        if len(body) < name_end:
+            raise ValueError(f"Truncated request of {len(body)} bytes, the name ends at {name_end}")
+        name = body[REQUEST_HEADER.size:name_end].decode()
+        return cls(op, name, size, offset, _decode_options(body[name_end:]))
+
+
+class Response(Frame):
+    """
+    Answer to a request. The meaning of `size` and `offset` depends on the operation
+    """
+    def __init__(self, status, size=0, offset=0, options=None):
+        self.status = status
+        self.size = size
+        self.offset = offset
+        self.options = options or {}
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(status={self.status}, size={self.size}, "
+                f"offset={self.offset}, options={self.options})")
+
+    @property
+    def ok(self):
+        return self.status == STATUS_OK
+
+    @property
+    def message(self):
+        return self.options.get("msg", "")
+
+    def body(self):
+        return RESPONSE_HEADER.pack(self.status, self.size, self.offset) + \
+            _encode_options(self.options)
+
+    @classmethod
+    def from_body(cls, body):
+        if len(body) < RESPONSE_HEADER.size:
+            raise ValueError(f"Truncated response of {len(body)} bytes")
+        status, size, offset = RESPONSE_HEADER.unpack_from(body)
+        return cls(status, size, offset, _decode_options(body[RESPONSE_HEADER.size:]))
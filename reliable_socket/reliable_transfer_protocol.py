@@ -1,14 +1,25 @@
 """
 This Module will include a Reliable Transfer Protocol similar to TCP, implemented in UDP
 """
+import io
+import os
+import mmap
 import time
+import errno
 import socket
 import logging
 import queue
-from threading import Thread, Lock, Condition
+from threading import Thread, Lock, RLock, Condition
 from abc import ABC, abstractmethod
 
-from utils import UDPPacket, chunked
+from utils import (UDPPacket, RTTEstimator, ByteQueue, chunked, to_ranges, pack_sack_blocks,
+                   unpack_sack_blocks, OPTION_SACK, OPTION_SACK_PERMITTED,
+                   OPTION_MAX_PACKET_SIZE, OPTION_PMTU_PROBE, OPTION_RECV_WINDOW,
+                   OPTION_WINDOW_PROBE, OPTION_SEGMENT_ACK, SIZE_OPTION, SEQ_N_OPTION)
+from timers import get_timer_service
+from congestion import RenoCongestionControl
+from pmtu import (PathMTUProber, BASE_PACKET_SIZE, MAX_DATAGRAM_SIZE, BLACK_HOLE_TIMEOUTS,
+                  set_dont_fragment)
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - [%(threadName)s] - %(message)s')
@@ -18,10 +29,38 @@ logger.setLevel(logging.ERROR)
 
 # MAX PACKET SIZE chosen based on
 # https://stackoverflow.com/questions/40032171/find-max-udp-payload-python-socket-send-sendto
+# Biggest package accepted by peers that don't negotiate it
 MAX_PACKET_SIZE = 1500
-WINDOW_SIZE = 4
-RTO = 2  # Seconds
+PACKET_SIZE = BASE_PACKET_SIZE  # Bytes. Initial size of the packages, probing raises it
+PMTU_PROBING = True  # Probe the path for bigger packages, see `pmtu.PathMTUProber`
+# Bytes. Kernel buffers of the socket, capped by the kernel to net.core.rmem_max / wmem_max
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+# Biggest packages accepted that fit in the receive buffer of the socket. Enough of them in flight
+# for the duplicate ACKs to reveal a loss
+PACKAGES_PER_SOCKET_BUFFER = 8
+RECV_BUFFER_SIZE = 4 * 1024 * 1024  # Bytes received and not yet read by the app, per connection
+SEND_BUFFER_SIZE = 4 * 1024 * 1024  # Bytes sent by the app waiting for room in the window
+WINDOW_SIZE = 64  # Upper bound, the congestion window decides how many packages are in flight
+DUP_ACK_THRESHOLD = 3
+RTO = 1  # Seconds. Initial value, it adapts to the measured RTT
+MIN_RTO = 0.2  # Seconds
+MAX_RTO = 60  # Seconds
 RETRANSMISSION_DELAY = 0.1  # Seconds
+IDLE_TIMEOUT = None  # Seconds without receiving anything before dropping the connection
+DEMUX = False  # Server: serve every connection through the listening socket
+RECV_BATCH = 64  # Max datagrams drained from the socket and processed in one go
+ACK_EVERY = 2  # Segments received in order acknowledged by each ACK
+ACK_DELAY = 0.04  # Seconds a segment received in order may wait for its ACK. Well below MIN_RTO
+SACK = True  # Offer Selective Acknowledgements during the handshake
+
+# ARQ MODES
+ARQ_GO_BACK_N = 'gbn'
+ARQ_SELECTIVE_REPEAT = 'sr'
+
+# sendmsg isn't available on every platform (i.e. Windows)
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+# Neither is MSG_DONTWAIT, without it every batch has a single datagram
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', None)
 
 # STATUSES
 STATUS_SYN = 1
@@ -79,6 +118,9 @@ class ReliableTCPSocket(socket.socket):
     """
     def __init__(self):
         super().__init__(family=socket.AF_INET, type=socket.SOCK_STREAM)
+        # Sessions write a small frame and wait for the answer: Nagle would hold it until the
+        # delayed ACK of the peer. Accepted connections inherit it
+        self.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
 
 class ReliableUDPSocket(ReliableSocket):
@@ -90,46 +132,196 @@ class ReliableUDPSocket(ReliableSocket):
     # MAX PACKET SIZE chosen based on
     # https://stackoverflow.com/questions/40032171/find-max-udp-payload-python-socket-send-sendto
     MAX_PACKET_SIZE = 1500
-    WINDOW_SIZE = 4
-    RTO = 2  # Seconds
+    PACKET_SIZE = BASE_PACKET_SIZE
+    PMTU_PROBING = True
+    SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+    RECV_BUFFER_SIZE = 4 * 1024 * 1024
+    SEND_BUFFER_SIZE = 4 * 1024 * 1024
+    WINDOW_SIZE = 64
+    DUP_ACK_THRESHOLD = 3
+    RTO = 1  # Seconds
+    MIN_RTO = 0.2
+    MAX_RTO = 60
     RETRANSMISSION_DELAY = 0.1
-
-    def __init__(self, window_size=WINDOW_SIZE, rto=RTO, rtx_delay=RETRANSMISSION_DELAY):
+    IDLE_TIMEOUT = None
+    DEMUX = False
+    RECV_BATCH = 64
+    ACK_EVERY = 2
+    ACK_DELAY = 0.04
+    SACK = True
+
+    def __init__(self, window_size=WINDOW_SIZE, rto=RTO, rtx_delay=RETRANSMISSION_DELAY,
+                 arq=ARQ_GO_BACK_N, min_rto=MIN_RTO, max_rto=MAX_RTO, idle_timeout=IDLE_TIMEOUT,
+                 demux=DEMUX, congestion_control=RenoCongestionControl, sock=None,
+                 recv_batch=RECV_BATCH, ack_every=ACK_EVERY, ack_delay=ACK_DELAY, sack=SACK,
+                 packet_size=PACKET_SIZE, max_packet_size=MAX_DATAGRAM_SIZE,
+                 pmtu_probing=PMTU_PROBING, socket_buffer_size=SOCKET_BUFFER_SIZE,
+                 recv_buffer_size=RECV_BUFFER_SIZE, send_buffer_size=SEND_BUFFER_SIZE):
+        """
+        `window_size` is the maximum amount of packages in flight, `congestion_control` is the
+        CongestionController class deciding how many of them can actually be sent.
+        `demux` only applies to servers: instead of forking a socket for each client, every
+        datagram is read by the listening socket and dispatched to its connection.
+        `sock` is the already created socket to use, the demultiplexed connections share the one
+        of the listening socket.
+        `recv_batch` is the maximum amount of datagrams read from the socket before processing
+        them.
+        `ack_every` and `ack_delay` are the delayed ACK policy: a cumulative ACK is sent once
+        `ack_every` segments were received in order, or `ack_delay` seconds after the first of
+        them otherwise. Out of order segments and the ones filling a gap are acknowledged
+        immediately. Use `ack_every=1` to acknowledge every segment (i.e. Stop & Wait).
+        `sack` offers Selective Acknowledgements. They are only used if the remote host accepts
+        them: the ACKs then report the segments received out of order so they aren't
+        retransmitted. Without them, the ACK sent for a segment received out of order
+        acknowledges that segment alone (Selective Repeat).
+        `packet_size` is the initial size of the packages sent, in bytes. `max_packet_size` is the
+        biggest package accepted, announced during the handshake. With `pmtu_probing` the
+        package size grows up to the biggest one both ends accept and the path carries.
+        `socket_buffer_size` is the size of the kernel buffers of the socket, capped by the
+        kernel (`net.core.rmem_max` and `wmem_max` on Linux). The window advertised never goes
+        beyond the receive one, and the packages accepted are small enough for several of them
+        to fit in it.
+        `recv_buffer_size` bounds the bytes received and not yet read by the app. The free space
+        is advertised to the remote host, which doesn't send more than that (flow control).
+        `send_buffer_size` bounds the bytes sent by the app that don't fit in the window yet,
+        `send` blocks once it is full (see `settimeout`)
+        """
+        assert arq in (ARQ_GO_BACK_N, ARQ_SELECTIVE_REPEAT)
         # Internal Socket
-        self.sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if sock is None:
+            sock = socket.socket(family=socket.AF_INET, type=socket.SOCK_DGRAM)
+            for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, option, socket_buffer_size)
+                except OSError as e:
+                    logger.debug(f"Couldn't set the socket buffer size: {e}")
+        self.sock = sock
+        # Datagrams must not be fragmented for the path MTU probing to work
+        self.dont_fragment = set_dont_fragment(sock)
         self.new_connections_queue = queue.Queue()
+        # Demultiplexing server only: connections indexed by the remote address
+        self.connections = {}
+        self.connections_lock = Lock()
+        # Demultiplexed connections only: the remote address and the listening socket they belong
+        self.peer_address = None
+        self.listener = None
         self.server_mode = None
         self.listening_thread = None
-        self.retransmission_thread = None
         self.stop_transmission = False
-        self.transmit_lock = Lock()
+        # Guards the state of both directions of the connection. Reentrant: the received packages
+        # are processed holding it, and processing them may call methods that also take it
+        self.transmit_lock = RLock()
+        # Notified when packages leave the send buffer, see `_wait_send_buffer`
+        self.send_buffer_cond = Condition(self.transmit_lock)
+        # Every timeout is handled by the process-wide timer service
+        self.timers = get_timer_service()
+        self.rtx_timer = None
+        self.linger_timer = None
+        self.idle_timer = None
+        self.ack_timer = None
+        self.probe_timer = None
+        self.persist_timer = None
+        self.last_activity = time.time()
         self.gbn_window = []
+        # Loss detection through duplicate ACKs, see `_on_duplicate_ack`
+        self.dup_acks = 0
+        self.recovery_point = 0
+        # Retransmission timeouts since the window last moved, see `_detect_black_hole`
+        self.timeouts_in_a_row = 0
         self.connection_status = None  # Only needed for client's 'workers'
         self.id = None
         self.seq_n = 0
         self.r_seq_n = 0
-        self.r_seq_n_lock = Lock()
+        # Delayed ACK: segments received in order since the last ACK was sent, and whether the
+        # batch being processed must be acknowledged regardless. See `_handle_batch`
+        self.unacked_segments = 0
+        self.ack_now = False
+        # Segments were received out of order, the next one in order fills the gap
+        self.receiving_gap = False
+        # Selective Repeat only: segments received ahead of r_seq_n, indexed by their seq_n
+        self.out_of_order_buffer = {}
         self.app_sent_buffer = queue.Queue()  # Info sent by the app
         self.app_sent_buffer_lock = Lock()
-        self.app_recv_buffer = b''  # Info to be read by the app
+        self.app_recv_buffer = ByteQueue()  # Info to be read by the app
         self.app_recv_buffer_lock = Lock()
         self.recv_buffer_cond = Condition()
         self.established_cond = Condition()
         self.can_close_cond = Condition()
         # Configurable Attributes
         self.window_size = window_size
-        self.rto = rto
+        self.congestion_control = congestion_control
+        self.congestion = congestion_control()
+        self.rtt_estimator = RTTEstimator(rto, min_rto, max_rto)
         self.rtx_delay = rtx_delay
+        self.idle_timeout = idle_timeout
+        self.arq = arq
+        self.demux = demux
+        self.recv_batch = recv_batch
+        # A window can't hold more unacknowledged segments than its size
+        self.ack_every = min(ack_every, window_size)
+        self.ack_delay = ack_delay
+        self.sack = sack
+        # Whether both ends agreed to use Selective Acknowledgements, see `_negotiate`
+        self.sack_permitted = False
+        self.packet_size = packet_size
+        self.max_packet_size = max_packet_size
+        self.pmtu_probing = pmtu_probing
+        self.socket_buffer_size = socket_buffer_size
+        # Bytes of payload the receive buffer of the socket holds. Linux reports twice the size it
+        # grants, and charges each datagram quite more than its payload (headers, bookkeeping,
+        # rounding of the allocations): a third of what it reports is left for the payload
+        self.kernel_recv_buffer = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) // 3
+        # A package must always fit in the receive buffer
+        self.recv_buffer_size = max(recv_buffer_size, max_packet_size)
+        # Flow control, only if both ends support it. See `_negotiate`
+        self.flow_control = False
+        self.advertised_window = self.recv_buffer_size  # Last window sent to the remote host
+        self.remote_window = None  # Last window received, None if there's no flow control
+        self.window_bytes = 0  # Payload bytes of the packages in the window
+        self.persist_interval = None
+        self.send_buffer_size = send_buffer_size
+        self.send_buffer_bytes = 0  # Payload bytes of the packages in `app_sent_buffer`
+        # Seconds `send` and `recv` wait, None blocks forever and 0 never blocks
+        self.timeout = None
+        # Only if the remote host supports probing, see `_negotiate`
+        self.prober = None
+        # Amount of recv and send calls made on the socket
+        self.recv_syscalls = 0
+        self.send_syscalls = 0
         # Used for ending a connection
         self.fin_cond = Condition()
         self.stop_listening = False
         self.desconnected_timeouts = 3
 
+    @property
+    def rto(self):
+        """
+        Current Retransmission Timeout, in seconds
+        """
+        return self.rtt_estimator.rto
+
+    @property
+    def cwnd(self):
+        """
+        Congestion window, in packages
+        """
+        return self.congestion.cwnd
+
+    @property
+    def ssthresh(self):
+        """
+        Slow start threshold, in packages
+        """
+        return self.congestion.ssthresh
+
     def bind(self, addr):
         """
         Binds the socket to a local address. Non-Blocking
+
+        The forked sockets bind to the address of the listening one. Clients must not reuse
+        addresses, otherwise two of them may be given the same ephemeral port
         """
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.sock.bind(addr)
 
     def accept(self):
@@ -139,8 +331,10 @@ class ReliableUDPSocket(ReliableSocket):
         """
         conn, address = self.new_connections_queue.get()
         conn.server_mode = True
-        conn._listen()
-        conn._start_retransmission_thread()
+        if not self.demux:
+            # Demultiplexed connections are fed by the listening socket
+            conn._listen()
+        conn._start_idle_timer()
         return conn, address
 
     def connect(self, address):
@@ -152,20 +346,22 @@ class ReliableUDPSocket(ReliableSocket):
         local_address = self.sock.getsockname()
         self.id = f"Client: {local_address[0]}:{local_address[1]}"
         self.server_mode = False
-        self._start_retransmission_thread()
         self._listen()
+        self._start_idle_timer()
 
-        package = UDPPacket.create_syn()
+        package = UDPPacket.create_syn(self._syn_options())
         with self.transmit_lock:
             self.gbn_window.append(package)
             package.tick()
             self._send(package)
+            self._arm_retransmission_timer()
 
         # Connect MUST be blocking, it blocks until the connection is fully established with the
         # server. The connect releases once the client receives a SYN+ACK from the server
         with self.established_cond:
             logger.info("Waiting for connection established")
-            self.established_cond.wait()
+            self.established_cond.wait_for(
+                lambda: self.connection_status == STATUS_ESTABLISHED or self.stop_listening)
 
     def connect_ex(self, address):
         self.connect(address)
@@ -180,56 +376,233 @@ class ReliableUDPSocket(ReliableSocket):
 
     def send(self, data: bytes):
         """
-        Send data to the socket.
+        Send data to the socket. Returns the amount of bytes accepted
 
-        Receives a bytearray and sends it through the socket if there's available space in the
-        Go-Back-N Window. If not, save the packages in a buffer
+        Sends the data through the socket if there's available space in the Go-Back-N Window.
+        If not, saves the packages in the send buffer. Once the buffer is full it waits for room
+        according to the timeout, and like `socket.send` it may accept only part of `data`
         """
         assert isinstance(data, bytes)
         with self.transmit_lock:
-            # Split the bytes into chunks that fit the UDP Package
-            for chunk in chunked(data, self.MAX_PACKET_SIZE-UDPPacket.HEADER_SIZE):
-                seq_n = self.seq_n + 1
-                self.seq_n += 1
-                with self.r_seq_n_lock:
-                    # TODO: Review the ack_n. Not quite sure
-                    pkg = UDPPacket.create_data(seq_n, self.r_seq_n, chunk)
+            self._wait_send_buffer(self._deadline())
+            return self._buffer_data(data)
+
+    def sendall(self, data: bytes):
+        """
+        Send data to the socket, waiting for room in the send buffer until all of it is accepted.
+        The timeout applies to the whole call
+        """
+        assert isinstance(data, bytes)
+        self._sendall(memoryview(data))
+
+    def sendfile(self, file, offset=0, count=None):
+        """
+        Send the contents of `file`, opened in binary mode, from `offset` up to `count` bytes (the
+        end of the file by default), with the signature of `socket.sendfile`. Returns the amount
+        of bytes sent
+
+        The file is memory-mapped and the packages are cut straight from the mapping, so its data
+        is never copied in user space, not even to retransmit it. The mapping is released once
+        every package cut from it is acknowledged. Files that can't be mapped are read instead
+        """
+        try:
+            fileno = file.fileno()
+            size = os.fstat(fileno).st_size
+        except (AttributeError, io.UnsupportedOperation):
+            return self._sendfile_use_send(file, offset, count)
+        count = size - offset if count is None else min(count, size - offset)
+        if count <= 0:
+            # Left at the end of the range, as when the file is read
+            file.seek(offset)
+            return 0
+        try:
+            mapping = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            # Not a regular file
+            return self._sendfile_use_send(file, offset, count)
+        self._sendall(memoryview(mapping)[offset:offset + count])
+        file.seek(offset + count)
+        return count
+
+    def _sendfile_use_send(self, file, offset, count):
+        """
+        `sendfile` for the files that can't be mapped, reading them a send buffer at a time
+        """
+        if offset:
+            file.seek(offset)
+        sent = 0
+        while count is None or sent < count:
+            blocksize = self.send_buffer_size if count is None else min(self.send_buffer_size,
+                                                                        count - sent)
+            data = file.read(blocksize)
+            if not data:
+                break
+            self.sendall(data)
+            sent += len(data)
+        return sent
+
+    def _sendall(self, view):
+        """
+        `sendall` of a memoryview. The packages keep slices of it, not copies
+        """
+        deadline = self._deadline()
+        sent = 0
+        with self.transmit_lock:
+            while sent < len(view):
+                self._wait_send_buffer(deadline)
+                sent += self._buffer_data(view[sent:])
+
+    def settimeout(self, value):
+        """
+        Seconds `send`, `sendall` and the `recv` methods wait before raising `socket.timeout`.
+        None blocks forever, 0 makes them non-blocking: they raise `BlockingIOError` instead
+        """
+        if value is not None and value < 0:
+            raise ValueError("Timeout value out of range")
+        self.timeout = value
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, flag):
+        self.settimeout(None if flag else 0.0)
+
+    def _deadline(self):
+        """
+        Time at which a call started now times out, None if it never does
+        """
+        return None if self.timeout is None else time.time() + self.timeout
+
+    def _wait(self, cond, predicate, deadline):
+        """
+        Waits on `cond` (held by the caller) for `predicate`, honouring the timeout of the socket
+        """
+        if predicate():
+            return
+        if self.timeout == 0:
+            raise BlockingIOError(errno.EAGAIN, "Resource temporarily unavailable")
+        timeout = None if deadline is None else max(deadline - time.time(), 0)
+        if not cond.wait_for(predicate, timeout):
+            raise socket.timeout("timed out")
+
+    def _wait_send_buffer(self, deadline):
+        """
+        Waits until the send buffer has room. Must hold `transmit_lock`
+        """
+        self._wait(self.send_buffer_cond,
+                   lambda: self._send_buffer_has_room() or self.stop_listening, deadline)
+        if self.stop_listening:
+            raise ConnectionError(f"Connection {self.id} is closed")
 
-                    if len(self.gbn_window) == self.window_size:
-                        # The buffer is full I cannot send any packages
-                        # Dump to local buffer
-                        self.app_sent_buffer.put(pkg)
-                    else:
-                        self.gbn_window.append(pkg)
-                        self._send(pkg)
+    def _send_buffer_has_room(self, size=None):
+        """
+        Whether a package with `size` bytes of payload (a full one by default) fits in the send
+        buffer. An empty buffer always takes one, whatever its size. Must hold `transmit_lock`
+        """
+        if size is None:
+            size = self.packet_size - UDPPacket.HEADER_SIZE
+        return not self.send_buffer_bytes or self.send_buffer_bytes + size <= self.send_buffer_size
 
-        return len(data)
+    def _buffer_data(self, data):
+        """
+        Splits `data` into packages, sending the ones the window has room for and buffering the
+        rest while the send buffer isn't full. Returns the amount of bytes accepted. Must hold
+        `transmit_lock`
+        """
+        view = memoryview(data)
+        accepted = 0
+        # Split the bytes into chunks that fit the UDP Package. The package size may be lowered
+        # halfway, see `_send_data`
+        while accepted < len(view):
+            chunk = view[accepted:accepted + self.packet_size - UDPPacket.HEADER_SIZE]
+            seq_n = self.seq_n + 1
+            # TODO: Review the ack_n. Not quite sure
+            pkg = UDPPacket.create_data(seq_n, self.r_seq_n, chunk)
+
+            if not self._window_has_room(pkg) or not self.app_sent_buffer.empty():
+                # The window is full (or others are already waiting) I cannot send any
+                # packages. Dump to local buffer, if there's room
+                if not self._send_buffer_has_room(len(chunk)):
+                    break
+                self.seq_n += 1
+                self.app_sent_buffer.put(pkg)
+                self.send_buffer_bytes += len(chunk)
+            else:
+                self.seq_n += 1
+                self.gbn_window.append(pkg)
+                self.window_bytes += len(pkg.payload)
+                self._send_data(pkg)
+            accepted += len(chunk)
+        self._arm_retransmission_timer()
+        self._arm_persist_timer()
+        return accepted
 
     def recv(self, bufsize: int):
         """
         Receive data from socket. Blocking.
 
         Reads from the receive buffer. If the buffer is empty, it blocks until it contains data
+        (see `settimeout`)
         """
         with self.recv_buffer_cond:
-            logger.debug("ESPERO A PODER LEER ALGO")
-            self.recv_buffer_cond.wait_for(self._rec_buffer_nonempty)
-            ret = self.app_recv_buffer[:bufsize]
-            self.app_recv_buffer = self.app_recv_buffer[bufsize:]
-            logger.debug("TERMINO DE LEER")
-            logger.debug("LEI %r", ret)
-            return ret
+            self._wait(self.recv_buffer_cond, self._can_read, self._deadline())
+            data = self.app_recv_buffer.read(bufsize)
+        self._update_window()
+        return data
+
+    def recv_into(self, buffer, nbytes=0):
+        """
+        Receive up to `nbytes` (or `len(buffer)` if 0) bytes from socket into `buffer` instead of
+        allocating new bytes. Blocking. Returns the amount of bytes received
+        """
+        with self.recv_buffer_cond:
+            self._wait(self.recv_buffer_cond, self._can_read, self._deadline())
+            read = self.app_recv_buffer.read_into(buffer, nbytes)
+        self._update_window()
+        return read
+
+    def recvmsg(self, bufsize, ancbufsize=0, flags=0):
+        """
+        Same as `recv`, with the signature of `socket.recvmsg`. There's never ancillary data
+        :return: (data, ancdata, msg_flags, address)
+        """
+        return self.recv(bufsize), [], 0, self.getpeername()
+
+    def recvmsg_into(self, buffers, ancbufsize=0, flags=0):
+        """
+        Scatters the received data into `buffers`, filling each one before moving to the next,
+        with the signature of `socket.recvmsg_into`. Blocking
+        :return: (nbytes, ancdata, msg_flags, address)
+        """
+        received = 0
+        with self.recv_buffer_cond:
+            self._wait(self.recv_buffer_cond, self._can_read, self._deadline())
+            for buffer in buffers:
+                read = self.app_recv_buffer.read_into(buffer)
+                received += read
+                if read < len(memoryview(buffer).cast('B')):
+                    break
+        self._update_window()
+        return received, [], 0, self.getpeername()
 
     def close(self):
         logger.debug("WAITING CAN CLOSE")
         with self.can_close_cond:
             self.can_close_cond.wait_for(self._can_close)
         logger.debug("NOW CAN CLOSE")
+        if self.stop_listening:
+            # The connection is already down, there's no one to send the FIN to
+            return
         package = UDPPacket.create_fin()
         with self.transmit_lock:
+            if self.unacked_segments:
+                # The delayed ACK would be cancelled with the connection: the peer would keep
+                # retransmitting the last segments it sent
+                self._send_ack()
             self.gbn_window.append(package)
             package.tick()
             self._send(package)
+            self._arm_retransmission_timer()
 
         # Client must notify the server, but server is not obliged to recieve FIN+ACK?
         if(not self.server_mode):
@@ -237,13 +610,15 @@ class ReliableUDPSocket(ReliableSocket):
             # server. The connect releases once the client receives a FIN+ACK from the server
             with self.fin_cond:
                 logger.info("Waiting for connection closure")
-                self.fin_cond.wait()
+                self.fin_cond.wait_for(lambda: self.stop_transmission or self.stop_listening)
                 logger.info("Connection Finished")
 
     def getpeername(self):
         """
         Returns the address of the remote host
         """
+        if self.peer_address:
+            return self.peer_address
         try:
             return self.sock.getpeername()
         except OSError:
@@ -261,8 +636,345 @@ class ReliableUDPSocket(ReliableSocket):
         """
         return len(self.app_recv_buffer) != 0
 
+    def _can_read(self):
+        """
+        Whether `recv` can return: there's data to read or the connection was dropped
+        """
+        return self._rec_buffer_nonempty() or self.stop_listening
+
     def _can_close(self):
-        return len(self.gbn_window) == 0 and self.app_sent_buffer.empty()
+        """
+        Whether `close` can send the FIN: everything sent was acknowledged, or the connection was
+        dropped and nothing will ever be
+        """
+        return (len(self.gbn_window) == 0 and self.app_sent_buffer.empty()) or self.stop_listening
+
+    def _mark_acked(self, ack_n):
+        """
+        Marks the DATA packages in the window acknowledged by `ack_n`. Must hold `transmit_lock`
+
+        ACKs are cumulative, so every package up to `ack_n` is acknowledged.
+        Returns the packages that were acknowledged
+        """
+        acked = []
+        for pkg in self.gbn_window:
+            if pkg.seq_n > ack_n:
+                # The window is sorted by seq_n
+                break
+            if pkg.acked or not pkg.is_data():
+                continue
+            pkg.acked = True
+            acked.append(pkg)
+        return acked
+
+    def _mark_sacked(self, options):
+        """
+        Marks the DATA packages in the window that the SACK blocks in the `options` of an ACK
+        report as received, so they aren't retransmitted. Must hold `transmit_lock`
+        """
+        value = options.get(OPTION_SACK)
+        if value is None:
+            return
+        blocks = unpack_sack_blocks(value)
+        for pkg in self.gbn_window:
+            if pkg.acked or not pkg.is_data():
+                continue
+            if any(first <= pkg.seq_n <= last for first, last in blocks):
+                pkg.acked = True
+
+    def _mark_segment_acked(self, options):
+        """
+        Marks the DATA package that an ACK without SACK blocks acknowledges on its own (see
+        `_send_ack`), so it isn't retransmitted. Must hold `transmit_lock`
+        """
+        value = options.get(OPTION_SEGMENT_ACK)
+        if value is None:
+            return
+        seq_n, = SEQ_N_OPTION.unpack(value)
+        for pkg in self.gbn_window:
+            if pkg.seq_n == seq_n and pkg.is_data():
+                pkg.acked = True
+                return
+
+    def _syn_options(self):
+        """
+        Options of the SYN and SYN+ACK packages. The server only accepts the ones the client offered
+        """
+        options = {OPTION_MAX_PACKET_SIZE: SIZE_OPTION.pack(self._accepted_packet_size())}
+        if self.sack_permitted if self.server_mode else self.sack:
+            options[OPTION_SACK_PERMITTED] = b''
+        if self.flow_control or not self.server_mode:
+            options[OPTION_RECV_WINDOW] = SIZE_OPTION.pack(self._free_window())
+        return options
+
+    def _free_window(self):
+        """
+        Free space in the receive buffer, in bytes, as long as the socket can hold that much
+        """
+        free = max(self.recv_buffer_size - len(self.app_recv_buffer), 0)
+        return min(free, self._socket_window())
+
+    def _socket_window(self):
+        """
+        Bytes that may be in flight to this end: the packages wait in the receive buffer of the
+        socket until they are processed, and the kernel drops the ones that don't fit. The
+        connections of a demultiplexing server share the buffer of the listening socket. It is
+        never smaller than a package
+        """
+        share = self.kernel_recv_buffer
+        if self.listener:
+            share //= max(len(self.listener.connections), 1)
+        return max(share, self._accepted_packet_size())
+
+    def _fits_window(self, payload):
+        """
+        Whether `payload` fits in the receive buffer, next to the packages waiting for a gap to be
+        filled. Must hold `transmit_lock`
+        """
+        if not self.flow_control:
+            return True
+        pending = sum(len(p) for p in self.out_of_order_buffer.values())
+        return pending + len(payload) <= self._free_window()
+
+    def _update_window(self):
+        """
+        Called after the app reads. Lets the remote host know the receive window opened, once
+        it grew by half its maximum since it was advertised
+        """
+        if not self.flow_control:
+            return
+        maximum = min(self.recv_buffer_size, self._socket_window())
+        if self._free_window() - self.advertised_window < maximum // 2:
+            return
+        with self.transmit_lock:
+            if not self.stop_listening:
+                self._send_ack()
+
+    def _window_has_room(self, package):
+        """
+        Whether `package` can be sent: it fits both the congestion window and the receive window
+        of the remote host. Must hold `transmit_lock`
+        """
+        if len(self.gbn_window) >= self._send_window():
+            return False
+        return (self.remote_window is None or
+                self.window_bytes + len(package.payload) <= self.remote_window)
+
+    def _arm_persist_timer(self):
+        """
+        If the receive window of the remote host doesn't let us send and there's nothing in
+        flight, no ACK will tell us when it opens: probe it until it does. Must hold
+        `transmit_lock`
+        """
+        blocked = self.remote_window is not None and not self.app_sent_buffer.empty()
+        if not blocked or self.gbn_window:
+            if self.persist_timer is not None:
+                self.persist_timer.cancel()
+                self.persist_timer = None
+            self.persist_interval = None
+            return
+        if self.persist_timer is not None:
+            return
+        self.persist_interval = min(self.persist_interval * 2, self.rtt_estimator.max_rto) \
+            if self.persist_interval else self.rto
+        self.persist_timer = self.timers.call_later(self.persist_interval, self._on_persist_timeout)
+
+    def _on_persist_timeout(self):
+        with self.transmit_lock:
+            self.persist_timer = None
+            if self.stop_listening:
+                return
+            logger.debug(f"[{self.id}] probing the receive window of {self.getpeername()}")
+            probe = UDPPacket.create_ack(self.seq_n, self.r_seq_n, {OPTION_WINDOW_PROBE: b''})
+            self._send(probe)
+            self._arm_persist_timer()
+
+    def _transmit_buffered(self):
+        """
+        Moves the packages waiting in the buffer into the window, as long as it has room. Must
+        hold `transmit_lock`
+        """
+        while not self.app_sent_buffer.empty() and self._window_has_room(self.app_sent_buffer.queue[0]):
+            new_pkg = self.app_sent_buffer.get()
+            self.send_buffer_bytes -= len(new_pkg.payload)
+            self.send_buffer_cond.notify_all()
+            # Update the package timestamp
+            new_pkg.tick()
+            # Update the package ack_number
+            new_pkg.ack_n = self.r_seq_n
+            # Insert it into the transmit buffer and send it
+            self.gbn_window.append(new_pkg)
+            self.window_bytes += len(new_pkg.payload)
+            self._send_data(new_pkg)
+
+        self._arm_retransmission_timer()
+        self._arm_persist_timer()
+
+        if self.app_sent_buffer.empty() and len(self.gbn_window) == 0:
+            with self.can_close_cond:
+                self.can_close_cond.notify()
+
+    def _accepted_packet_size(self):
+        """
+        Biggest package this end accepts: `max_packet_size`, as long as PACKAGES_PER_SOCKET_BUFFER
+        of them fit in the receive buffer of the socket
+        """
+        fitting = self.kernel_recv_buffer // PACKAGES_PER_SOCKET_BUFFER
+        return max(min(self.max_packet_size, fitting), MAX_PACKET_SIZE)
+
+    def _negotiate(self, packet):
+        """
+        Enables the options that both ends support, from the SYN or SYN+ACK sent by the remote host
+        """
+        options = packet.options
+        self.sack_permitted = self.sack and OPTION_SACK_PERMITTED in options
+        self.flow_control = OPTION_RECV_WINDOW in options
+        if self.flow_control:
+            self.remote_window, = SIZE_OPTION.unpack(options[OPTION_RECV_WINDOW])
+        if OPTION_MAX_PACKET_SIZE in options:
+            remote_max_packet_size, = SIZE_OPTION.unpack(options[OPTION_MAX_PACKET_SIZE])
+        else:
+            remote_max_packet_size = MAX_PACKET_SIZE
+        self.packet_size = min(self.packet_size, remote_max_packet_size)
+        # Hosts that don't announce their size don't answer probes either
+        if self.pmtu_probing and self.dont_fragment and OPTION_MAX_PACKET_SIZE in options:
+            max_packet_size = min(self.max_packet_size, remote_max_packet_size)
+            self.prober = PathMTUProber(self.packet_size, max_packet_size)
+
+    def _probe_path_mtu(self):
+        """
+        Sends the next path MTU probe, if the search isn't over. Must hold `transmit_lock`
+        """
+        if self.prober is None or self.stop_listening or self.probe_timer is not None:
+            return
+        while True:
+            size = self.prober.next_probe()
+            if size is None:
+                return
+            try:
+                self._send(UDPPacket.create_probe(size))
+            except OSError as e:
+                if e.errno != errno.EMSGSIZE:
+                    raise
+                # Bigger than the MTU the kernel knows of, no need to wait for it to be lost
+                self.prober.on_probe_lost(too_big=True)
+                continue
+            self.probe_timer = self.timers.call_later(self.rto, self._on_probe_timeout)
+            return
+
+    def _on_probe_timeout(self):
+        with self.transmit_lock:
+            self.probe_timer = None
+            if self.stop_listening:
+                return
+            logger.debug(f"[{self.id}] probe lost, {self.prober!r}")
+            self.prober.on_probe_lost()
+            self._probe_path_mtu()
+
+    def _on_probe_acked(self, size):
+        """
+        The remote host received the probe of `size` bytes. Must hold `transmit_lock`
+        """
+        if self.prober is None:
+            return
+        if self.probe_timer is not None:
+            self.probe_timer.cancel()
+            self.probe_timer = None
+        if self.prober.on_probe_acked(size):
+            self.packet_size = self.prober.size
+            logger.info(f"[{self.id}] package size raised to {self.packet_size} bytes")
+        self._probe_path_mtu()
+
+    def _send_data(self, package, retransmit=False):
+        """
+        Sends a data package of the window. If it doesn't fit the path any more (EMSGSIZE) the
+        package size is lowered and the package is left to the retransmission timer. Must hold
+        `transmit_lock`
+        """
+        try:
+            self._send(package, retransmit)
+        except OSError as e:
+            if e.errno != errno.EMSGSIZE:
+                raise
+            size = UDPPacket.HEADER_SIZE + len(package.payload)
+            if size > self.packet_size:
+                # Cut before the package size was lowered, it was already dealt with
+                return
+            logger.info(f"[{self.id}] package of {size} bytes rejected by the kernel (EMSGSIZE)")
+            if self.prober is not None:
+                self.prober.on_packet_too_big(size)
+            self._lower_packet_size()
+
+    def _detect_black_hole(self):
+        """
+        Packages bigger than the base size lost on every retransmission timeout may be dropped
+        by the path without telling (a black hole): the package size falls back to the base one
+        and probing starts over. Must hold `transmit_lock`
+        """
+        if self.prober is None or self.timeouts_in_a_row < BLACK_HOLE_TIMEOUTS:
+            return
+        if self.packet_size <= self.prober.base_size:
+            return
+        logger.info(f"[{self.id}] {self.timeouts_in_a_row} timeouts in a row with packages of "
+                    f"{self.packet_size} bytes, suspecting a black hole")
+        self.timeouts_in_a_row = 0
+        self.prober.on_black_hole()
+        self._lower_packet_size()
+
+    def _lower_packet_size(self):
+        """
+        Falls back to the size the prober settled on (the base size without probing) and probes
+        for bigger ones again. Must hold `transmit_lock`
+
+        The packages in the window keep their size: the remote host may have received them, their
+        sequence numbers can't change. The ones still in the send buffer are split again
+        """
+        size = self.prober.size if self.prober is not None else BASE_PACKET_SIZE
+        if size >= self.packet_size:
+            return
+        self.packet_size = size
+        logger.info(f"[{self.id}] package size lowered to {self.packet_size} bytes")
+        self._split_buffered()
+        if self.probe_timer is not None:
+            # The probe in flight belongs to the previous search
+            self.probe_timer.cancel()
+            self.probe_timer = None
+        self._probe_path_mtu()
+
+    def _split_buffered(self):
+        """
+        Splits again the packages of the send buffer, none of them was sent yet, into packages of
+        the current size. Must hold `transmit_lock`
+        """
+        if self.app_sent_buffer.empty():
+            return
+        buffered = list(self.app_sent_buffer.queue)
+        self.app_sent_buffer.queue.clear()
+        data = b''.join(package.payload for package in buffered)
+        seq_n = buffered[0].seq_n
+        for chunk in chunked(data, self.packet_size - UDPPacket.HEADER_SIZE):
+            self.app_sent_buffer.put(UDPPacket.create_data(seq_n, self.r_seq_n, chunk))
+            seq_n += 1
+        self.seq_n = seq_n - 1
+
+    def _new_connection(self, sock=None):
+        """
+        Returns a new ReliableUDPSocket configured as this one
+        """
+        estimator = self.rtt_estimator
+        return ReliableUDPSocket(window_size=self.window_size, rto=estimator.initial_rto,
+                                 rtx_delay=self.rtx_delay, arq=self.arq,
+                                 min_rto=estimator.min_rto, max_rto=estimator.max_rto,
+                                 idle_timeout=self.idle_timeout,
+                                 congestion_control=self.congestion_control, sock=sock,
+                                 recv_batch=self.recv_batch, ack_every=self.ack_every,
+                                 ack_delay=self.ack_delay, sack=self.sack,
+                                 packet_size=self.packet_size,
+                                 max_packet_size=self.max_packet_size,
+                                 pmtu_probing=self.pmtu_probing,
+                                 socket_buffer_size=self.socket_buffer_size,
+                                 recv_buffer_size=self.recv_buffer_size,
+                                 send_buffer_size=self.send_buffer_size)
 
     def _fork(self, remote_address):
         """
@@ -273,13 +985,35 @@ class ReliableUDPSocket(ReliableSocket):
         with the client once a connection is initialized (SYN).
         Therefore we will have one "fork" for each client connected to the server
         """
-        new_socket = ReliableUDPSocket()
+        new_socket = self._new_connection()
         new_socket.bind(self.sock.getsockname())
         new_socket.sock.connect(remote_address)
         new_socket.id = f"Server: {remote_address[0]}:{remote_address[1]}"
         return new_socket
 
+    def _demux_connection(self, remote_address):
+        """
+        Returns a new connection with `remote_address` that shares the listening socket
+
+        It doesn't have a listening thread, the listening socket hands it the packages sent by
+        `remote_address`. It is registered in the connections table until its resources are
+        released
+        """
+        new_socket = self._new_connection(sock=self.sock)
+        new_socket.peer_address = remote_address
+        new_socket.listener = self
+        new_socket.server_mode = True
+        new_socket.id = f"Server: {remote_address[0]}:{remote_address[1]}"
+        with self.connections_lock:
+            self.connections[remote_address] = new_socket
+        return new_socket
+
     def release_resources(self):
+        if self.listener:
+            # The socket belongs to the listener, we only stop receiving its packages
+            with self.listener.connections_lock:
+                self.listener.connections.pop(self.peer_address, None)
+            return
         self.sock.shutdown(socket.SHUT_RDWR)
         self.sock.close()
 
@@ -299,68 +1033,221 @@ class ReliableUDPSocket(ReliableSocket):
             self.listening_thread.start()
 
     def _listen(self):
-        print(self.listening_thread)
         if not self.listening_thread:
             self.listening_thread = Thread(name=f'{self.id}-Listener',
                                            target=self._start_listening,
                                            daemon=True)
             self.listening_thread.start()
 
-    def _start_retransmission_thread(self):
-        if not self.retransmission_thread:
-            self.retransmission_thread = Thread(name=f'{self.id}-Tx',
-                                              target=self._start_retransmission,
-                                              daemon=True)
-            self.retransmission_thread.start()
-
-    def _start_retransmission(self):
+    def _arm_retransmission_timer(self):
         """
-        Method in charge of checking timeouts and retransmitting packages
+        Makes sure the retransmission timer fires no later than the oldest unacknowledged package
+        expires. Must hold `transmit_lock`
+
+        A timer that fires earlier than needed just re-arms itself, so it is only rescheduled when
+        the deadline moves backwards
         """
-        while True:
+        deadline = self._retransmission_deadline()
+        if deadline is None:
+            return
+        if self.rtx_timer is not None:
+            if not self.rtx_timer.cancelled and self.rtx_timer.deadline <= deadline:
+                return
+            self.rtx_timer.cancel()
+        self.rtx_timer = self.timers.call_at(deadline, self._on_retransmission_timeout)
+
+    def _on_retransmission_timeout(self):
+        with self.transmit_lock:
+            self.rtx_timer = None
+            if self.stop_listening:
+                return
             try:
-                # Wait for Retransmission timeout
-                # TODO: Validate time of sleep, should be less than RTO
-                time.sleep(ReliableUDPSocket.RTO)
+                self._retransmit_expired()
+            except OSError as e:
+                # The datagrams didn't leave (e.g. ECONNREFUSED from a previous one). They are
+                # retried after a backed off RTO, the timer mustn't fire again right away
+                logger.debug(f"[{self.id}] retransmission failed: {e}")
+                for packet in self.gbn_window:
+                    if not packet.acked:
+                        packet.tick()
+                self.rtt_estimator.backoff()
+            finally:
+                self._arm_retransmission_timer()
+
+    def _finish_transmission(self):
+        """
+        Called once the FIN exchange is done. The server keeps answering retransmitted FINs for a
+        while, the client can release its resources right away
+        """
+        with self.transmit_lock:
+            self.stop_transmission = True
+            if self.linger_timer is None:
+                lingering_timeouts = self.desconnected_timeouts if self.server_mode else 0
+                self.linger_timer = self.timers.call_later(lingering_timeouts * self.rto,
+                                                           self._on_linger_timeout)
+
+    def _on_linger_timeout(self):
+        logger.debug(f"Not transmitting any more to {self.getpeername()}")
+        self._shutdown()
+
+    def _start_idle_timer(self):
+        if self.idle_timeout:
+            self.idle_timer = self.timers.call_at(self.last_activity + self.idle_timeout,
+                                                  self._on_idle_timeout)
+
+    def _on_idle_timeout(self):
+        """
+        Drops the connection if nothing was received for `idle_timeout` seconds. Received
+        packages only update `last_activity`, so the timer is rescheduled here instead of on
+        every package
+        """
+        if self.stop_listening:
+            return
+        if time.time() - self.last_activity < self.idle_timeout:
+            self._start_idle_timer()
+            return
+        logger.info(f"Connection {self.id} idle for {self.idle_timeout} seconds, dropping it")
+        self._shutdown()
+
+    def _shutdown(self):
+        """
+        Stops the connection: cancels its timers, releases the socket and wakes up the readers
+        """
+        with self.transmit_lock:
+            if self.stop_listening:
+                return
+            self.stop_listening = True
+            for timer in (self.rtx_timer, self.linger_timer, self.idle_timer, self.ack_timer,
+                          self.probe_timer, self.persist_timer):
+                if timer is not None:
+                    timer.cancel()
+            self.send_buffer_cond.notify_all()
+        self.release_resources()
+        with self.recv_buffer_cond:
+            self.recv_buffer_cond.notify_all()
+        with self.can_close_cond:
+            self.can_close_cond.notify_all()
+        with self.fin_cond:
+            self.fin_cond.notify_all()
 
-                if self.stop_transmission and not self.server_mode:
-                    self.stop_listening = True
-                    self.release_resources()
-                    break
-                elif self.stop_transmission and self.server_mode and self.desconnected_timeouts > 0:
-                    self.desconnected_timeouts -= 1
-                elif self.desconnected_timeouts == 0:
-                    logger.debug(f"Server is not transmitting any more to client {self.getpeername()}")
-                    self.stop_listening = True
-                    self.release_resources()
-                    break
+    def _retransmission_deadline(self):
+        """
+        Time at which the oldest unacknowledged package expires. Must hold `transmit_lock`
+        """
+        pending = [p.time for p in self.gbn_window if not p.acked]
+        if not pending:
+            return None
+        return min(pending) + self.rto
 
-                #if not self.connected_to and len(self.sent_buffer) == 0:
-                #    return
-                # Retransmission of data frames
-                with self.transmit_lock:
-                    logger.debug("CURRENT TRANSMIT BUFFER %r", self.gbn_window)
-                    if any(p.expired(self.RTO) for p in self.gbn_window):
-                        # We must retransmit the whole window
-                        for packet in self.gbn_window:
-                            #if packet.expired(self.RTO):
-                            # Retransmitting packet
-                            logger.debug(f'[{self.id}] retransmitting %r due to timeout',
-                                         packet)
-                            packet.tick()
-                            # TODO: Should I change the ACK_NUMBER?
-                            self._send(packet, retransmit=True)
-                    # TODO: Remove, this is for testing.. Just one RTO
-                    # self.gbn_window = []
-            except Exception as e:
-                logger.error("Exception: {}".format(str(e)))
-                return
+    def _retransmit_expired(self):
+        """
+        Retransmits the packages whose timer expired and backs off the RTO. Must hold
+        `transmit_lock`
+        """
+        logger.debug("CURRENT TRANSMIT BUFFER %r", self.gbn_window)
+        rto = self.rto
+        pending = [p for p in self.gbn_window if not p.acked]
+        if self.arq == ARQ_SELECTIVE_REPEAT:
+            # Only the segments whose own timer expired are retransmitted
+            to_retransmit = [p for p in pending if p.expired(rto)]
+        elif any(p.expired(rto) for p in pending):
+            # We must retransmit the whole window
+            to_retransmit = pending
+        else:
+            to_retransmit = []
+
+        for packet in to_retransmit:
+            logger.debug(f'[{self.id}] retransmitting %r due to timeout', packet)
+            packet.tick()
+            packet.retransmitted = True
+            # TODO: Should I change the ACK_NUMBER?
+            self._send_data(packet, retransmit=True)
+        if to_retransmit:
+            self.rtt_estimator.backoff()
+            self.congestion.on_timeout(len(pending))
+            self.dup_acks = 0
+            self.recovery_point = self.seq_n
+            self.timeouts_in_a_row += 1
+            self._detect_black_hole()
+
+    def _send_window(self):
+        """
+        Amount of packages allowed in the window: the congestion window, bounded by `window_size`
+        """
+        return min(self.window_size, self.congestion.window)
+
+    def _on_duplicate_ack(self, ack_n):
+        """
+        Counts the ACKs that don't advance the head of the window. After DUP_ACK_THRESHOLD of them
+        the head is considered lost: it is retransmitted right away (fast retransmit) and the
+        congestion window is reduced. Must hold `transmit_lock`
+
+        The receiver repeats the ACK of the last package received in order for every package
+        that arrives after the missing one
+        """
+        pending = [p for p in self.gbn_window if not p.acked and p.is_data()]
+        if not pending:
+            return
+        if ack_n != pending[0].seq_n - 1:
+            return
+        if pending[0].seq_n <= self.recovery_point:
+            # Still recovering from the last loss, the window was already reduced
+            return
+
+        self.dup_acks += 1
+        if self.dup_acks < self.DUP_ACK_THRESHOLD:
+            return
+
+        if self.arq == ARQ_GO_BACK_N:
+            # Go-Back-N receivers discard everything after the missing package
+            to_retransmit = pending
+        elif self.sack_permitted:
+            # Every package before the last one the receiver reported is a hole
+            sacked = [p.seq_n for p in self.gbn_window if p.acked and p.is_data()]
+            to_retransmit = [p for p in pending if sacked and p.seq_n < max(sacked)] or pending[:1]
+        else:
+            to_retransmit = pending[:1]
+        for packet in to_retransmit:
+            logger.debug(f'[{self.id}] fast retransmit of %r', packet)
+            packet.tick()
+            packet.retransmitted = True
+            self._send_data(packet, retransmit=True)
+        self.congestion.on_duplicate_acks(len(pending))
+        self.dup_acks = 0
+        self.recovery_point = self.seq_n
 
     def _send(self, package, retransmit=False):
         """
         Sends a package through the socket
         """
-        self.sock.send(package.to_bytes())
+        self.send_syscalls += 1
+        # Scatter-gather: the payload goes straight from the app's buffer to the kernel
+        if self.peer_address and HAS_SENDMSG:
+            self.sock.sendmsg(package.to_buffers(), [], 0, self.peer_address)
+        elif self.peer_address:
+            self.sock.sendto(package.to_bytes(), self.peer_address)
+        elif HAS_SENDMSG:
+            self.sock.sendmsg(package.to_buffers())
+        else:
+            self.sock.send(package.to_bytes())
+
+    def _receive_batch(self):
+        """
+        Blocks until a datagram arrives and then drains, without blocking, the ones already queued
+        in the socket, up to `recv_batch` datagrams
+        :return: list of (data, address)
+        """
+        self.recv_syscalls += 1
+        batch = [self.sock.recvfrom(self.max_packet_size)]
+        if MSG_DONTWAIT is None:
+            return batch
+        while len(batch) < self.recv_batch:
+            self.recv_syscalls += 1
+            try:
+                batch.append(self.sock.recvfrom(self.max_packet_size, MSG_DONTWAIT))
+            except BlockingIOError:
+                break
+        return batch
 
     def _start_listening_connections(self):
         """
@@ -374,51 +1261,56 @@ class ReliableUDPSocket(ReliableSocket):
                     self.getpeername())
         while True:
             logger.info("Haciendo escucha")
-            # TODO: Is a lock required?
-            # Mepa que no, porque este sock solo tiene laddr y no tiene raddr (0.0.0.0:*)
-            # Por lo que es un sock que sólo se usa para iniciar las conexiones
-            data, address = self.sock.recvfrom(self.MAX_PACKET_SIZE)
+            try:
+                batch = self._receive_batch()
+            except OSError as e:
+                logger.debug(f"Stopped listening for new connections: {e}")
+                break
 
-            packet = UDPPacket.from_bytes(data)
-            logger.info("Received from %r, packet %r", address, packet)
+            # Demultiplexing server: the packages of each connection, in order of arrival
+            received = {}
+            for data, address in batch:
+                try:
+                    packet = UDPPacket.from_bytes(data)
+                except ValueError as e:
+                    logger.debug(f"Discarding datagram from {address}: {e}")
+                    continue
+                logger.info("Received from %r, packet %r", address, packet)
+
+                if self.demux:
+                    with self.connections_lock:
+                        conn = self.connections.get(address)
+                    if conn:
+                        # The package belongs to an already started connection
+                        received.setdefault(conn, []).append(packet)
+                        continue
 
-            if not packet.is_syn():
-                logger.info("Packet is not SYN, therefore should not be able to set a connection")
-                continue
-            # TODO: Debería validar 2 cosas
-            #  1) Que sea un SYN. De no ser un SYN el protocolo se rompe.
-            #  2) Si es un SYN y ya tenemos una conexión con dicho remote_address, en teoria tenemos
-            #     un problema, porque ese paquete debería haber llegado a un sock con una conexión
-            #     ya establecida
-            # if address not in self.connections_table:
-            new_socket = self._fork(address)
-            logger.debug("creando socket")
-            # self.connections_table[address] = new_socket
-            logger.debug(self.new_connections_queue)
-            self.new_connections_queue.put((new_socket, address))
-
-            """
-            else:
-                self.connections_table[address] += 1
-                logger.info("Another package received from %r, total %d",
-                            address,
-                            self.connections_table[address])
-            """
+                if not packet.is_syn():
+                    logger.info("Packet is not SYN, therefore should not be able to set a connection")
+                    continue
+
+                if self.demux:
+                    # No new socket, the connection is served through this one
+                    new_socket = self._demux_connection(address)
+                    new_socket._negotiate(packet)
+                    new_socket._open()
+                else:
+                    new_socket = self._fork(address)
+                    new_socket._negotiate(packet)
+                logger.debug("creando socket")
+                self.new_connections_queue.put((new_socket, address))
+
+            for conn, packets in received.items():
+                try:
+                    conn._handle_batch(packets)
+                except Exception as e:
+                    logger.error(f"Exception handling package of {conn.id}: {e}")
 
     def _start_listening(self):
         """
         Listens for incoming packets from already started connections (doesn't mean estabished)
         """
-        self.connection_status = STATUS_SYN
-        logger.debug(f"{self.connection_status} - {self.server_mode}")
-        """
-        When entering this method as a server-mode, it means a client had sent a SYN package.
-        Therefore we must send the due SYN+ACK to the client
-        """
-        if self.server_mode:
-            synack_pkg = UDPPacket.create_synack()
-            self.sock.send(synack_pkg.to_bytes())
-            logger.info("sent SYN+ACK package %r", synack_pkg)
+        self._open()
 
         logger.info("listening with sock laddr: %r, raddr: %r",
                     self.getsockname(),
@@ -426,10 +1318,12 @@ class ReliableUDPSocket(ReliableSocket):
         while True:
 
             logger.info("Haciendo escucha")
-            # TODO: Is a lock required?
-            # Mepa que no, porque este sock solo tiene laddr y no tiene raddr (0.0.0.0:*)
-            # Por lo que es un sock que sólo se usa para iniciar las conexiones
-            data, address = self.sock.recvfrom(self.MAX_PACKET_SIZE)
+            try:
+                batch = self._receive_batch()
+            except OSError as e:
+                # Either the resources were released or the remote host is gone
+                logger.debug(f"Stopped listening to {self.id}: {e}")
+                break
 
             if self.stop_listening:
                 logger.debug(f"Server is not listening any more to client {self.getpeername()}")
@@ -437,133 +1331,241 @@ class ReliableUDPSocket(ReliableSocket):
                     logger.debug(f"Buffer is... %r", self.app_recv_buffer)
                 break
 
-            packet = UDPPacket.from_bytes(data)
-            logger.info("Received from %r, packet %r", address, packet)
-
-            if self.server_mode and packet.is_syn() and self.connection_status == STATUS_SYN:
-                # Server receives a SYN (duplicate)
-                # We have already sent a SYN+ACK. Receiveing a new SYN from the same client
-                # means either the package was lost or was received after the timeout and the
-                # client sent a new SYN. Therefore we must re-send the SYN+ACK
-                synack_pkg = UDPPacket.create_synack()
-                self.sock.send(synack_pkg.to_bytes())
-                logger.info("Sent SYN+ACK package %r", synack_pkg)
-
-            elif self.server_mode and packet.is_ack() and packet.ack_n == 0 and self.connection_status == STATUS_SYN:
-                # Server receives an ACK (to its SYN+ACK)
-                self.connection_status = STATUS_ESTABLISHED
-                logger.debug("Connection established")
-            elif not self.server_mode and packet.is_synack() and self.connection_status == STATUS_SYN:
-                # Client receives a SYN+ACK
-                logger.debug("Received SYN+ACK.. Sending ACK")
-                with self.transmit_lock:
-                    pkg = min(self.gbn_window)
-                    assert pkg.is_syn()
-                    assert pkg.seq_n == packet.ack_n
-                    self.gbn_window.remove(pkg)
-                self.connection_status = STATUS_ESTABLISHED
-                self.sock.send(UDPPacket.create_ack(0, 0).to_bytes())
-
-                # Notify the reception of the SYN+ACK
-                with self.established_cond:
-                    logger.debug("Releasing established condition")
-                    self.established_cond.notify()
-            elif packet.is_ack() and self.connection_status == STATUS_ESTABLISHED:
-                # Either Server o Client received an ACK for a package
-                with self.transmit_lock:
-                    if not self.gbn_window:
-                        logger.debug("No packages to ACK")
-                        continue
+            packets = []
+            for data, _ in batch:
+                try:
+                    packets.append(UDPPacket.from_bytes(data))
+                except ValueError as e:
+                    logger.debug(f"Discarding datagram from {self.getpeername()}: {e}")
+            logger.info("Received %d packets from %r", len(packets), self.getpeername())
+            self._handle_batch(packets)
 
-                    if not any(p.seq_n==packet.ack_n for p in self.gbn_window):
-                        # The ack isn't of any of the packages contained in the buffer
-                        logger.debug("ACK number doesn't match any package in the window")
-                        continue
-                    else:
-                        for buff in self.gbn_window:
-                            if buff.seq_n <= packet.ack_n:
-                                self.gbn_window.remove(buff)
-
-                    # TODO: Deprecated
-                    """
-                    min_pkg = min(self.gbn_window)
-                    # TODO: FIX. Actually we must remove from the buffer, ALL packages whose seq_n
-                    # is <= than the ACK. We might have lost an ACK
-                    if min_pkg.seq_n != packet.ack_n:
-                        logger.debug("ACK Number doesnt match the min SEQ_N in window")
-                        # Do Nothing
-                        continue
+        # Wake up anyone still waiting on this connection
+        self._shutdown()
 
-                    self.gbn_window.remove(min_pkg)
-                    """
-
-                    # We now have more space in the window
-                    while not self.app_sent_buffer.empty() and len(self.gbn_window) < self.window_size:
-                        new_pkg = self.app_sent_buffer.get()
-                        # Update the package timestamp
-                        new_pkg.tick()
-                        # Update the package ack_number
-                        with self.r_seq_n_lock:
-                            new_pkg.ack_n = self.r_seq_n
-                        # Insert it into the transmit buffer and send it
-                        self.gbn_window.append(new_pkg)
-                        self._send(new_pkg)
-
-                    if self.app_sent_buffer.empty() and len(self.gbn_window) == 0:
-                        with self.can_close_cond:
-                            self.can_close_cond.notify()
-            elif packet.is_data():
-                if self.connection_status == STATUS_SYN and self.server_mode:
-                    # We might have lost the client's ACK of the three way handshake
-                    if packet.seq_n == 1:
-                        self.connection_status = STATUS_ESTABLISHED
-                        logger.debug("Connection established")
-                    else:
-                        logger.debug("SYN Status and received a DATA package that isn't the first")
-                        continue
+    def _open(self):
+        """
+        Starts the connection, the packages received from now on belong to it
+        """
+        self.connection_status = STATUS_SYN
+        logger.debug(f"{self.connection_status} - {self.server_mode}")
+        """
+        When entering this method as a server-mode, it means a client had sent a SYN package.
+        Therefore we must send the due SYN+ACK to the client
+        """
+        if self.server_mode:
+            synack_pkg = UDPPacket.create_synack(self._syn_options())
+            self._send(synack_pkg)
+            logger.info("sent SYN+ACK package %r", synack_pkg)
 
-                logger.debug("Received DATA")
-                with self.r_seq_n_lock:
-                    if self.r_seq_n + 1 == packet.seq_n:
-                        # It is a new package, one we haven't processed yet
+    def _handle_batch(self, packets):
+        """
+        Processes the packages received in one batch holding `transmit_lock` only once. The DATA
+        received in order is acknowledged with a single cumulative ACK once the batch is done, or
+        later by the delayed ACK timer if there are less than `ack_every` segments to acknowledge
+        """
+        with self.transmit_lock:
+            for packet in packets:
+                self._handle_packet(packet)
+            if self.ack_now or self.unacked_segments >= self.ack_every:
+                self._send_ack()
+            elif self.unacked_segments and self.ack_timer is None:
+                self.ack_timer = self.timers.call_later(self.ack_delay, self._on_ack_timeout)
+
+    def _send_ack(self, segment=None):
+        """
+        Acknowledges every package received in order so far. Must hold `transmit_lock`
+
+        `segment` is the seq_n of a package just received out of order and buffered (Selective
+        Repeat). If there are no SACK blocks to report it, the ACK acknowledges it on its own, or
+        the sender would retransmit it
+        """
+        self.unacked_segments = 0
+        self.ack_now = False
+        if self.ack_timer is not None:
+            self.ack_timer.cancel()
+            self.ack_timer = None
+        options = {}
+        if self.sack_permitted and self.out_of_order_buffer:
+            blocks = to_ranges(self.out_of_order_buffer)
+            options[OPTION_SACK] = pack_sack_blocks(blocks)
+        elif segment is not None:
+            options[OPTION_SEGMENT_ACK] = SEQ_N_OPTION.pack(segment)
+        if self.flow_control:
+            self.advertised_window = self._free_window()
+            options[OPTION_RECV_WINDOW] = SIZE_OPTION.pack(self.advertised_window)
+        self._send(UDPPacket.create_ack(self.seq_n, self.r_seq_n, options))
+
+    def _on_ack_timeout(self):
+        with self.transmit_lock:
+            self.ack_timer = None
+            if self.stop_listening or not self.unacked_segments:
+                return
+            self._send_ack()
+
+    def _handle_packet(self, packet):
+        """
+        Connection's state machine, processes a package received from the remote host. Must hold
+        `transmit_lock`
+        """
+        self.last_activity = time.time()
+
+        if self.server_mode and packet.is_syn() and self.connection_status == STATUS_SYN:
+            # Server receives a SYN (duplicate)
+            # We have already sent a SYN+ACK. Receiveing a new SYN from the same client
+            # means either the package was lost or was received after the timeout and the
+            # client sent a new SYN. Therefore we must re-send the SYN+ACK
+            synack_pkg = UDPPacket.create_synack(self._syn_options())
+            self._send(synack_pkg)
+            logger.info("Sent SYN+ACK package %r", synack_pkg)
+
+        elif self.server_mode and packet.is_ack() and packet.ack_n == 0 and self.connection_status == STATUS_SYN:
+            # Server receives an ACK (to its SYN+ACK)
+            self.connection_status = STATUS_ESTABLISHED
+            logger.debug("Connection established")
+            self._probe_path_mtu()
+        elif not self.server_mode and packet.is_synack() and self.connection_status == STATUS_SYN:
+            # Client receives a SYN+ACK
+            logger.debug("Received SYN+ACK.. Sending ACK")
+            pkg = min(self.gbn_window)
+            assert pkg.is_syn()
+            assert pkg.seq_n == packet.ack_n
+            self.gbn_window.remove(pkg)
+            if not pkg.retransmitted:
+                self.rtt_estimator.sample(time.time() - pkg.time)
+            self._negotiate(packet)
+            self.connection_status = STATUS_ESTABLISHED
+            self._send(UDPPacket.create_ack(0, 0))
+            self._probe_path_mtu()
+
+            # Notify the reception of the SYN+ACK
+            with self.established_cond:
+                logger.debug("Releasing established condition")
+                self.established_cond.notify()
+        elif packet.is_ack() and self.connection_status == STATUS_ESTABLISHED:
+            # Either Server o Client received an ACK for a package
+            options = packet.options
+            probe_size = options.get(OPTION_PMTU_PROBE)
+            if probe_size is not None:
+                # Answer to a probe, it doesn't acknowledge any package
+                self._on_probe_acked(SIZE_OPTION.unpack(probe_size)[0])
+                return
+            if OPTION_WINDOW_PROBE in options:
+                # Answered along with the rest of the batch, the ACK carries the window
+                self.ack_now = True
+                return
+
+            window_opened = False
+            if self.flow_control and OPTION_RECV_WINDOW in options:
+                remote_window, = SIZE_OPTION.unpack(options[OPTION_RECV_WINDOW])
+                window_opened = remote_window > self.remote_window
+                self.remote_window = remote_window
+
+            if not self.gbn_window:
+                logger.debug("No packages to ACK")
+                self._transmit_buffered()
+                return
+
+            if self.sack_permitted:
+                self._mark_sacked(options)
+            self._mark_segment_acked(options)
+            acked = self._mark_acked(packet.ack_n)
+            if not acked:
+                # The ack isn't of any of the packages contained in the buffer
+                logger.debug("ACK number doesn't match any package in the window")
+                if window_opened:
+                    # A window update, not a duplicate
+                    self._transmit_buffered()
+                else:
+                    self._on_duplicate_ack(packet.ack_n)
+                return
+            self.congestion.on_ack(len(acked))
+            self.dup_acks = 0
+            self.timeouts_in_a_row = 0
+
+            # Karn's rule, retransmitted packages are ambiguous and can't be sampled
+            sampled = [p for p in acked if p.seq_n == packet.ack_n and not p.retransmitted]
+            if sampled:
+                self.rtt_estimator.sample(time.time() - sampled[0].time)
+
+            # Slide the window past every acknowledged package at its head
+            while self.gbn_window and self.gbn_window[0].acked:
+                self.window_bytes -= len(self.gbn_window.pop(0).payload)
+
+            # We now have more space in the window
+            self._transmit_buffered()
+        elif packet.is_data():
+            if self.connection_status == STATUS_SYN and self.server_mode:
+                # We might have lost the client's ACK of the three way handshake
+                if packet.seq_n == 1:
+                    self.connection_status = STATUS_ESTABLISHED
+                    logger.debug("Connection established")
+                    self._probe_path_mtu()
+                else:
+                    logger.debug("SYN Status and received a DATA package that isn't the first")
+                    return
+
+            logger.debug("Received DATA")
+            if packet.seq_n > self.r_seq_n and not self._fits_window(packet.payload):
+                # The remote host ignored the window we advertised. Dropped, the ACK tells it
+                # the window again
+                logger.debug("Packet received beyond the receive buffer, discarding")
+                self.ack_now = True
+                return
+            if self.r_seq_n + 1 == packet.seq_n:
+                # It is a new package, one we haven't processed yet
+                self.r_seq_n += 1
+                self.unacked_segments += 1
+                if self.receiving_gap:
+                    # The sender is recovering from a loss, don't make it wait for the ACK
+                    self.receiving_gap = False
+                    self.ack_now = True
+                with self.recv_buffer_cond:
+                    self.app_recv_buffer.append(packet.payload)
+                    # Selective Repeat: the package may fill a gap, so everything buffered
+                    # right after it can be delivered too
+                    while self.r_seq_n + 1 in self.out_of_order_buffer:
                         self.r_seq_n += 1
-                        with self.recv_buffer_cond:
-                            if packet.seq_n == 67:
-                                logger.debug("EL PAYLOAD ES %r", packet.payload)
-                            self.app_recv_buffer += packet.payload
-                            self.recv_buffer_cond.notify()
-
-                        with self.transmit_lock:
-                            ack = UDPPacket.create_ack(self.seq_n, packet.seq_n)
-                            self._send(ack)
-                    elif packet.seq_n <= self.r_seq_n:
-                        # It is a package we've already processed. The client might not have received
-                        # the ACK
-                        with self.transmit_lock:
-                            ack = UDPPacket.create_ack(self.seq_n, packet.seq_n)
-                            self._send(ack)
-                    else:
-                        # Packet arrived out of order, discarding
-                        # We send an ACK with the seq_n of the last package we acked.
-                        logger.debug("Packet received out of order")
-                        with self.transmit_lock:
-                            ack = UDPPacket.create_ack(self.seq_n, self.r_seq_n)
-                            self.gbn_window.append(ack)
-                            self._send(ack)
-            elif self.server_mode and packet.is_fin() and self.connection_status == STATUS_ESTABLISHED:
-                # Server receives a FIN
-                finack_pkg = UDPPacket.create_finack()
-                self.sock.send(finack_pkg.to_bytes())
-                logger.info("Sent FIN+ACK package %r", finack_pkg)
-                self.stop_transmission = True
-            elif not self.server_mode and packet.is_finack() and self.connection_status == STATUS_ESTABLISHED:
-                # Client receives FIN+ACK
-                with self.fin_cond:
-                    pkg = min(self.gbn_window)
-                    assert pkg.is_fin()
-                    self.gbn_window.remove(pkg)
-                    logger.debug("Releasing closing condition")
-                    self.stop_transmission = True
-                    self.fin_cond.notify()
+                        self.app_recv_buffer.append(self.out_of_order_buffer.pop(self.r_seq_n))
+                    self.recv_buffer_cond.notify()
+            elif packet.seq_n <= self.r_seq_n:
+                # It is a package we've already processed. The client might not have received
+                # the ACK, it is acknowledged along with the rest of the batch
+                self.ack_now = True
             else:
-                logger.debug("Bad Package")
+                # Packet arrived out of order. The ACK of the last package received in order is
+                # repeated right away, the sender detects the loss through these duplicates
+                logger.debug("Packet received out of order")
+                segment = None
+                if self.arq == ARQ_SELECTIVE_REPEAT:
+                    if packet.seq_n > self.r_seq_n + self.window_size:
+                        logger.debug("Packet received beyond the receive window, discarding")
+                        return
+                    # We keep it until the gap is filled
+                    self.out_of_order_buffer[packet.seq_n] = packet.payload
+                    segment = packet.seq_n
+                self.receiving_gap = True
+                self._send_ack(segment)
+        elif packet.is_probe() and self.connection_status == STATUS_ESTABLISHED:
+            # The size of the probe is acknowledged right away, it isn't application data
+            size = SIZE_OPTION.pack(UDPPacket.HEADER_SIZE + len(packet.payload))
+            self._send(UDPPacket.create_ack(self.seq_n, self.r_seq_n, {OPTION_PMTU_PROBE: size}))
+        elif self.server_mode and packet.is_fin() and self.connection_status == STATUS_ESTABLISHED:
+            # Server receives a FIN
+            finack_pkg = UDPPacket.create_finack()
+            self._send(finack_pkg)
+            logger.info("Sent FIN+ACK package %r", finack_pkg)
+            self._finish_transmission()
+        elif not self.server_mode and packet.is_finack() and self.connection_status == STATUS_ESTABLISHED:
+            # Client receives FIN+ACK
+            with self.fin_cond:
+                fins = [p for p in self.gbn_window if p.is_fin()]
+                if not fins:
+                    logger.debug("Duplicate FIN+ACK")
+                    return
+                self.gbn_window.remove(fins[0])
+                logger.debug("Releasing closing condition")
+                self._finish_transmission()
+                self.fin_cond.notify()
+        else:
+            logger.debug("Bad Package")
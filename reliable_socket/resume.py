@@ -0,0 +1,162 @@
+"""
+Files received under a temporary name, so an interrupted transfer continues where it stopped
+
+The data goes to `<name>.part`. Every `CHECKPOINT_SIZE` bytes it is flushed to disk and a small
+sidecar, `<name>.part.json`, records how many bytes are durable (committed) and their CRC-32.
+After a crash the part file is trusted up to the committed length only. The CRC lets the sender
+check that the committed bytes are a prefix of the file it holds before resuming from there.
+"""
+import os
+import json
+import zlib
+import struct
+
+PART_SUFFIX = '.part'
+SIDECAR_SUFFIX = '.part.json'
+CHECKPOINT_SIZE = 8 * 1024 * 1024  # Bytes received between two checkpoints
+CRC_BLOCK_SIZE = 1024 * 1024  # Bytes read per call while computing a CRC
+# Sent right before the data: offset of the file it starts at
+OFFSET = struct.Struct('!Q')
+
+
+def file_crc(fd, end, start=0, crc=0):
+    """
+    CRC-32 of the bytes [start, end) of the file descriptor `fd`, continuing from `crc`
+    """
+    position = start
+    while position < end:
+        data = os.pread(fd, min(CRC_BLOCK_SIZE, end - position), position)
+        if not data:
+            break
+        crc = zlib.crc32(data, crc)
+        position += len(data)
+    return crc
+
+
+def prefix_matches(path, length, crc):
+    """
+    Whether the first `length` bytes of the file at `path` have the given CRC-32
+    """
+    try:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size < length:
+                return False
+            return file_crc(file.fileno(), length) == crc
+    except FileNotFoundError:
+        return False
+
+
+def load_state(path):
+    """
+    Size of the file, committed length and CRC left by a previous transfer into `path`, None if
+    there's nothing to resume
+    """
+    try:
+        with open(path + SIDECAR_SUFFIX) as sidecar:
+            state = json.load(sidecar)
+        size, committed, crc = state['size'], state['committed'], state['crc']
+        if os.path.getsize(path + PART_SUFFIX) < committed:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return size, committed, crc
+
+
+class PartialFile:
+    """
+    Receives the `size` bytes of the file at `path` through its part file
+
+    `committed` and `crc` describe the durable prefix left by a previous transfer of a file of
+    the same size, if any. `open(offset)` starts receiving at `offset`, which must be 0 or
+    `committed`. `finish()` renames the part file once the whole file arrived.
+    """
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.part_path = path + PART_SUFFIX
+        self.sidecar_path = path + SIDECAR_SUFFIX
+        self.file = None
+        self.committed, self.crc = self._load()
+        self.received = self.committed
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(path={self.path!r}, size={self.size}, "
+                f"committed={self.committed}, received={self.received})")
+
+    def _load(self):
+        """
+        Committed length and CRC left by a previous transfer, (0, 0) if there's nothing to resume
+        """
+        state = load_state(self.path)
+        if state is None or state[0] != self.size:
+            return 0, 0
+        return state[1:]
+
+    def open(self, offset=0):
+        """
+        Opens the part file to receive from `offset` on. Returns the file
+        """
+        if offset not in (0, self.committed):
+            raise ValueError(f"Can't resume {self.path} at {offset}, {self.committed} bytes are committed")
+        if offset == 0:
+            self.committed = self.crc = 0
+        # Readable too, the checkpoints read back what they commit
+        mode = 'r+b' if offset else 'w+b'
+        self.file = open(self.part_path, mode)
+        # Whatever follows the committed prefix may not have reached the disk whole
+        self.file.truncate(offset)
+        self.file.seek(offset)
+        self.received = offset
+        return self.file
+
+    def on_write(self, nbytes):
+        """
+        To be called with the amount of bytes of every write, checkpoints every CHECKPOINT_SIZE
+        """
+        self.received += nbytes
+        if self.received - self.committed >= CHECKPOINT_SIZE:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """
+        Makes the bytes received so far durable and records them in the sidecar
+        """
+        if self.file is None or self.received == self.committed:
+            return
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.crc = file_crc(self.file.fileno(), self.received, self.committed, self.crc)
+        self.committed = self.received
+        state = {'size': self.size, 'committed': self.committed, 'crc': self.crc}
+        tmp_path = self.sidecar_path + '.tmp'
+        with open(tmp_path, 'w') as sidecar:
+            json.dump(state, sidecar)
+            sidecar.flush()
+            os.fsync(sidecar.fileno())
+        os.replace(tmp_path, self.sidecar_path)
+
+    def close(self):
+        """
+        Stops receiving, keeping what arrived for a later transfer to resume from
+        """
+        if self.file is None:
+            return
+        self.checkpoint()
+        self.file.close()
+        self.file = None
+
+    def finish(self):
+        """
+        Closes the part file and, if the whole file arrived, moves it to `path`. Returns whether
+        it did
+        """
+        self.close()
+        if self.committed != self.size:
+            return False
+        os.replace(self.part_path, self.path)
+        try:
+            os.remove(self.sidecar_path)
+        except FileNotFoundError:
+            # Nothing was checkpointed, the file is empty
+            pass
+        return True
@@ -1,14 +1,27 @@
-from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket, ReliableTCPSocket
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket, ReliableTCPSocket, \
+    ARQ_SELECTIVE_REPEAT
+from reliable_socket.async_reliable_transfer_protocol import AsyncReliableUDPSocket
+from reliable_socket.file_transfer import recv_to_file, recv_exact, recv_exact_async, \
+    recv_range, FILE_BUFFER_SIZE
+from reliable_socket.resume import PartialFile, OFFSET, prefix_matches
+from reliable_socket.striping import StripedUploads, split_ranges, STRIPE_CHUNK_SIZE
+from reliable_socket.compression import send_compressed, recv_compressed, choose_codec
+from reliable_socket.delta import SignatureCache, apply_delta, DELTA_SUFFIX
+from reliable_socket.chunk_store import ChunkStore, CHUNK_LIST_HEADER, CHUNK_ENTRY, CHUNK_INDEX, \
+    MIN_CHUNK_SIZE, MAX_CHUNK_SIZE, MAX_CHUNKS
+from reliable_socket.directory import scan, outdated, pack_manifest, recv_manifest, \
+    pack_indexes, send_entries, recv_entries
+from reliable_socket.protocol import Request, Response, OP_UPLOAD, OP_DOWNLOAD, \
+    OP_UPLOAD_RANGE, OP_DOWNLOAD_RANGE, OP_UPLOAD_DELTA, OP_UPLOAD_CHUNKS, OP_STAT, OP_UPLOAD_DIR, \
+    OP_DOWNLOAD_DIR, OP_BYE, STATUS_OK, STATUS_BAD_REQUEST, STATUS_NOT_FOUND
 from threading import Thread
+import asyncio
 import traceback
 import os
-import json
 import logging
 
 
-BUFFER_SIZE = 1024
-MODE_UPLOAD = 'upload'
-MODE_DOWNLOAD = 'download'
+BUFFER_SIZE = 1024  # Bytes of file data per send of the asyncio worker
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - [%(threadName)s] - %(message)s')
@@ -16,19 +29,33 @@ logger.setLevel(logging.ERROR)
 
 
 class Server(Thread):
-    def __init__(self, storage, port, host):
+    def __init__(self, storage, port, host, demux=False, buffer_size=FILE_BUFFER_SIZE,
+                 dedup=False):
         Thread.__init__(self)
         self.port = port
+        # UDP only: serve every client through the listening socket
+        self.demux = demux
+        # Bytes of file data moved per call
+        self.buffer_size = buffer_size
         self.socket = ReliableTCPSocket()
         self.host = host
         self.storage = storage
         self.clients = []
+        # Shared by the workers receiving the ranges of the same upload
+        self.striped_uploads = StripedUploads()
+        # Signatures of the files in storage, for delta uploads
+        self.signatures = SignatureCache()
+        # Content-addressed storage of the files uploaded in chunks, None if disabled
+        self.chunk_store = ChunkStore(storage) if dedup else None
 
     def set_sw_socket(self):
-        self.socket = ReliableUDPSocket(window_size = 1)
+        self.socket = ReliableUDPSocket(window_size = 1, demux=self.demux)
 
     def set_gbn_socket(self):
-        self.socket = ReliableUDPSocket(window_size = 4)
+        self.socket = ReliableUDPSocket(demux=self.demux)
+
+    def set_sr_socket(self):
+        self.socket = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, demux=self.demux)
 
     def __setup__(self):
         self.socket.bind((self.host, self.port))
@@ -40,7 +67,9 @@ class Server(Thread):
         while True:
             conn, (client_host, client_port) = self.socket.accept()
             logger.info(f'Incoming Connection from {client_host} {client_port}')
-            new_client = ServerWorker(client_port, client_host, conn, self.storage)
+            new_client = ServerWorker(client_port, client_host, conn, self.storage,
+                                      self.buffer_size, self.striped_uploads, self.signatures,
+                                      self.chunk_store)
             new_client.start()
             self.clients.append(new_client)
 
@@ -50,77 +79,485 @@ class Server(Thread):
 
 
 class ServerWorker(Thread):
-    def __init__(self, port, host, socket, source_dir):
+    def __init__(self, port, host, socket, source_dir, buffer_size=FILE_BUFFER_SIZE,
+                 striped_uploads=None, signatures=None, chunk_store=None):
         Thread.__init__(self)
         self.port = port
         self.host = host
         self.socket = socket
         self.source_dir = source_dir
+        self.buffer_size = buffer_size
+        self.striped_uploads = striped_uploads if striped_uploads is not None else StripedUploads()
+        self.signatures = signatures if signatures is not None else SignatureCache()
+        self.chunk_store = chunk_store
 
     def __close_conection(self):
         self.socket.close()
 
-    def __send_status(self, code, msg):
-        response = { "code": code, "msg": msg }
-        self.socket.send(json.dumps(response).encode())
+    def __send_status(self, status, msg=None, size=0, offset=0, **options):
+        if msg is not None:
+            options["msg"] = msg
+        Response(status, size, offset, options).send(self.socket)
 
     def run(self):
-        mode = self.socket.recv(BUFFER_SIZE).decode()
-        if mode == MODE_UPLOAD:
-            logger.info(f"Client {self.host}:{self.port} mode: {MODE_UPLOAD} - recving")
-            self.__send_status(200, "OK - upload")
-            self.recv_file()
-        elif mode == MODE_DOWNLOAD:
-            logger.info(f"Client {self.host}:{self.port} mode: {MODE_DOWNLOAD} - sending")
-            self.__send_status(200, "OK - download")
-            self.send_file()
-        else:
-            logger.info("Invalid mode: ", mode)
+        try:
+            while self.serve(Request.recv(self.socket)):
+                pass
+            logger.info(f"Client {self.host}:{self.port} ended the session")
+        except ConnectionError:
+            logger.info(f"Client {self.host}:{self.port} disconnected")
+        except ValueError as e:
+            # The stream is out of step, nothing after this can be read
+            logger.info(f"Client {self.host}:{self.port} sent an invalid stream: {e}")
+        finally:
+            self.__close_conection()
 
-    def recv_file(self):
-        filename = self.socket.recv(BUFFER_SIZE).decode()
-        filename = os.path.basename(filename)
-        logger.info(f"Client {self.host}:{self.port} filename to save: {filename}")
-        self.__send_status(200, "OK - filename")
+    def serve(self, request):
+        """
+        Serves a request of the session. Returns False once the client ends it
+        """
+        request.name = os.path.basename(request.name)
+        if request.op == OP_UPLOAD:
+            logger.info(f"Client {self.host}:{self.port} upload: {request.name} - recving")
+            self.recv_file(request)
+        elif request.op == OP_DOWNLOAD:
+            logger.info(f"Client {self.host}:{self.port} download: {request.name} - sending")
+            self.send_file(request)
+        elif request.op == OP_UPLOAD_RANGE:
+            logger.info(f"Client {self.host}:{self.port} upload range: {request.name} - recving")
+            self.recv_file_range(request)
+        elif request.op == OP_DOWNLOAD_RANGE:
+            logger.info(f"Client {self.host}:{self.port} download range: {request.name} - sending")
+            self.send_file(request, ranged=True)
+        elif request.op == OP_UPLOAD_DELTA:
+            logger.info(f"Client {self.host}:{self.port} upload delta: {request.name} - recving")
+            self.recv_file_delta(request)
+        elif request.op == OP_UPLOAD_CHUNKS:
+            logger.info(f"Client {self.host}:{self.port} upload chunks: {request.name} - recving")
+            self.recv_file_chunks(request)
+        elif request.op == OP_STAT:
+            self.stat_file(request)
+        elif request.op == OP_UPLOAD_DIR:
+            logger.info(f"Client {self.host}:{self.port} upload directory: {request.name} - recving")
+            self.recv_directory(request)
+        elif request.op == OP_DOWNLOAD_DIR:
+            logger.info(f"Client {self.host}:{self.port} download directory: {request.name} - sending")
+            self.send_directory(request)
+        elif request.op == OP_BYE:
+            return False
+        else:
+            logger.info(f"Invalid operation: {request.op}")
+            self.__send_status(STATUS_BAD_REQUEST, f"Invalid operation {request.op}")
+        return True
 
-        file_size = int(self.socket.recv(BUFFER_SIZE).decode())
+    def recv_file(self, request):
+        filename, file_size = request.name, request.size
+        codec = choose_codec(request.options.get("compression"))
         logger.info(f"Client {self.host}:{self.port} filename size: {file_size}")
-        self.__send_status(200, "OK - file_size")
+        # What's left of a previous upload of the file, the client resumes from there if the
+        # checksum matches its copy
+        partial = PartialFile(f"{self.source_dir}/{filename}", file_size)
+        self.__send_status(STATUS_OK, offset=partial.committed, crc=partial.crc,
+                           compression=codec)
+        offset, = OFFSET.unpack(recv_exact(self.socket, OFFSET.size))
+        logger.info(f"Client {self.host}:{self.port} uploading from byte {offset}")
 
-        recieved_file = open(f"{self.source_dir}/{filename}", 'wb')
-        data_recieved = 0
-        while True:
-            data = self.socket.recv(BUFFER_SIZE)
-            data_recieved += len(data)
-            logger.debug("Ultimo fragmento leido fue %r", data)
-            recieved_file.write(data)
-            if data_recieved == file_size:
-                logger.info(f"Receiving finished: closing connection {self.host}:{self.port} ")
-                break
-            logger.info(f"Llevo leidos {data_recieved} de {file_size}")
+        recieved_file = partial.open(offset)
+        try:
+            if codec:
+                stats = recv_compressed(self.socket, recieved_file, file_size - offset, codec,
+                                        partial.on_write)
+                data_recieved = offset + stats.raw_bytes
+                logger.info(f"Client {self.host}:{self.port} upload: {stats}")
+            else:
+                # TCP: spliced from the socket into the file inside the kernel
+                data_recieved = offset + recv_to_file(self.socket, recieved_file,
+                                                      file_size - offset, self.buffer_size,
+                                                      partial.on_write)
+        finally:
+            finished = partial.finish()
+        if not finished:
+            logger.info(f"Client {self.host}:{self.port} closed the connection, "
+                        f"{partial.committed} of {file_size} bytes kept to resume")
+        else:
+            self.__forget_chunked(filename)
+        logger.info(f"Llevo leidos {data_recieved} de {file_size}")
+        logger.info(f"Receiving finished: closing connection {self.host}:{self.port} ")
         logger.info("TERMINO DE GUARDAR EL ARCHIVO")
-        recieved_file.close()
 
 
-    def send_file(self):
-        rcv_packet = self.socket.recv(BUFFER_SIZE)
-        filename = rcv_packet.decode()
+    def recv_file_range(self, request):
+        """
+        Receives a range of a striped upload, written in place into the file shared with the
+        other connections of the upload
+        """
+        filename, file_size, offset = request.name, request.size, request.offset
+        count = request.options.get("count", 0)
+        if not (0 < count and offset + count <= file_size):
+            self.__send_status(STATUS_BAD_REQUEST,
+                               f"Invalid range {offset}+{count} of {file_size} bytes")
+            return
+        logger.info(f"Client {self.host}:{self.port} uploading {filename} [{offset}, {offset + count})")
+
+        path = f"{self.source_dir}/{filename}"
+        fd = self.striped_uploads.open(path, file_size)
+        try:
+            self.__send_status(STATUS_OK)
+            data_recieved = recv_range(self.socket, fd, offset, count, self.buffer_size)
+        finally:
+            os.close(fd)
+        if data_recieved < count:
+            logger.info(f"Client {self.host}:{self.port} closed the connection, range incomplete")
+        elif self.striped_uploads.on_range(path, file_size, offset, count):
+            logger.info(f"Striped upload of {filename} complete")
+            self.__forget_chunked(filename)
+
+    def recv_file_delta(self, request):
+        """
+        Receives the delta of a file against the copy in storage, and rebuilds the new file from
+        both into a temporary one that replaces the copy
+        """
+        filename, file_size = request.name, request.size
+        path = f"{self.source_dir}/{filename}"
+        signature = self.signatures.get(path)
+        self.__send_status(STATUS_OK)
+        # Binary, its length is in its header
+        self.socket.sendall(signature.to_bytes())
+        logger.info(f"Client {self.host}:{self.port} delta of {filename} against {len(signature)} blocks")
+
+        tmp_path = path + DELTA_SUFFIX
+        basis = open(path, 'rb') if len(signature) else None
+        try:
+            with open(tmp_path, 'wb') as recieved_file:
+                matches, literal, copied = apply_delta(
+                    self.socket, basis.fileno() if basis else None, recieved_file,
+                    signature.block_size)
+            if matches and literal + copied == file_size:
+                os.replace(tmp_path, path)
+                self.__forget_chunked(filename)
+                self.__send_status(STATUS_OK, literal=literal, copied=copied)
+                logger.info(f"Client {self.host}:{self.port} delta of {filename}: {literal} bytes "
+                            f"sent, {copied} copied")
+            else:
+                self.__send_status(STATUS_BAD_REQUEST, "The rebuilt file doesn't match")
+        finally:
+            if basis:
+                basis.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def recv_file_chunks(self, request):
+        """
+        Receives a file into the deduplicating storage: the client lists the chunks of the file
+        right after the request, and sends only the ones the storage lacks
+        """
+        filename, file_size = request.name, request.size
+        size, count = CHUNK_LIST_HEADER.unpack(recv_exact(self.socket, CHUNK_LIST_HEADER.size))
+        # Only the last chunk of a file can be shorter than MIN_CHUNK_SIZE
+        if count > min(MAX_CHUNKS, size // MIN_CHUNK_SIZE + 1):
+            raise ValueError(f"List of {count} chunks for a file of {size} bytes")
+        chunks = list(CHUNK_ENTRY.iter_unpack(recv_exact(self.socket, count * CHUNK_ENTRY.size)))
+        if any(length > MAX_CHUNK_SIZE for _, length in chunks):
+            raise ValueError(f"Chunk longer than {MAX_CHUNK_SIZE} bytes")
+        if self.chunk_store is None:
+            self.__send_status(STATUS_BAD_REQUEST, "Deduplicating storage disabled")
+            return
+        missing = self.chunk_store.missing(chunks)
+        self.__send_status(STATUS_OK)
+        self.socket.sendall(CHUNK_INDEX.pack(len(missing)) +
+                            b''.join(CHUNK_INDEX.pack(index) for index in missing))
+        logger.info(f"Client {self.host}:{self.port} {filename}: {len(missing)} of {count} chunks missing")
+
+        corrupted = 0
+        for index in missing:
+            digest, length = chunks[index]
+            try:
+                self.chunk_store.put(digest, recv_exact(self.socket, length))
+            except ValueError:
+                corrupted += 1
+        if corrupted or sum(length for _, length in chunks) != file_size:
+            self.__send_status(STATUS_BAD_REQUEST, f"{corrupted} chunks don't match their hash")
+            return
+        self.chunk_store.save_manifest(filename, file_size, chunks)
+        try:
+            # The file stored in chunks replaces the one uploaded whole
+            os.remove(f"{self.source_dir}/{filename}")
+        except FileNotFoundError:
+            pass
+        sent = sum(chunks[index][1] for index in missing)
+        self.__send_status(STATUS_OK, chunks=count, sent=len(missing), bytes=sent)
+
+    def recv_directory(self, request):
+        """
+        Receives the files of a directory that the storage lacks or has outdated: the client
+        lists all of them right after the request, and sends back to back the ones asked for
+        """
+        try:
+            entries = recv_manifest(self.socket)
+        except ValueError as e:
+            self.__send_status(STATUS_BAD_REQUEST, str(e))
+            return
+        if not request.name:
+            self.__send_status(STATUS_BAD_REQUEST, "Missing directory name")
+            return
+        root = f"{self.source_dir}/{request.name}"
+        indexes = outdated(entries, scan(root))
+        # The list of files follows the response in the same write
+        self.socket.sendall(Response(STATUS_OK).to_bytes() + pack_indexes(indexes))
+        logger.info(f"Client {self.host}:{self.port} {request.name}: {len(indexes)} of "
+                    f"{len(entries)} files needed")
+        received = recv_entries(self.socket, root, entries, indexes, self.buffer_size)
+        self.__send_status(STATUS_OK, files=len(indexes), bytes=received)
+
+    def send_directory(self, request):
+        """
+        Sends the files of a directory of the storage that the client lacks or has outdated: the
+        client lists the ones it has right after the request. The list of the files sent follows
+        the response, and the files follow it, without waiting for the client
+        """
+        try:
+            existing = recv_manifest(self.socket)
+        except ValueError as e:
+            self.__send_status(STATUS_BAD_REQUEST, str(e))
+            return
+        root = f"{self.source_dir}/{request.name}"
+        if not request.name or not os.path.isdir(root):
+            self.__send_status(STATUS_NOT_FOUND, f"directory: {request.name} not found")
+            return
+        entries = scan(root)
+        entries = [entries[index] for index in outdated(entries, existing)]
+        size = sum(size for _, size, _ in entries)
+        self.socket.sendall(Response(STATUS_OK, size).to_bytes() + pack_manifest(entries))
+        logger.info(f"Client {self.host}:{self.port} {request.name}: sending {len(entries)} files")
+        send_entries(self.socket, root, entries, range(len(entries)))
+
+    def __forget_chunked(self, filename):
+        """
+        The file just uploaded whole replaces the one stored in chunks, if any
+        """
+        if self.chunk_store is not None:
+            self.chunk_store.remove_manifest(filename)
+
+    def __open_stored(self, filename):
+        """
+        Opens the file `filename` of the storage, rebuilt from its chunks if it's stored in them
+        :return: (file, size)
+        """
+        if self.chunk_store is not None:
+            file = self.chunk_store.open(filename)
+            if file is not None:
+                return file, file.size
+        path = f"{self.source_dir}/{filename}"
+        file = open(path, 'rb')
+        return file, os.fstat(file.fileno()).st_size
+
+    def __stored_path(self, filename):
+        """
+        Path of what stores the file `filename`: its manifest if it's stored in chunks
+        """
+        if self.chunk_store is not None:
+            manifest = self.chunk_store.manifest_path(filename)
+            if os.path.exists(manifest):
+                return manifest
+        return f"{self.source_dir}/{filename}"
+
+    def stat_file(self, request):
+        """
+        Answers with the size and the modification time, in nanoseconds, of the file in storage
+        """
+        filename = request.name
+        try:
+            file, file_size = self.__open_stored(filename)
+            file.close()
+            mtime = os.stat(self.__stored_path(filename)).st_mtime_ns
+        except FileNotFoundError:
+            self.__send_status(STATUS_NOT_FOUND, f"file: {filename} not found")
+            return
+        self.__send_status(STATUS_OK, size=file_size, mtime=mtime)
+
+    def __requested_range(self, request, file_size):
+        """
+        Range of the file of a stripe of a striped download, the same split the client makes
+        :return: (offset, count)
+        """
+        stripe = request.options.get("stripe", 0)
+        ranges = split_ranges(file_size, request.options.get("stripes", 1),
+                              request.options.get("chunk_size", STRIPE_CHUNK_SIZE))
+        if stripe < len(ranges):
+            return ranges[stripe]
+        # More stripes than chunks, nothing for this one
+        return file_size, 0
+
+    def __resume_offset(self, request, file_size):
+        """
+        Byte the download starts at: where the partial copy of the client ends, as long as it is
+        a prefix of the file
+        """
+        filename, offset, crc = request.name, request.offset, request.options.get("crc", 0)
+        if not 0 < offset <= file_size or request.options.get("size") != file_size:
+            return 0
+        if self.chunk_store is not None and self.chunk_store.open(filename) is not None:
+            matches = self.chunk_store.prefix_matches(filename, offset, crc)
+        else:
+            matches = prefix_matches(f"{self.source_dir}/{filename}", offset, crc)
+        return offset if matches else 0
+
+    def send_file(self, request, ranged=False):
+        """
+        Sends the requested file from the byte the client resumes at, or only the range of the
+        stripe it asks for if `ranged`
+        """
+        filename = request.name
         logger.info(f"Client {self.host}:{self.port} requested file: {filename}")
         try:
-            file_requested = open(f"{self.source_dir}/{filename}", 'rb')
-            self.__send_status(200, os.path.getsize(f"{self.source_dir}/{filename}"))
-            self.socket.recv(BUFFER_SIZE)
-            while(True):
-                file_buffered = file_requested.read(BUFFER_SIZE)
-                while(file_buffered):
-                    self.socket.send(file_buffered)
-                    file_buffered = file_requested.read(BUFFER_SIZE)
-                if not file_buffered:
-                    logger.info(f"Sending finished: closing connection {self.host}:{self.port}")
-                    file_requested.close()
-                    break
+            file_requested, file_size = self.__open_stored(filename)
         except FileNotFoundError:
-            response = {"code": 400}
-            self.socket.send(json.dumps(response).encode())
             logger.info(traceback.format_exc())
-            self.socket.send(f"file: {filename} not found".encode())
+            self.__send_status(STATUS_NOT_FOUND, f"file: {filename} not found")
+            return
+
+        with file_requested:
+            codec = None
+            if ranged:
+                offset, count = self.__requested_range(request, file_size)
+                self.__send_status(STATUS_OK, size=file_size, offset=offset, count=count)
+            else:
+                offset, count = self.__resume_offset(request, file_size), None
+                codec = choose_codec(request.options.get("compression"))
+                self.__send_status(STATUS_OK, size=file_size, offset=offset, compression=codec)
+            logger.info(f"Client {self.host}:{self.port} downloading from byte {offset}")
+            if codec:
+                stats = send_compressed(self.socket, file_requested, codec, offset)
+                logger.info(f"Client {self.host}:{self.port} download: {stats}")
+            elif count != 0:
+                # The socket reads the file itself, without going through a buffer of ours
+                self.socket.sendfile(file_requested, offset, count)
+            logger.info(f"Sending finished: closing connection {self.host}:{self.port}")
+
+
+class AsyncServer():
+    """
+    asyncio counterpart of Server. Every client is served by a task instead of a thread, through
+    a single UDP endpoint
+    """
+    def __init__(self, storage, port, host):
+        self.port = port
+        self.socket = AsyncReliableUDPSocket()
+        self.host = host
+        self.storage = storage
+        self.clients = []
+
+    def set_sw_socket(self):
+        self.socket = AsyncReliableUDPSocket(window_size = 1)
+
+    def set_gbn_socket(self):
+        self.socket = AsyncReliableUDPSocket()
+
+    def set_sr_socket(self):
+        self.socket = AsyncReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT)
+
+    async def __setup__(self):
+        self.socket.bind((self.host, self.port))
+        await self.socket.listen()
+        logger.info(f"Listening in {self.host} and {self.port}")
+
+    async def main_loop(self):
+        await self.__setup__()
+        while True:
+            conn, (client_host, client_port) = await self.socket.accept()
+            logger.info(f'Incoming Connection from {client_host} {client_port}')
+            new_client = AsyncServerWorker(client_port, client_host, conn, self.storage)
+            self.clients.append(asyncio.create_task(new_client.run()))
+            self.clients = [client for client in self.clients if not client.done()]
+
+
+class AsyncServerWorker():
+    def __init__(self, port, host, socket, source_dir):
+        self.port = port
+        self.host = host
+        self.socket = socket
+        self.source_dir = source_dir
+
+    async def __send_status(self, status, msg=None, size=0, offset=0, **options):
+        if msg is not None:
+            options["msg"] = msg
+        await Response(status, size, offset, options).send_async(self.socket)
+
+    async def run(self):
+        try:
+            while await self.serve(await Request.recv_async(self.socket)):
+                pass
+            logger.info(f"Client {self.host}:{self.port} ended the session")
+        except ConnectionError:
+            logger.info(f"Client {self.host}:{self.port} disconnected")
+        except ValueError as e:
+            logger.info(f"Client {self.host}:{self.port} sent an invalid stream: {e}")
+        finally:
+            await self.socket.close()
+
+    async def serve(self, request):
+        """
+        Serves a request of the session. Returns False once the client ends it
+        """
+        request.name = os.path.basename(request.name)
+        if request.op == OP_UPLOAD:
+            logger.info(f"Client {self.host}:{self.port} upload: {request.name} - recving")
+            await self.recv_file(request)
+        elif request.op == OP_DOWNLOAD:
+            logger.info(f"Client {self.host}:{self.port} download: {request.name} - sending")
+            await self.send_file(request)
+        elif request.op == OP_BYE:
+            return False
+        else:
+            # Striped, delta, chunked and stat requests are only served by ServerWorker
+            logger.info(f"Invalid operation: {request.op}")
+            await self.__send_status(STATUS_BAD_REQUEST, f"Invalid operation {request.op}")
+        return True
+
+    async def recv_file(self, request):
+        filename, file_size = request.name, request.size
+        logger.info(f"Client {self.host}:{self.port} filename size: {file_size}")
+        partial = PartialFile(f"{self.source_dir}/{filename}", file_size)
+        # Compression isn't offered here, the data always goes raw
+        await self.__send_status(STATUS_OK, offset=partial.committed, crc=partial.crc)
+        offset, = OFFSET.unpack(await recv_exact_async(self.socket, OFFSET.size))
+
+        recieved_file = partial.open(offset)
+        try:
+            buffer = memoryview(bytearray(BUFFER_SIZE))
+            data_recieved = offset
+            while data_recieved < file_size:
+                read = await self.socket.recv_into(buffer, min(BUFFER_SIZE, file_size - data_recieved))
+                if not read:
+                    raise ConnectionError("Connection closed before receiving the whole file")
+                data_recieved += read
+                recieved_file.write(buffer[:read])
+                partial.on_write(read)
+        finally:
+            partial.finish()
+        logger.info(f"Receiving finished: closing connection {self.host}:{self.port} ")
+
+    async def send_file(self, request):
+        filename = request.name
+        logger.info(f"Client {self.host}:{self.port} requested file: {filename}")
+        path = f"{self.source_dir}/{filename}"
+        try:
+            file_requested = open(path, 'rb')
+        except FileNotFoundError:
+            logger.info(traceback.format_exc())
+            await self.__send_status(STATUS_NOT_FOUND, f"file: {filename} not found")
+            return
+
+        with file_requested:
+            file_size = os.fstat(file_requested.fileno()).st_size
+            offset, crc = request.offset, request.options.get("crc", 0)
+            if not (0 < offset <= file_size and request.options.get("size") == file_size and
+                    prefix_matches(path, offset, crc)):
+                offset = 0
+            await self.__send_status(STATUS_OK, size=file_size, offset=offset)
+            file_requested.seek(offset)
+            file_buffered = file_requested.read(BUFFER_SIZE)
+            while file_buffered:
+                await self.socket.send(file_buffered)
+                file_buffered = file_requested.read(BUFFER_SIZE)
+        logger.info(f"Sending finished: closing connection {self.host}:{self.port}")
@@ -1,6 +1,7 @@
 import argparse
 import socket
-from reliable_socket.server import Server
+from reliable_socket.server import Server, AsyncServer
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,18 +16,29 @@ parser.add_argument('-q', '--quiet', help="decrease output verbosity", action="s
 parser.add_argument('-p', '--port', help="service port", type=int)
 parser.add_argument('-H', '--host', help="service IP address", default=socket.gethostname())
 parser.add_argument('-s', '--storage', help="storage dir path]")
-parser.add_argument('-P', '--proto', help="protocol tcp, sw (udp stop&wait) or gbn (udp go back n)")
+parser.add_argument('-D', '--demux', help="udp: serve every client through a single socket", action="store_true")
+parser.add_argument('-c', '--chunks', help="deduplicating storage: files uploaded in chunks are stored by content", action="store_true")
+parser.add_argument('-A', '--asyncio', help="udp: use the asyncio implementation", action="store_true")
+parser.add_argument('-P', '--proto', help="protocol tcp, sw (udp stop&wait), gbn (udp go back n) or sr (udp selective repeat)")
 
 args = parser.parse_args()
 
 logger.info(args)
 if((args.storage is not None) and (args.port is not None) and (args.host is not None)):
-    server = Server(args.storage, args.port, args.host)
+    if args.asyncio:
+        server = AsyncServer(args.storage, args.port, args.host)
+    else:
+        server = Server(args.storage, args.port, args.host, demux=args.demux, dedup=args.chunks)
     if args.proto == 'ws':
         server.set_sw_socket()
     elif args.proto == 'gbn':
         server.set_gbn_socket()
-    server.main_loop()
+    elif args.proto == 'sr':
+        server.set_sr_socket()
+    if args.asyncio:
+        asyncio.run(server.main_loop())
+    else:
+        server.main_loop()
 else:
     logger.info("Paramters missing")
     exit()
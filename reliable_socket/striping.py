@@ -0,0 +1,79 @@
+"""
+Striped transfers: a file is split into byte ranges, each one moved on its own connection
+
+A single connection is bound by its window and the RTT. With several of them the windows add
+up. Each range is written in place with `os.pwrite` into a file preallocated to the final size,
+under a temporary name until every range arrived.
+"""
+import os
+from threading import Lock
+
+from reliable_socket.file_transfer import preallocate
+
+STRIPES = 4  # Connections of a striped transfer
+STRIPE_CHUNK_SIZE = 1024 * 1024  # Bytes. Ranges are multiples of it, and it is the pwrite size
+STRIPED_SUFFIX = '.stripes'
+
+
+def split_ranges(size, stripes, chunk_size=STRIPE_CHUNK_SIZE):
+    """
+    Splits `size` bytes into at most `stripes` contiguous ranges, multiples of `chunk_size`
+    except for the last one
+    :return: list of (offset, count)
+    """
+    if not size:
+        return []
+    chunks = -(-size // chunk_size)
+    stripe_size = -(-chunks // max(stripes, 1)) * chunk_size
+    return [(offset, min(stripe_size, size - offset)) for offset in range(0, size, stripe_size)]
+
+
+def open_striped(path, size):
+    """
+    Opens the temporary file of a striped transfer into `path`, preallocated to `size` bytes.
+    Returns its file descriptor
+    """
+    fd = os.open(path + STRIPED_SUFFIX, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size != size:
+            preallocate(fd, size)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+class StripedUploads:
+    """
+    Ranges received of the striped uploads in progress, shared by the workers of a server. The
+    upload is moved into place by the worker that receives its last range
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.uploads = {}  # path: (size, {offset: count})
+
+    def open(self, path, size):
+        """
+        File descriptor to write a range of the upload into `path` of `size` bytes
+        """
+        with self.lock:
+            uploaded_size, _ = self.uploads.get(path, (None, None))
+            if uploaded_size != size:
+                # A new upload, or another one of the same file with a different size
+                self.uploads[path] = (size, {})
+            return open_striped(path, size)
+
+    def on_range(self, path, size, offset, count):
+        """
+        Records that the range was received whole. Returns whether the upload is complete
+        """
+        with self.lock:
+            uploaded_size, ranges = self.uploads.get(path, (None, None))
+            if uploaded_size != size:
+                return False
+            ranges[offset] = count
+            if sum(ranges.values()) < size:
+                return False
+            del self.uploads[path]
+            os.replace(path + STRIPED_SUFFIX, path)
+            return True
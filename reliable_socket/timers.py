@@ -0,0 +1,127 @@
+"""
+Process-wide timer service shared by every ReliableUDPSocket
+
+A single thread owns a heap with every deadline (retransmissions, idle and linger timeouts) of
+all the connections, so the amount of threads doesn't grow with the amount of connections.
+Scheduling is O(log n) and cancelling is O(1): cancelled timers are just flagged and discarded
+once they reach the top of the heap.
+"""
+import heapq
+import itertools
+import logging
+import time
+from threading import Thread, Lock, Condition
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - [%(threadName)s] - %(message)s')
+logger.setLevel(logging.ERROR)
+
+
+class TimerHandle:
+    """
+    Returned by `TimerService.call_at`, used to cancel the timer
+    """
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled', '_service')
+
+    def __init__(self, deadline, callback, args, service):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._service = service
+
+    def __repr__(self):
+        return f"TimerHandle(deadline={self.deadline}, callback={self.callback}, cancelled={self.cancelled})"
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._service._cancelled()
+
+
+class TimerService:
+    """
+    Runs callbacks at a given time on a single background thread
+
+    Callbacks run on the timer thread, so they must be short and never block. Deadlines are
+    expressed in `time.time()` seconds, like the packages timestamps.
+    """
+    def __init__(self, name='TimerService'):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = Condition(Lock())
+        self._cancelled_count = 0
+        self._thread = None
+
+    def __len__(self):
+        """
+        Amount of scheduled (not cancelled) timers
+        """
+        with self._cond:
+            return len(self._heap) - self._cancelled_count
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Schedules `callback(*args)` to run at `deadline`
+        """
+        handle = TimerHandle(deadline, callback, args, self)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), handle))
+            if self._heap[0][2] is handle:
+                # The earliest deadline changed, the thread must recompute how long it sleeps
+                self._cond.notify()
+            if not self._thread:
+                self._thread = Thread(name=self.name, target=self._run, daemon=True)
+                self._thread.start()
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """
+        Schedules `callback(*args)` to run `delay` seconds from now
+        """
+        return self.call_at(time.time() + delay, callback, *args)
+
+    def _cancelled(self):
+        with self._cond:
+            self._cancelled_count += 1
+            # Don't let the heap fill up with dead timers
+            if self._cancelled_count > 64 and self._cancelled_count > len(self._heap) // 2:
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled_count = 0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                        self._cancelled_count -= 1
+                    now = time.time()
+                    if self._heap and self._heap[0][0] <= now:
+                        _, _, handle = heapq.heappop(self._heap)
+                        break
+                    self._cond.wait(self._heap[0][0] - now if self._heap else None)
+                # From now on it can't be cancelled, it is about to run
+                handle.cancelled = True
+
+            try:
+                handle.callback(*handle.args)
+            except Exception as e:
+                logger.error("Exception running timer %r: %s", handle, e)
+
+
+_default_service = None
+_default_service_lock = Lock()
+
+
+def get_timer_service():
+    """
+    Returns the process-wide TimerService
+    """
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = TimerService()
+        return _default_service
@@ -1,6 +1,9 @@
 import argparse
 import socket
-from reliable_socket.client import Client
+from reliable_socket.client import Client, AsyncClient
+from reliable_socket.striping import STRIPE_CHUNK_SIZE
+from reliable_socket.compression import CODEC_NAMES
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,18 +18,50 @@ parser.add_argument('-q', '--quiet', help="decrease output verbosity", action="s
 parser.add_argument('-p', '--port', help="server port", type=int)
 parser.add_argument('-H', '--host', help="host server IP address", default=socket.gethostname())
 parser.add_argument('-s', '--src', help="source file path")
-parser.add_argument('-n', '--name', help="file name")
-parser.add_argument('-P', '--proto', help="protocol tcp, sw (udp stop&wait) or gbn (udp go back n)")
+parser.add_argument('-n', '--name', help="file names, all of them moved on the same connection", nargs='+')
+parser.add_argument('-r', '--recursive', help="the names are directories, moved with every file under them", action="store_true")
+parser.add_argument('-A', '--asyncio', help="udp: use the asyncio implementation", action="store_true")
+parser.add_argument('-S', '--stripes', help="connections of the transfer, each one moves a range of the file", type=int, default=1)
+parser.add_argument('-C', '--chunk-size', help="bytes, the ranges of a striped transfer are multiples of it", type=int, default=STRIPE_CHUNK_SIZE)
+parser.add_argument('-z', '--compression', help="compress the data with the codec, if the server supports it", choices=CODEC_NAMES)
+parser.add_argument('-D', '--delta', help="send only the blocks that changed from the copy of the server", action="store_true")
+parser.add_argument('-c', '--chunks', help="send only the chunks the deduplicating storage of the server lacks", action="store_true")
+parser.add_argument('-P', '--proto', help="protocol tcp, sw (udp stop&wait), gbn (udp go back n) or sr (udp selective repeat)")
 
 args = parser.parse_args()
 
+if args.asyncio and args.recursive:
+    logger.info("Directories can't be moved with the asyncio implementation")
+    exit()
+
 if((args.src is not None) and (args.name is not None) and (args.port is not None) and (args.host is not None)):
-    client = Client(args.src, args.name, args.host, args.port)
+    if args.asyncio:
+        client = AsyncClient(args.src, args.name[0], args.host, args.port)
+    else:
+        client = Client(args.src, args.name[0], args.host, args.port, stripes=args.stripes, chunk_size=args.chunk_size,
+                        compression=args.compression, delta=args.delta,
+                        dedup=args.chunks)
     if args.proto == 'ws':
         client.set_sw_socket()
     elif args.proto == 'gbn':
         client.set_gbn_socket()
-    client.upload()
+    elif args.proto == 'sr':
+        client.set_sr_socket()
+    if args.asyncio:
+        async def upload_all():
+            for name in args.name:
+                client.filename = name
+                await client.upload()
+        asyncio.run(upload_all())
+    else:
+        upload = client.upload_dir if args.recursive else client.upload
+        if len(args.name) > 1:
+            # One session for all of them, instead of a connection per file
+            with client:
+                for name in args.name:
+                    upload(name)
+        else:
+            upload()
 else:
     logger.info("Paramters missing")
     exit()
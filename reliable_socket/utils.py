@@ -1,21 +1,221 @@
 import struct
 import time
+from collections import deque
 
 
 def chunked(source, size):
-    for i in range(0, len(source), size):
-        yield source[i:i+size]
+    """
+    Splits `source` in chunks of `size` bytes. The chunks are memoryviews of `source`, not copies
+    """
+    view = memoryview(source)
+    for i in range(0, len(view), size):
+        yield view[i:i+size]
+
+
+class ByteQueue:
+    """
+    FIFO of bytes backed by a deque of memoryviews
+
+    Appending keeps a reference to the chunk instead of copying it, and reading only copies the
+    bytes that are read, so both are O(1) regardless of how much data is queued
+    """
+    def __init__(self):
+        self._chunks = deque()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return f"ByteQueue(chunks={len(self._chunks)}, size={self._size})"
+
+    def append(self, data):
+        if len(data):
+            self._chunks.append(memoryview(data))
+            self._size += len(data)
+
+    def read(self, size):
+        """
+        Removes and returns up to `size` bytes from the beginning of the queue
+        """
+        if self._chunks and len(self._chunks[0]) >= size:
+            # Most reads are served by the first chunk, no need to join
+            return bytes(self._consume(size))
+        buffer = bytearray(min(size, self._size))
+        read = self.read_into(buffer)
+        return bytes(buffer[:read])
+
+    def read_into(self, buffer, size=0):
+        """
+        Removes up to `size` bytes (or `len(buffer)` if 0) from the beginning of the queue, copying
+        them into `buffer`. Returns the amount of bytes copied
+        """
+        target = memoryview(buffer).cast('B')
+        size = min(size or len(target), len(target), self._size)
+        read = 0
+        while read < size:
+            chunk = self._consume(size - read)
+            target[read:read + len(chunk)] = chunk
+            read += len(chunk)
+        return read
+
+    def _consume(self, size):
+        """
+        Removes and returns up to `size` bytes of the first chunk
+        """
+        chunk = self._chunks[0]
+        if len(chunk) <= size:
+            self._chunks.popleft()
+        else:
+            self._chunks[0] = chunk[size:]
+            chunk = chunk[:size]
+        self._size -= len(chunk)
+        return chunk
+
+
+class RTTEstimator:
+    """
+    Smoothed RTT and RTT variance estimation used to compute the Retransmission Timeout.
+
+    Follows RFC 6298: samples must only be taken from packages that were not retransmitted
+    (Karn's rule) and the RTO is doubled on every timeout until a new sample is taken.
+    """
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+    CLOCK_GRANULARITY = 0.001  # Seconds
+
+    def __init__(self, initial_rto, min_rto, max_rto):
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None
+        self.rttvar = None
+        self.rto = initial_rto
+
+    def sample(self, rtt):
+        """
+        Updates the estimation with a new RTT measurement (in seconds)
+        """
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        rto = self.srtt + max(self.CLOCK_GRANULARITY, self.K * self.rttvar)
+        self.rto = min(max(rto, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        """
+        Exponential backoff, to be called when the retransmission timer expires
+        """
+        self.rto = min(self.rto * 2, self.max_rto)
+
+
+# FLAGS, one bit each
+FLAG_SYN = 0b1000
+FLAG_ACK = 0b0100
+FLAG_FIN = 0b0010
+FLAG_PSH = 0b0001
+
+# OPTIONS, carried in the payload of SYN, SYN+ACK and ACK packages. Encoded like the TCP ones:
+# kind and length (of the whole option) bytes followed by the value. Unknown kinds are ignored,
+# so peers that don't know an option just don't answer it during the handshake
+OPTION_HEADER = struct.Struct('BB')
+OPTION_MAX_PACKET_SIZE = 2  # SYN, SYN+ACK. Biggest package the sender of the option accepts
+OPTION_SACK_PERMITTED = 4  # SYN, SYN+ACK. No value
+OPTION_SACK = 5  # ACK. Blocks of received seq_n, see `pack_sack_blocks`
+OPTION_PMTU_PROBE = 6  # ACK. Size of the probe being acknowledged
+OPTION_RECV_WINDOW = 7  # SYN, SYN+ACK, ACK. Free space in the receive buffer, in bytes
+OPTION_WINDOW_PROBE = 8  # ACK. Asks for the current receive window. No value
+# ACK. seq_n of the package received out of order that the ACK acknowledges on its own, when
+# there are no SACK blocks to report it
+OPTION_SEGMENT_ACK = 9
+SACK_BLOCK = struct.Struct('II')
+SIZE_OPTION = struct.Struct('I')  # Value of the options holding a size, in bytes
+SEQ_N_OPTION = struct.Struct('I')  # Value of the options holding a seq_n
+MAX_SACK_BLOCKS = 8
+
+
+def pack_options(options):
+    """
+    Encodes a {kind: value} dict of options
+    """
+    return b''.join(OPTION_HEADER.pack(kind, OPTION_HEADER.size + len(value)) + value
+                    for kind, value in options.items())
+
+
+def unpack_options(payload):
+    """
+    Decodes the options in `payload` into a {kind: value} dict. Decoding stops at the first
+    malformed option
+    """
+    options = {}
+    view = memoryview(payload)
+    offset = 0
+    while offset + OPTION_HEADER.size <= len(view):
+        kind, length = OPTION_HEADER.unpack_from(view, offset)
+        if length < OPTION_HEADER.size or offset + length > len(view):
+            break
+        options[kind] = view[offset + OPTION_HEADER.size:offset + length]
+        offset += length
+    return options
+
+
+def to_ranges(numbers):
+    """
+    Groups the consecutive `numbers` into sorted (first, last) ranges
+    """
+    ranges = []
+    for n in sorted(numbers):
+        if ranges and ranges[-1][1] + 1 == n:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return [(first, last) for first, last in ranges]
+
+
+def pack_sack_blocks(blocks):
+    """
+    Encodes up to MAX_SACK_BLOCKS (first, last) ranges of received seq_n as a SACK option value
+    """
+    return b''.join(SACK_BLOCK.pack(first, last) for first, last in blocks[:MAX_SACK_BLOCKS])
+
+
+def unpack_sack_blocks(value):
+    return [SACK_BLOCK.unpack_from(value, offset)
+            for offset in range(0, len(value) - SACK_BLOCK.size + 1, SACK_BLOCK.size)]
 
 
 class UDPPacket:
-    HEADER_SIZE = 12
+    """
+    Package of the Reliable Transfer Protocol
+
+    The flags are a single int bitmask. The header is packed only once and cached, changing
+    `ack_n` invalidates it; `seq_n` and `flags` must not change once the package is created
+    """
+    __slots__ = ('seq_n', '_ack_n', 'flags', 'payload', 'time', 'acked', 'retransmitted',
+                 '_header')
+
+    # Sequence Number, Acknowledge Number and Flags, 4 bytes each
+    HEADER = struct.Struct('III')
+    HEADER_SIZE = HEADER.size
 
     def __init__(self, seq_n, ack_n, flags, payload=None):
         self.seq_n = seq_n
-        self.ack_n = ack_n
-        self.flags = flags
+        self._ack_n = ack_n
+        # Compatibility: flags used to be a dict such as the ones returned by `flag_dict`
+        if isinstance(flags, dict):
+            flags = self.flags_to_int(**flags)
+        self.flags = flags or 0
         self.payload = payload if payload else b''
         self.time = time.time()
+        # Set by the sender once the package is acknowledged but can't leave the window yet
+        self.acked = False
+        # Karn's rule: packages sent more than once can't be used to sample the RTT
+        self.retransmitted = False
+        self._header = None
 
     def __eq__(self, other):
         return (self.seq_n == other.seq_n and
@@ -24,10 +224,11 @@ class UDPPacket:
                self.payload == other.payload)
 
     def __repr__(self):
-        return str(self.__dict__)
+        return (f"UDPPacket(seq_n={self.seq_n}, ack_n={self.ack_n}, flags={self.flags_dict}, "
+                f"payload={len(self.payload)} bytes)")
 
     def __str__(self):
-        return str(self.__dict__)
+        return self.__repr__()
 
     def __lt__(self, other):
         return self.seq_n < other.seq_n
@@ -35,25 +236,31 @@ class UDPPacket:
     def __gt__(self, other):
         return self.seq_n > other.seq_n
 
+    @property
+    def ack_n(self):
+        return self._ack_n
+
+    @ack_n.setter
+    def ack_n(self, ack_n):
+        self._ack_n = ack_n
+        self._header = None
+
     @staticmethod
     def flags_to_int(syn=False, ack=False, fin=False, psh=False):
         """
         Returns an integer representing the combination of flags
         """
-        flag_list = [syn, ack, fin, psh]
-        binarray = ''.join(map(str, map(int, flag_list)))
-        return int(binarray, 2)
+        return ((FLAG_SYN if syn else 0) | (FLAG_ACK if ack else 0) |
+                (FLAG_FIN if fin else 0) | (FLAG_PSH if psh else 0))
 
     @staticmethod
     def flag_from_int(flag_int):
-        flag_list = list(map(bool, map(int, f'{flag_int:04b}')))
-        flags = {
-            'syn': flag_list[0],
-            'ack': flag_list[1],
-            'fin': flag_list[2],
-            'psh': flag_list[3]
+        return {
+            'syn': bool(flag_int & FLAG_SYN),
+            'ack': bool(flag_int & FLAG_ACK),
+            'fin': bool(flag_int & FLAG_FIN),
+            'psh': bool(flag_int & FLAG_PSH),
         }
-        return flags
 
     @classmethod
     def create_package(cls, seq_n, ack_n, payload=None):
@@ -69,34 +276,36 @@ class UDPPacket:
         }
 
     @classmethod
-    def create_syn(cls):
-        flags = cls.flag_dict(syn=True)
-        return cls(0, 0, flags)
+    def create_syn(cls, options=None):
+        return cls(0, 0, FLAG_SYN, pack_options(options) if options else None)
 
     @classmethod
-    def create_synack(cls):
+    def create_synack(cls, options=None):
         """
         By convention all SYNs are seq_n 0. Thus all ack_n of a SYN+ACK should also be 0
         NOTE: Instead of using the ack_n as which should be the next byte, we are messaging
         which package number we are acking
         """
-        flags = cls.flag_dict(syn=True, ack=True)
-        return cls(0, 0, flags)
+        return cls(0, 0, FLAG_SYN | FLAG_ACK, pack_options(options) if options else None)
 
     @classmethod
-    def create_ack(cls, seq_n, ack_n):
-        flags = cls.flag_dict(ack=True)
-        return cls(seq_n, ack_n, flags)
+    def create_ack(cls, seq_n, ack_n, options=None):
+        return cls(seq_n, ack_n, FLAG_ACK, pack_options(options) if options else None)
 
     @classmethod
     def create_data(cls, seq_n, ack_n, payload):
-        flags = cls.flag_dict(ack=True, psh=True)
-        return cls(seq_n, ack_n, flags, payload)
+        return cls(seq_n, ack_n, FLAG_ACK | FLAG_PSH, payload)
+
+    @classmethod
+    def create_probe(cls, size):
+        """
+        Path MTU probe: a package of `size` bytes of padding, it isn't application data
+        """
+        return cls(0, 0, FLAG_PSH, bytes(size - cls.HEADER_SIZE))
 
     @classmethod
     def create_fin(cls):
-        flags = cls.flag_dict(fin=True)
-        return cls(0, 0, flags)
+        return cls(0, 0, FLAG_FIN)
 
     @classmethod
     def create_finack(cls):
@@ -105,35 +314,52 @@ class UDPPacket:
         NOTE: Instead of using the ack_n as which should be the next byte, we are messaging
         which package number we are acking
         """
-        flags = cls.flag_dict(fin=True, ack=True)
-        return cls(0, 0, flags)
-
+        return cls(0, 0, FLAG_FIN | FLAG_ACK)
 
     @property
     def flags_int(self):
-        return self.flags_to_int(**self.flags)
+        return self.flags
+
+    @property
+    def flags_dict(self):
+        return self.flag_from_int(self.flags)
+
+    @property
+    def options(self):
+        """
+        {kind: value} options of the package. DATA packages don't have options
+        """
+        if self.flags & FLAG_PSH or not self.payload:
+            return {}
+        return unpack_options(self.payload)
+
+    def header_bytes(self):
+        if self._header is None:
+            self._header = self.HEADER.pack(self.seq_n, self._ack_n, self.flags)
+        return self._header
+
+    def to_buffers(self):
+        """
+        Returns the package as a list of buffers [header, payload], meant for scatter-gather sends
+        (`socket.sendmsg`) so the payload isn't copied to build the datagram
+        """
+        if not self.payload:
+            return [self.header_bytes()]
+        return [self.header_bytes(), self.payload]
 
     def to_bytes(self):
-        pack = b''
-        # First 4 bytes are the Sequence Number
-        pack += struct.pack('I', self.seq_n)
-        # 4 Bytes for Acknoledge Number
-        pack += struct.pack('I', self.ack_n)
-        # 4 Bytes to represent the Flags
-        pack += struct.pack('I', self.flags_int)
-        # The remaining bytes are data
-        pack += self.payload
-
-        return pack
+        return self.header_bytes() + self.payload
 
     @classmethod
     def from_bytes(cls, byte_pack):
-        seq_n = struct.unpack('I', byte_pack[0:4])[0]
-        ack_n = struct.unpack('I', byte_pack[4:8])[0]
-        flag_int = struct.unpack('I', byte_pack[8:12])[0]
-        databytes = byte_pack[12:]
-
-        flags = cls.flag_from_int(flag_int)
+        """
+        The payload of the package is a memoryview of `byte_pack`, it isn't copied. Raises
+        ValueError if `byte_pack` is too short to be a package
+        """
+        if len(byte_pack) < cls.HEADER_SIZE:
+            raise ValueError(f"Datagram of {len(byte_pack)} bytes, shorter than a header")
+        seq_n, ack_n, flags = cls.HEADER.unpack_from(byte_pack)
+        databytes = memoryview(byte_pack)[cls.HEADER_SIZE:]
 
         return cls(seq_n, ack_n, flags, databytes)
 
@@ -151,19 +377,22 @@ class UDPPacket:
         return time.time() - self.time > rto
 
     def is_syn(self):
-        return self.flags_int == 8
+        return self.flags == FLAG_SYN
 
     def is_ack(self):
-        return self.flags_int == 4
+        return self.flags == FLAG_ACK
 
     def is_synack(self):
-        return self.flags_int == 12
+        return self.flags == FLAG_SYN | FLAG_ACK
 
     def is_fin(self):
-        return self.flags_int == 2
+        return self.flags == FLAG_FIN
 
     def is_finack(self):
-        return self.flags_int == 6
+        return self.flags == FLAG_FIN | FLAG_ACK
+
+    def is_probe(self):
+        return self.flags == FLAG_PSH
 
     def is_data(self):
-        return self.flags_int == 5 and self.payload
+        return self.flags == FLAG_ACK | FLAG_PSH and len(self.payload) > 0
@@ -1,17 +1,25 @@
+import sys
 import socket
 from threading import Thread
 import traceback
 import os
 import json
+# file_transfer is shared with reliable_socket. Appended, so the modules of this directory
+# aren't shadowed by the ones there with the same name (client, server)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                             'reliable_socket'))
+from file_transfer import recv_to_file, FILE_BUFFER_SIZE
 
-BUFFER_SIZE = 1024
+BUFFER_SIZE = 1024  # Control messages
 MODE_UPLOAD = 'upload'
 MODE_DOWNLOAD = 'download'
 
 class ServerTCP(Thread):
-    def __init__(self, storage, port, host):
+    def __init__(self, storage, port, host, buffer_size=FILE_BUFFER_SIZE):
         Thread.__init__(self)
         self.port = port
+        # Bytes of file data moved per call
+        self.buffer_size = buffer_size
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.host = host
@@ -28,7 +36,8 @@ class ServerTCP(Thread):
         while True:
             conn, (client_host, client_port) = self.socket.accept()
             print(f'Incoming Connection from {client_host} {client_port}')
-            new_client = ServerWorker(client_port, client_host, conn, self.storage)
+            new_client = ServerWorker(client_port, client_host, conn, self.storage,
+                                      self.buffer_size)
             new_client.start()
             self.clients.append(new_client)
 
@@ -38,12 +47,13 @@ class ServerTCP(Thread):
 
 
 class ServerWorker(Thread):
-    def __init__(self, port, host, socket, source_dir):
+    def __init__(self, port, host, socket, source_dir, buffer_size=FILE_BUFFER_SIZE):
         Thread.__init__(self)
         self.port = port
         self.host = host
         self.socket = socket
         self.source_dir = source_dir
+        self.buffer_size = buffer_size
 
     def __close_conection(self):
         self.socket.close()
@@ -76,15 +86,10 @@ class ServerWorker(Thread):
         self.__send_status(200, "OK - file_size")
 
         with open(f"{self.source_dir}/{filename}", 'wb') as recieved_file:
-                while True:
-                    data = self.socket.recv(BUFFER_SIZE)
-                    if not data:
-                        print(f"Receiving finished: closing connection {self.host}:{self.port} ")
-                        recieved_file.close()
-                        self.__close_conection()
-                        break
-
-                    recieved_file.write(data)
+            # Spliced from the socket into the file inside the kernel, until the client closes
+            recv_to_file(self.socket, recieved_file, buffer_size=self.buffer_size)
+        print(f"Receiving finished: closing connection {self.host}:{self.port} ")
+        self.__close_conection()
 
     def send_file(self):
         rcv_packet = self.socket.recv(BUFFER_SIZE)
@@ -94,16 +99,11 @@ class ServerWorker(Thread):
             file_requested = open(f"{self.source_dir}/{filename}", 'rb')
             self.__send_status(200, os.path.getsize(f"{self.source_dir}/{filename}"))
             self.socket.recv(BUFFER_SIZE)
-            while(True):
-                file_buffered = file_requested.read(BUFFER_SIZE)
-                while(file_buffered):
-                    self.socket.send(file_buffered)
-                    file_buffered = file_requested.read(BUFFER_SIZE)
-                if not file_buffered:
-                    print(f"Sending finished: closing connection {self.host}:{self.port}")
-                    file_requested.close()
-                    self.__close_conection()
-                    break
+            # os.sendfile: the file goes from the page cache to the socket inside the kernel
+            self.socket.sendfile(file_requested)
+            print(f"Sending finished: closing connection {self.host}:{self.port}")
+            file_requested.close()
+            self.__close_conection()
         except FileNotFoundError:
             response = {"code": 400}
             self.socket.send(json.dumps(response).encode())
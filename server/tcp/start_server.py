@@ -1,6 +1,7 @@
 import argparse
 import socket
 from server import ServerTCP
+from file_transfer import FILE_BUFFER_SIZE
 
 parser = argparse.ArgumentParser()
 parser.add_argument('-v', '--verbose', help="increase output verbosity", action="store_true")
@@ -9,11 +10,12 @@ parser.add_argument('-q', '--quiet', help="decrease output verbosity", action="s
 parser.add_argument('-p', '--port', help="service port", type=int)
 parser.add_argument('-H', '--host', help="service IP address", default=socket.gethostname())
 parser.add_argument('-s', '--storage', help="storage dir path]")
+parser.add_argument('-b', '--buffer-size', help="bytes of file data moved per call", type=int, default=FILE_BUFFER_SIZE)
 
 args = parser.parse_args()
 
 if((args.storage is not None) and (args.port is not None) and (args.host is not None)):
-    a = ServerTCP(args.storage, args.port, args.host)
+    a = ServerTCP(args.storage, args.port, args.host, args.buffer_size)
     a.main_loop()
 else:
     print("Paramters missing")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The socket modules import their siblings as top level modules (utils, timers...), as they do
+# when the scripts run from reliable_socket/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'reliable_socket'))
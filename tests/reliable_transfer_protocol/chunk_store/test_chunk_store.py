@@ -0,0 +1,70 @@
+import os
+import zlib
+
+import pytest
+
+from reliable_socket.chunk_store import ChunkStore, chunk_file, chunk_hash, MIN_CHUNK_SIZE, \
+    MAX_CHUNK_SIZE
+
+
+def chunks_of(tmp_path, data):
+    path = tmp_path / 'f.bin'
+    path.write_bytes(data)
+    with open(path, 'rb') as file:
+        return chunk_file(file)
+
+
+def store_file(store, name, data, chunks):
+    store.save_manifest(name, len(data), [(digest, length) for _, length, digest in chunks])
+    for offset, length, digest in chunks:
+        store.put(digest, data[offset:offset + length])
+
+
+def test_chunks_cover_the_file_within_the_size_limits(tmp_path):
+    data = os.urandom(1024 * 1024)
+
+    chunks = chunks_of(tmp_path, data)
+
+    assert [offset for offset, _, _ in chunks] == [0] + [sum(c[:2]) for c in chunks[:-1]]
+    assert sum(length for _, length, _ in chunks) == len(data)
+    assert all(MIN_CHUNK_SIZE < length <= MAX_CHUNK_SIZE for _, length, _ in chunks[:-1])
+    assert all(digest == chunk_hash(data[o:o + n]) for o, n, digest in chunks)
+
+
+def test_an_insertion_only_changes_the_chunks_around_it(tmp_path):
+    data = os.urandom(1024 * 1024)
+    edited = data[:500000] + b'inserted' + data[500000:]
+
+    chunks = {digest for _, _, digest in chunks_of(tmp_path, data)}
+    edited_chunks = [digest for _, _, digest in chunks_of(tmp_path, edited)]
+
+    assert len([digest for digest in edited_chunks if digest not in chunks]) <= 2
+
+
+def test_only_missing_chunks_are_asked_once(tmp_path):
+    store = ChunkStore(str(tmp_path))
+    stored, missing = os.urandom(100), os.urandom(100)
+    store.put(chunk_hash(stored), stored)
+
+    chunks = [(chunk_hash(stored), 100), (chunk_hash(missing), 100), (chunk_hash(missing), 100)]
+
+    assert store.missing(chunks) == [1]
+    with pytest.raises(ValueError):
+        store.put(chunk_hash(missing), stored)
+
+
+def test_stored_file_is_read_back_from_its_chunks(tmp_path):
+    store = ChunkStore(str(tmp_path / 'storage'))
+    data = os.urandom(300 * 1024)
+    store_file(store, 'f.bin', data, chunks_of(tmp_path, data))
+
+    with store.open('f.bin') as file:
+        assert file.size == len(data)
+        assert file.read() == data
+        file.seek(123456)
+        assert file.read() == data[123456:]
+    assert store.prefix_matches('f.bin', 200000, zlib.crc32(data[:200000]))
+    assert not store.prefix_matches('f.bin', 200000, zlib.crc32(data[:200000]) + 1)
+
+    store.remove_manifest('f.bin')
+    assert store.open('f.bin') is None
@@ -0,0 +1,51 @@
+import io
+import os
+import socket
+from threading import Thread
+
+from reliable_socket.compression import send_compressed, recv_compressed, choose_codec, \
+    COMPRESSION_CHUNK_SIZE, SAMPLE_FRAMES, FRAME
+
+
+def transfer(data, codec, offset=0):
+    sender, receiver = socket.socketpair()
+    sent = []
+
+    def send():
+        sent.append(send_compressed(sender, io.BytesIO(data), codec, offset))
+        sender.close()
+
+    thread = Thread(target=send)
+    thread.start()
+    file = io.BytesIO()
+    stats = recv_compressed(receiver, file, len(data) - offset, codec)
+    receiver.close()
+    thread.join()
+    return file.getvalue(), sent[0], stats
+
+
+def test_compressible_data_arrives_smaller():
+    data = b"2026-10-18,GET,/api/v1/items,200\n" * 100000
+
+    for codec in ('zlib', 'bz2', 'lzma'):
+        received, sent, stats = transfer(data, codec, offset=10)
+
+        assert received == data[10:]
+        assert sent.raw_bytes == stats.raw_bytes == len(data) - 10
+        assert sent.wire_bytes == stats.wire_bytes < len(data) / 10
+
+
+def test_compression_is_turned_off_for_incompressible_data():
+    data = os.urandom((SAMPLE_FRAMES + 4) * COMPRESSION_CHUNK_SIZE)
+
+    received, sent, _ = transfer(data, 'zlib')
+
+    frames = SAMPLE_FRAMES + 4
+    assert received == data
+    assert sent.wire_bytes == len(data) + frames * FRAME.size
+
+
+def test_first_known_codec_is_chosen():
+    assert choose_codec(['zstd', 'lzma', 'zlib']) == 'lzma'
+    assert choose_codec(['zstd']) is None
+    assert choose_codec(None) is None
@@ -0,0 +1,29 @@
+from reliable_socket.congestion import RenoCongestionControl
+
+
+def test_reno_slow_start():
+    reno = RenoCongestionControl(initial_cwnd=1, initial_ssthresh=8)
+    for _ in range(3):
+        reno.on_ack(reno.window)
+
+    assert reno.cwnd == 8
+
+
+def test_reno_congestion_avoidance():
+    reno = RenoCongestionControl(initial_cwnd=8, initial_ssthresh=8)
+    reno.on_ack(8)
+
+    assert reno.window == 9
+
+
+def test_reno_multiplicative_decrease():
+    reno = RenoCongestionControl(initial_cwnd=20, initial_ssthresh=16)
+    reno.on_duplicate_acks(20)
+
+    assert reno.ssthresh == 10
+    assert reno.cwnd == 10
+
+    reno.on_timeout(10)
+
+    assert reno.ssthresh == 5
+    assert reno.window == 1
@@ -0,0 +1,83 @@
+import io
+import os
+import socket
+import zlib
+from threading import Thread
+
+from reliable_socket.delta import Signature, SignatureCache, send_delta, apply_delta, roll
+
+
+BLOCK_SIZE = 1024
+
+
+def transfer(tmp_path, old, new):
+    basis_path = tmp_path / 'basis'
+    basis_path.write_bytes(old)
+    new_path = tmp_path / 'new'
+    new_path.write_bytes(new)
+    signature = Signature.of_file(str(basis_path), BLOCK_SIZE)
+    sender, receiver = socket.socketpair()
+    sent = []
+
+    def send():
+        with open(new_path, 'rb') as file:
+            sent.append(send_delta(sender, file, signature))
+        sender.close()
+
+    thread = Thread(target=send)
+    thread.start()
+    rebuilt = io.BytesIO()
+    with open(basis_path, 'rb') as basis:
+        result = apply_delta(receiver, basis.fileno(), rebuilt, BLOCK_SIZE)
+    receiver.close()
+    thread.join()
+    return rebuilt.getvalue(), result, sent[0]
+
+
+def test_rolled_checksum_is_the_checksum_of_the_window():
+    data = os.urandom(3 * BLOCK_SIZE)
+    weak = zlib.adler32(data[:BLOCK_SIZE])
+    for position in range(len(data) - BLOCK_SIZE):
+        weak = roll(weak, data[position], data[position + BLOCK_SIZE], BLOCK_SIZE)
+
+        assert weak == zlib.adler32(data[position + 1:position + 1 + BLOCK_SIZE])
+
+
+def test_only_the_changes_are_sent(tmp_path):
+    old = os.urandom(64 * BLOCK_SIZE)
+    new = bytearray(old)
+    new[10 * BLOCK_SIZE + 5:10 * BLOCK_SIZE + 15] = b'x' * 10
+    new[30 * BLOCK_SIZE:30 * BLOCK_SIZE] = b'inserted'
+    del new[50 * BLOCK_SIZE:50 * BLOCK_SIZE + 100]
+
+    rebuilt, (matches, literal, copied), sent = transfer(tmp_path, old, bytes(new))
+
+    assert rebuilt == new
+    assert matches
+    assert (literal, copied) == sent
+    assert literal + copied == len(new)
+    assert literal < 4 * BLOCK_SIZE
+
+
+def test_without_a_copy_everything_is_literal(tmp_path):
+    new = os.urandom(10 * BLOCK_SIZE + 10)
+
+    rebuilt, (matches, literal, copied), _ = transfer(tmp_path, b'', new)
+
+    assert rebuilt == new
+    assert matches
+    assert (literal, copied) == (len(new), 0)
+
+
+def test_signature_is_cached_until_the_file_changes(tmp_path):
+    path = tmp_path / 'f.bin'
+    path.write_bytes(os.urandom(4 * BLOCK_SIZE))
+    cache = SignatureCache()
+
+    signature = cache.get(str(path), BLOCK_SIZE)
+    assert cache.get(str(path), BLOCK_SIZE) is signature
+
+    path.write_bytes(os.urandom(5 * BLOCK_SIZE))
+    changed = cache.get(str(path), BLOCK_SIZE)
+    assert changed is not signature
+    assert len(changed) == 5
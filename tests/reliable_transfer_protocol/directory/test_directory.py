@@ -0,0 +1,77 @@
+import os
+import socket
+from threading import Thread
+
+import pytest
+
+from reliable_socket.directory import scan, outdated, local_path, pack_manifest, recv_manifest, \
+    send_entries, recv_entries, SMALL_FILE_SIZE
+
+
+def make_tree(root, files):
+    for relative, data in files.items():
+        path = root / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+
+def test_scan_lists_regular_files_recursively(tmp_path):
+    make_tree(tmp_path, {'b.bin': b'bb', 'a/c.bin': b'c', 'a/d/e.bin': b''})
+    os.symlink(tmp_path / 'b.bin', tmp_path / 'link')
+
+    entries = scan(str(tmp_path))
+
+    assert [(relative, size) for relative, size, _ in entries] == \
+        [('b.bin', 2), ('a/c.bin', 1), ('a/d/e.bin', 0)]
+    assert scan(str(tmp_path / 'missing')) == []
+
+
+def test_only_missing_or_changed_entries_are_outdated():
+    entries = [('a', 1, 10), ('b', 2, 20), ('c', 3, 30)]
+    existing = [('a', 1, 10), ('b', 2, 21)]
+
+    assert outdated(entries, existing) == [1, 2]
+
+
+@pytest.mark.parametrize('relative', ['../x', '/etc/passwd', 'a//b', 'a/./b', ''])
+def test_paths_out_of_the_directory_are_rejected(relative):
+    with pytest.raises(ValueError):
+        local_path('root', relative)
+
+
+def test_invalid_manifest_is_received_whole():
+    sender, receiver = socket.socketpair()
+    sender.sendall(pack_manifest([('ok', 1, 1), ('../escape', 1, 1)]) + b'next')
+    with pytest.raises(ValueError):
+        recv_manifest(receiver)
+    assert receiver.recv(4) == b'next'
+    sender.close()
+    receiver.close()
+
+
+def test_files_stream_back_to_back(tmp_path):
+    files = {f'small/{i}.bin': os.urandom(i * 100) for i in range(20)}
+    files['big.bin'] = os.urandom(3 * SMALL_FILE_SIZE)
+    make_tree(tmp_path / 'src', files)
+    entries = scan(str(tmp_path / 'src'))
+    indexes = [index for index, (relative, _, _) in enumerate(entries) if relative != 'small/3.bin']
+    sender, receiver = socket.socketpair()
+
+    def send():
+        send_entries(sender, str(tmp_path / 'src'), entries, indexes)
+        sender.close()
+
+    thread = Thread(target=send)
+    thread.start()
+    received = recv_entries(receiver, str(tmp_path / 'dst'), entries, indexes)
+    thread.join()
+    receiver.close()
+
+    assert received == sum(entries[index][1] for index in indexes)
+    assert not (tmp_path / 'dst' / 'small' / '3.bin').exists()
+    # The modification times are kept, so the next transfer skips every file
+    assert [entries[index][0] for index in outdated(entries, scan(str(tmp_path / 'dst')))] == \
+        ['small/3.bin']
+    for index in indexes:
+        relative = entries[index][0]
+        assert (tmp_path / 'dst' / relative).read_bytes() == files[relative]
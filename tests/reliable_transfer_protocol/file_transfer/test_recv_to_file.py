@@ -0,0 +1,47 @@
+import os
+import socket
+import tempfile
+from threading import Thread
+
+from reliable_socket.file_transfer import recv_to_file
+
+
+def transfer(data, count=None, timeout=None):
+    sender, receiver = socket.socketpair()
+    receiver.settimeout(timeout)
+
+    def send():
+        try:
+            sender.sendall(data)
+        except OSError:
+            pass  # The receiver stopped reading before the end
+        sender.close()
+
+    thread = Thread(target=send)
+    thread.start()
+    chunks = []
+    with tempfile.TemporaryFile() as file:
+        received = recv_to_file(receiver, file, count, buffer_size=64 * 1024,
+                                callback=chunks.append)
+        receiver.close()
+        thread.join()
+        file.seek(0)
+        return received, file.read(), sum(chunks)
+
+
+def test_recv_to_file_until_the_connection_is_closed():
+    data = os.urandom(300 * 1024)
+
+    assert transfer(data) == (len(data), data, len(data))
+
+
+def test_recv_to_file_stops_at_count():
+    data = os.urandom(300 * 1024)
+
+    assert transfer(data, count=100 * 1024 + 1)[:2] == (100 * 1024 + 1, data[:100 * 1024 + 1])
+
+
+def test_recv_to_file_with_a_timeout_reads_into_a_buffer():
+    data = os.urandom(300 * 1024)
+
+    assert transfer(data, timeout=5) == (len(data), data, len(data))
@@ -0,0 +1,33 @@
+from threading import Thread
+
+import pytest
+
+
+def connect(listener, client, timeout=5):
+    """
+    Connects `client` to `listener`. Returns the accepted connection, None if it takes longer
+    than `timeout` seconds
+    """
+    accepted = []
+    acceptor = Thread(target=lambda: accepted.append(listener.accept()[0]), daemon=True)
+    acceptor.start()
+    connector = Thread(target=client.connect, args=(listener.getsockname(),), daemon=True)
+    connector.start()
+    acceptor.join(timeout)
+    # The connection may be accepted before the client gets the SYN+ACK
+    connector.join(timeout)
+    return accepted[0] if accepted and not connector.is_alive() else None
+
+
+@pytest.fixture
+def loopback():
+    """
+    Factory of connected pairs of sockets: loopback(listener, client) listens on `listener`,
+    bound to a loopback address, connects `client` to it and returns the accepted connection
+    """
+    def connect_pair(listener, client):
+        listener.listen()
+        conn = connect(listener, client)
+        assert conn is not None, "The connection wasn't accepted"
+        return conn
+    return connect_pair
@@ -0,0 +1,109 @@
+import os
+import asyncio
+from queue import Queue
+from threading import Thread
+
+import pytest
+
+from reliable_socket.reliable_transfer_protocol import (ReliableUDPSocket, ARQ_GO_BACK_N,
+                                                       ARQ_SELECTIVE_REPEAT)
+from reliable_socket.async_reliable_transfer_protocol import AsyncReliableUDPSocket
+
+DATA = os.urandom(512 * 1024)
+
+
+def run_async(coroutine):
+    """
+    Runs `coroutine` on an event loop of its own, in another thread
+    """
+    Thread(target=asyncio.run, args=(coroutine,), daemon=True).start()
+
+
+def recv_exact(sock, size):
+    received = bytearray()
+    while len(received) < size:
+        received += sock.recv(size - len(received))
+    return bytes(received)
+
+
+async def recv_exact_async(sock, size):
+    received = bytearray()
+    while len(received) < size:
+        received += await sock.recv(size - len(received))
+    return bytes(received)
+
+
+def lose_once(sock, seq_n):
+    """
+    Drops the first transmission of the DATA package `seq_n` sent by `sock`. Returns the list
+    the packages retransmitted from then on are appended to
+    """
+    send = sock._send
+    retransmitted = []
+
+    def lossy_send(package, retransmit=False):
+        if retransmit:
+            retransmitted.append(package.seq_n)
+        elif package.is_data() and package.seq_n == seq_n:
+            return
+        send(package, retransmit)
+    sock._send = lossy_send
+    return retransmitted
+
+
+@pytest.mark.parametrize('arq', [ARQ_GO_BACK_N, ARQ_SELECTIVE_REPEAT])
+def test_sync_client_and_async_server(arq):
+    results = Queue()
+
+    async def serve():
+        listener = AsyncReliableUDPSocket(arq=arq)
+        listener.bind(('127.0.0.1', 0))
+        await listener.listen()
+        results.put(listener.getsockname())
+        conn, _ = await listener.accept()
+        received = await recv_exact_async(conn, len(DATA))
+        await conn.send(received[::-1])
+        results.put(received)
+        # The endpoint goes with the loop, it must answer until the client is done
+        while await conn.recv(1):
+            pass
+
+    run_async(serve())
+    client = ReliableUDPSocket(arq=arq)
+    client.connect(results.get(timeout=5))
+    client.settimeout(10)
+    retransmitted = lose_once(client, 2)
+
+    client.sendall(DATA)
+    answer = recv_exact(client, len(DATA))
+    client.close()
+
+    assert results.get(timeout=10) == DATA
+    assert answer == DATA[::-1]
+    if arq == ARQ_SELECTIVE_REPEAT:
+        # The server buffers whatever the client's window let through after the lost package
+        assert set(retransmitted) == {2}
+
+
+@pytest.mark.parametrize('arq', [ARQ_GO_BACK_N, ARQ_SELECTIVE_REPEAT])
+def test_async_client_and_sync_server(arq):
+    listener = ReliableUDPSocket(arq=arq)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    results = Queue()
+
+    async def transfer():
+        client = AsyncReliableUDPSocket(arq=arq)
+        await client.connect(listener.getsockname())
+        await client.send(DATA)
+        results.put(await recv_exact_async(client, len(DATA)))
+        await client.close()
+
+    run_async(transfer())
+    conn, _ = listener.accept()
+    conn.settimeout(10)
+    received = recv_exact(conn, len(DATA))
+    conn.sendall(received[::-1])
+
+    assert received == DATA
+    assert results.get(timeout=10) == DATA[::-1]
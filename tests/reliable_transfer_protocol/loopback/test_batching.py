@@ -0,0 +1,80 @@
+import time
+from functools import partial
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+from reliable_socket.congestion import RenoCongestionControl
+from reliable_socket.utils import UDPPacket
+
+SEGMENTS = 32
+# A window big enough for the whole burst to be sent at once
+BURST_CONGESTION_CONTROL = partial(RenoCongestionControl, initial_cwnd=SEGMENTS)
+
+
+def record_batches(sock):
+    """
+    Records the size of every batch of datagrams `sock` reads from its socket
+    """
+    receive_batch = sock._receive_batch
+    batches = []
+
+    def recording_receive_batch():
+        batch = receive_batch()
+        batches.append(len(batch))
+        return batch
+    sock._receive_batch = recording_receive_batch
+    return batches
+
+
+def record_acks(sock):
+    send = sock._send
+    acks = []
+
+    def recording_send(package, retransmit=False):
+        if package.is_ack():
+            acks.append(package)
+        send(package, retransmit)
+    sock._send = recording_send
+    return acks
+
+
+def queue_burst(client, conn, segments):
+    """
+    Sends `segments` while `conn` is held from processing them, so they queue up in its socket
+    """
+    payload = b'x' * (client.packet_size - UDPPacket.HEADER_SIZE)
+    with conn.transmit_lock:
+        for _ in range(segments):
+            client.sendall(payload)
+        time.sleep(0.05)
+    conn.settimeout(10)
+    size = segments * len(payload)
+    received = 0
+    while received < size:
+        received += len(conn.recv(size - received))
+
+
+def test_batches_stop_at_the_limit(loopback):
+    listener = ReliableUDPSocket(recv_batch=4, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(pmtu_probing=False, congestion_control=BURST_CONGESTION_CONTROL)
+    conn = loopback(listener, client)
+    batches = record_batches(conn)
+
+    queue_burst(client, conn, SEGMENTS)
+    client.close()
+
+    assert max(batches) == conn.recv_batch
+
+
+def test_a_batch_is_acknowledged_once(loopback):
+    # Every segment would be acknowledged on its own if they came one by one
+    listener = ReliableUDPSocket(ack_every=1, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(pmtu_probing=False, congestion_control=BURST_CONGESTION_CONTROL)
+    conn = loopback(listener, client)
+    acks = record_acks(conn)
+
+    queue_burst(client, conn, SEGMENTS)
+    client.close()
+
+    assert len(acks) < SEGMENTS // 2
@@ -0,0 +1,124 @@
+import time
+import asyncio
+from queue import Queue
+from threading import Thread
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+from reliable_socket.async_reliable_transfer_protocol import AsyncReliableUDPSocket
+from reliable_socket.utils import UDPPacket
+
+SEGMENTS = 64
+
+
+def record_acks(sock):
+    """
+    Records the time of every ACK sent by `sock` that doesn't carry data
+    """
+    send = sock._send
+    acks = []
+
+    def recording_send(package, *args):
+        if package.is_ack():
+            acks.append(time.time())
+        send(package, *args)
+    sock._send = recording_send
+    return acks
+
+
+def send_burst(sock, segments):
+    payload = b'x' * (sock.packet_size - UDPPacket.HEADER_SIZE)
+    for _ in range(segments):
+        sock.sendall(payload)
+    return segments * len(payload)
+
+
+def recv_all(conn, size):
+    conn.settimeout(10)
+    received = 0
+    while received < size:
+        received += len(conn.recv(size - received))
+
+
+def acks_of_burst(loopback, ack_every):
+    # A datagram per batch, so only the delayed ACK policy decides how many ACKs are sent
+    listener = ReliableUDPSocket(recv_batch=1, ack_every=ack_every, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(pmtu_probing=False)
+    conn = loopback(listener, client)
+    acks = record_acks(conn)
+
+    recv_all(conn, send_burst(client, SEGMENTS))
+    time.sleep(2 * conn.ack_delay)
+    client.close()
+    return len(acks)
+
+
+def test_every_other_segment_is_acknowledged(loopback):
+    every_segment = acks_of_burst(loopback, ack_every=1)
+    every_other = acks_of_burst(loopback, ack_every=2)
+
+    assert every_segment >= SEGMENTS
+    assert every_other <= 0.6 * every_segment
+
+
+def test_lone_segment_is_acknowledged_after_the_delay(loopback):
+    listener = ReliableUDPSocket(ack_every=2, ack_delay=0.1, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(pmtu_probing=False)
+    conn = loopback(listener, client)
+    acks = record_acks(conn)
+
+    sent = time.time()
+    recv_all(conn, send_burst(client, 1))
+    time.sleep(2 * conn.ack_delay)
+    client.close()
+
+    # Held for a second segment, until the timer gave up on it. The delay is below MIN_RTO, the
+    # client doesn't retransmit it meanwhile
+    assert len(acks) == 1
+    assert acks[0] - sent >= conn.ack_delay
+
+
+def async_acks(segments, ack_every, ack_delay):
+    """
+    Sends a burst of `segments` to an AsyncReliableUDPSocket. Returns the time the burst was sent
+    and the times of the ACKs it sent back
+    """
+    client = ReliableUDPSocket(pmtu_probing=False)
+    size = segments * (client.packet_size - UDPPacket.HEADER_SIZE)
+    results = Queue()
+
+    async def serve():
+        listener = AsyncReliableUDPSocket(ack_every=ack_every, ack_delay=ack_delay)
+        listener.bind(('127.0.0.1', 0))
+        await listener.listen()
+        results.put(listener.getsockname())
+        conn, _ = await listener.accept()
+        acks = record_acks(conn)
+        received = 0
+        while received < size:
+            received += len(await conn.recv(size - received))
+        await asyncio.sleep(2 * ack_delay)
+        results.put(list(acks))
+        # The endpoint goes with the loop, it must answer until the client is done
+        while await conn.recv(1):
+            pass
+
+    Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    client.connect(results.get(timeout=5))
+    sent = time.time()
+    send_burst(client, segments)
+    acks = results.get(timeout=10)
+    client.close()
+    return sent, acks
+
+
+def test_async_receiver_delays_its_acks():
+    _, every_segment = async_acks(SEGMENTS, ack_every=1, ack_delay=0.04)
+    _, every_other = async_acks(SEGMENTS, ack_every=2, ack_delay=0.04)
+    sent, lone = async_acks(1, ack_every=2, ack_delay=0.1)
+
+    assert len(every_segment) >= SEGMENTS
+    assert len(every_other) <= 0.6 * len(every_segment)
+    assert len(lone) == 1
+    assert lone[0] - sent >= 0.1
@@ -0,0 +1,79 @@
+import os
+import time
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket, \
+    PACKAGES_PER_SOCKET_BUFFER
+
+RECV_BUFFER_SIZE = 128 * 1024
+SOCKET_BUFFER_SIZE = 64 * 1024  # Below net.core.rmem_max, so it is granted
+
+
+def test_slow_reader_bounds_the_receive_buffer(loopback):
+    listener = ReliableUDPSocket(recv_buffer_size=RECV_BUFFER_SIZE)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket()
+    conn = loopback(listener, client)
+    data = os.urandom(2 * 1024 * 1024)
+
+    client.sendall(data)
+    # Nothing is read for a while: the window closes and the client has to probe it
+    time.sleep(0.5)
+    conn.settimeout(10)
+    peak = 0
+    received = bytearray()
+    while len(received) < len(data):
+        peak = max(peak, len(conn.app_recv_buffer))
+        received += conn.recv(16 * 1024)
+        time.sleep(0.001)
+    client.close()
+
+    assert bytes(received) == data
+    assert RECV_BUFFER_SIZE // 2 < peak <= conn.recv_buffer_size
+
+
+def test_window_fits_a_small_socket_buffer(loopback):
+    listener = ReliableUDPSocket(socket_buffer_size=SOCKET_BUFFER_SIZE)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(socket_buffer_size=SOCKET_BUFFER_SIZE)
+    conn = loopback(listener, client)
+    send = client._send
+    retransmitted = []
+
+    def recording_send(package, retransmit=False):
+        if retransmit:
+            retransmitted.append(package.seq_n)
+        send(package, retransmit)
+    client._send = recording_send
+    data = os.urandom(2 * 1024 * 1024)
+
+    client.sendall(data)
+    conn.settimeout(10)
+    received = bytearray()
+    while len(received) < len(data):
+        received += conn.recv(len(data) - len(received))
+    client.close()
+
+    assert bytes(received) == data
+    # The kernel didn't drop anything
+    assert not retransmitted
+    # Several of the packages probed fit in the socket, and never more of them are in flight
+    assert client.packet_size <= conn.kernel_recv_buffer // PACKAGES_PER_SOCKET_BUFFER
+    assert client.remote_window <= conn.kernel_recv_buffer
+
+
+def test_demultiplexed_connections_share_the_socket_buffer(loopback):
+    listener = ReliableUDPSocket(demux=True, socket_buffer_size=SOCKET_BUFFER_SIZE)
+    listener.bind(('127.0.0.1', 0))
+    first = ReliableUDPSocket()
+    first_conn = loopback(listener, first)
+    assert first_conn._free_window() == listener.kernel_recv_buffer
+
+    second = ReliableUDPSocket()
+    second_conn = loopback(listener, second)
+    second.sendall(b'x')
+    second_conn.settimeout(5)
+    second_conn.recv(1)
+    first.close()
+    second.close()
+
+    assert second.remote_window <= listener.kernel_recv_buffer // 2
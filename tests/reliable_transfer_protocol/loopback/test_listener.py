@@ -0,0 +1,72 @@
+import os
+import socket
+from threading import Thread
+
+import pytest
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+from reliable_socket.utils import UDPPacket
+
+
+@pytest.mark.parametrize('demux', [False, True])
+def test_listener_survives_datagrams_that_arent_packages(loopback, demux):
+    listener = ReliableUDPSocket(demux=demux)
+    listener.bind(('127.0.0.1', 0))
+    junk = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for length in (0, 1, UDPPacket.HEADER_SIZE - 1):
+        junk.sendto(b'x' * length, listener.getsockname())
+    junk.close()
+
+    client = ReliableUDPSocket()
+    conn = loopback(listener, client)
+    client.sendall(b'still listening')
+    received = b''
+    while len(received) < len(b'still listening'):
+        received += conn.recv(1024)
+    client.close()
+
+    assert received == b'still listening'
+
+
+def test_demultiplexing_server_serves_two_clients_on_one_socket():
+    listener = ReliableUDPSocket(demux=True)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    clients = [ReliableUDPSocket(), ReliableUDPSocket()]
+    accepted = []
+
+    def accept():
+        for _ in clients:
+            accepted.append(listener.accept()[0])
+
+    acceptor = Thread(target=accept, daemon=True)
+    acceptor.start()
+    connectors = [Thread(target=client.connect, args=(listener.getsockname(),), daemon=True)
+                  for client in clients]
+    for connector in connectors:
+        connector.start()
+    acceptor.join(5)
+    assert len(accepted) == 2
+    # No socket of their own
+    assert all(conn.sock is listener.sock for conn in accepted)
+
+    data = {client.getsockname(): os.urandom(100 * 1024) for client in clients}
+    for client in clients:
+        client.sendall(data[client.getsockname()])
+    for conn in accepted:
+        conn.settimeout(10)
+        expected = data[conn.getpeername()]
+        received = bytearray()
+        while len(received) < len(expected):
+            received += conn.recv(len(expected) - len(received))
+        assert bytes(received) == expected
+        # Answered through the listening socket
+        conn.sendall(expected[::-1])
+    for client in clients:
+        client.settimeout(10)
+        expected = data[client.getsockname()][::-1]
+        received = bytearray()
+        while len(received) < len(expected):
+            received += client.recv(len(expected) - len(received))
+        client.close()
+        assert bytes(received) == expected
@@ -0,0 +1,83 @@
+import os
+import time
+import errno
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+from reliable_socket.utils import UDPPacket
+
+PATH_MTU = 9000
+
+
+def narrow_path(sock, black_hole=False):
+    """
+    Makes the kernel of `sock` reject with EMSGSIZE the datagrams bigger than PATH_MTU, as once
+    an ICMP Fragmentation Needed lowered the path MTU. With `black_hole` they are dropped
+    silently instead
+    """
+    send = sock._send
+
+    def narrowed_send(package, retransmit=False):
+        if UDPPacket.HEADER_SIZE + len(package.payload) <= PATH_MTU:
+            send(package, retransmit)
+        elif not black_hole:
+            raise OSError(errno.EMSGSIZE, os.strerror(errno.EMSGSIZE))
+    sock._send = narrowed_send
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def probed_pair(loopback):
+    """
+    Client and accepted connection, once the client sends packages bigger than PATH_MTU
+    """
+    listener = ReliableUDPSocket()
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket()
+    conn = loopback(listener, client)
+    assert wait_for(lambda: client.packet_size > PATH_MTU)
+    return client, conn
+
+
+def test_package_too_big_lowers_the_package_size(loopback):
+    client, conn = probed_pair(loopback)
+
+    narrow_path(client)
+    data = os.urandom(2 * 1024 * 1024)
+    client.sendall(data)
+
+    assert client.packet_size <= PATH_MTU
+    # Not sent yet, so split again at the new size
+    assert all(len(p.payload) <= client.packet_size - UDPPacket.HEADER_SIZE
+               for p in client.app_sent_buffer.queue)
+    # The ones cut before go through once the kernel forgets the path MTU
+    del client._send
+    conn.settimeout(10)
+    received = bytearray()
+    while len(received) < len(data):
+        received += conn.recv(len(data) - len(received))
+    client.close()
+
+    assert bytes(received) == data
+
+
+def test_black_hole_lowers_the_package_size(loopback):
+    client, conn = probed_pair(loopback)
+
+    narrow_path(client, black_hole=True)
+    data = os.urandom(256 * 1024)
+    client.sendall(data)
+
+    assert wait_for(lambda: client.packet_size <= PATH_MTU)
+    del client._send
+    conn.settimeout(10)
+    received = bytearray()
+    while len(received) < len(data):
+        received += conn.recv(len(data) - len(received))
+    client.close()
+
+    assert bytes(received) == data
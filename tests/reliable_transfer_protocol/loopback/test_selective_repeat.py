@@ -0,0 +1,167 @@
+import random
+import asyncio
+
+import pytest
+from queue import Queue
+from threading import Thread
+
+from reliable_socket.reliable_transfer_protocol import (ReliableUDPSocket, ARQ_SELECTIVE_REPEAT,
+                                                       WINDOW_SIZE, OPTION_SACK)
+from reliable_socket.async_reliable_transfer_protocol import AsyncReliableUDPSocket
+from reliable_socket.utils import UDPPacket
+
+
+def lose(sock, seq_n, times):
+    """
+    Drops the first `times` transmissions of the DATA package `seq_n` sent by `sock`. Returns
+    the list of seq_n retransmitted from then on
+    """
+    send = sock._send
+    retransmitted = []
+    lost = []
+
+    def lossy_send(package, retransmit=False):
+        if retransmit:
+            retransmitted.append(package.seq_n)
+        if package.is_data() and package.seq_n == seq_n and len(lost) < times:
+            lost.append(package)
+            return
+        send(package, retransmit)
+    sock._send = lossy_send
+    return retransmitted
+
+
+def lossy_path(sock, loss, seed):
+    """
+    Drops at random a `loss` fraction of the packages sent by `sock`
+    """
+    send = sock._send
+    rng = random.Random(seed)
+
+    def lossy_send(package, retransmit=False):
+        if rng.random() >= loss:
+            send(package, retransmit)
+    sock._send = lossy_send
+
+
+def send_in_packages(sock, data):
+    size = sock.packet_size - UDPPacket.HEADER_SIZE
+    for offset in range(0, len(data), size):
+        sock.sendall(data[offset:offset + size])
+
+
+@pytest.mark.parametrize('listener_sack, client_sack', [(True, True), (True, False),
+                                                     (False, True), (False, False)])
+def test_sack_is_enabled_only_if_both_ends_offer_it(loopback, listener_sack, client_sack):
+    listener = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, sack=listener_sack)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, sack=client_sack)
+    conn = loopback(listener, client)
+    client.close()
+
+    assert conn.sack_permitted == client.sack_permitted == (listener_sack and client_sack)
+
+
+def test_sacked_segments_are_not_retransmitted(loopback):
+    listener = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, pmtu_probing=False)
+    conn = loopback(listener, client)
+    send = conn._send
+    sack_blocks = []
+
+    def recording_send(package, retransmit=False):
+        if OPTION_SACK in package.options:
+            sack_blocks.append(package.options[OPTION_SACK])
+        send(package, retransmit)
+    conn._send = recording_send
+    # Lost along with its fast retransmission, it is only recovered by the timeout
+    retransmitted = lose(client, 2, times=2)
+    data = bytes(range(256)) * 40
+
+    send_in_packages(client, data)
+    conn.settimeout(10)
+    received = bytearray()
+    while len(received) < len(data):
+        received += conn.recv(len(data) - len(received))
+    client.close()
+
+    assert bytes(received) == data
+    assert conn.sack_permitted and sack_blocks
+    # The segments after the lost one were reported by the SACK blocks, the timeout only sends
+    # the lost one again
+    assert set(retransmitted) == {2}
+
+
+def test_segments_out_of_order_are_acknowledged_without_sack(loopback):
+    listener = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, sack=False, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, sack=False, pmtu_probing=False)
+    conn = loopback(listener, client)
+    # Lost along with its fast retransmission, it is only recovered by the timeout
+    retransmitted = lose(client, 2, times=2)
+    data = bytes(range(256)) * 40
+
+    send_in_packages(client, data)
+    conn.settimeout(10)
+    received = bytearray()
+    while len(received) < len(data):
+        received += conn.recv(len(data) - len(received))
+    client.close()
+
+    assert bytes(received) == data
+    # The segments after the lost one arrived, only the lost one is sent again
+    assert set(retransmitted) == {2}
+
+
+def test_async_receiver_acknowledges_segments_out_of_order():
+    data = bytes(range(256)) * 40
+    results = Queue()
+
+    async def serve():
+        # The window of the sender, Selective Repeat receivers drop the segments beyond theirs
+        listener = AsyncReliableUDPSocket(window_size=WINDOW_SIZE, arq=ARQ_SELECTIVE_REPEAT)
+        listener.bind(('127.0.0.1', 0))
+        await listener.listen()
+        results.put(listener.getsockname())
+        conn, _ = await listener.accept()
+        received = bytearray()
+        while len(received) < len(data):
+            received += await conn.recv(len(data) - len(received))
+        results.put(bytes(received))
+        # The endpoint goes with the loop, it must answer until the client is done
+        while await conn.recv(1):
+            pass
+
+    Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    client = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT)
+    client.connect(results.get(timeout=5))
+    retransmitted = lose(client, 2, times=2)
+
+    send_in_packages(client, data)
+    received = results.get(timeout=10)
+    client.close()
+
+    assert received == data
+    assert set(retransmitted) == {2}
+
+
+def test_transfer_over_a_lossy_path(loopback):
+    listener = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, pmtu_probing=False)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(arq=ARQ_SELECTIVE_REPEAT, pmtu_probing=False)
+    conn = loopback(listener, client)
+    # Both the DATA and the ACKs get lost
+    lossy_path(client, 0.05, seed=1)
+    lossy_path(conn, 0.05, seed=2)
+    data = random.Random(3).randbytes(128 * 1024)
+
+    client.sendall(data)
+    conn.settimeout(30)
+    received = bytearray()
+    while len(received) < len(data):
+        received += conn.recv(len(data) - len(received))
+    del client._send, conn._send
+    client.close()
+
+    assert bytes(received) == data
@@ -0,0 +1,46 @@
+import io
+import os
+
+import pytest
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+
+FILE_SIZE = 1024 * 1024 + 777
+
+
+@pytest.fixture(scope='module')
+def content():
+    return os.urandom(FILE_SIZE)
+
+
+@pytest.mark.parametrize('offset, count', [
+    (0, None),
+    (12345, 300000),
+    (4096, None),
+    (1000, 10 * FILE_SIZE),  # Up to the end of the file
+    (FILE_SIZE, None),  # Nothing to send
+])
+@pytest.mark.parametrize('mapped', [True, False])
+def test_sendfile_sends_the_range(loopback, tmp_path, content, offset, count, mapped):
+    listener = ReliableUDPSocket()
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket()
+    conn = loopback(listener, client)
+    path = tmp_path / 'file.bin'
+    path.write_bytes(content)
+    expected = content[offset:] if count is None else content[offset:offset + count]
+
+    with open(path, 'rb') if mapped else io.BytesIO(content) as file:
+        sent = client.sendfile(file, offset, count)
+        position = file.tell()
+    # A marker after the range, nothing else may arrive before it
+    client.sendall(b'END')
+    conn.settimeout(10)
+    received = bytearray()
+    while len(received) < len(expected) + 3:
+        received += conn.recv(len(expected) + 3 - len(received))
+    client.close()
+
+    assert sent == len(expected)
+    assert position == offset + len(expected)
+    assert bytes(received) == expected + b'END'
@@ -0,0 +1,75 @@
+import os
+import time
+import socket
+from threading import Thread
+
+import pytest
+
+from reliable_socket.reliable_transfer_protocol import ReliableUDPSocket
+
+BUFFER_SIZE = 64 * 1024
+
+
+@pytest.fixture
+def pair(loopback):
+    """
+    Client and accepted connection with small buffers, the client fills them fast. Once the test
+    is done the connection reads everything and the client closes
+    """
+    listener = ReliableUDPSocket(recv_buffer_size=BUFFER_SIZE)
+    listener.bind(('127.0.0.1', 0))
+    client = ReliableUDPSocket(send_buffer_size=BUFFER_SIZE)
+    conn = loopback(listener, client)
+    yield client, conn
+
+    def drain():
+        while conn.recv(BUFFER_SIZE):
+            pass
+
+    conn.setblocking(True)
+    Thread(target=drain, daemon=True).start()
+    client.setblocking(True)
+    client.close()
+
+
+def test_recv_times_out(pair):
+    _, conn = pair
+    conn.settimeout(0.1)
+
+    start = time.monotonic()
+    with pytest.raises(socket.timeout):
+        conn.recv(1024)
+    assert time.monotonic() - start >= 0.1
+
+
+def test_non_blocking_recv(pair):
+    client, conn = pair
+    conn.setblocking(False)
+
+    with pytest.raises(BlockingIOError):
+        conn.recv(1024)
+    client.sendall(b'data')
+    time.sleep(0.1)
+    assert conn.recv(1024) == b'data'
+
+
+def test_sendall_times_out_once_the_buffers_are_full(pair):
+    client, _ = pair
+    client.settimeout(0.2)
+
+    # Nobody reads: the receive window closes and the send buffer fills up
+    with pytest.raises(socket.timeout):
+        client.sendall(os.urandom(16 * BUFFER_SIZE))
+
+
+def test_non_blocking_send_accepts_what_fits(pair):
+    client, _ = pair
+    client.setblocking(False)
+    data = os.urandom(16 * BUFFER_SIZE)
+
+    sent = client.send(data)
+    assert 0 < sent < len(data)
+    with pytest.raises(BlockingIOError):
+        for _ in range(100):
+            sent += client.send(data[sent:])
+            time.sleep(0.01)
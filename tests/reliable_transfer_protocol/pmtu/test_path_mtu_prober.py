@@ -0,0 +1,67 @@
+from reliable_socket.pmtu import PathMTUProber, MAX_PROBES
+
+
+def test_prober_jumps_to_max_size():
+    prober = PathMTUProber(base_size=1200, max_size=65507)
+
+    assert prober.next_probe() == 65507
+    assert prober.next_probe() is None  # Already in flight
+
+    prober.on_probe_acked(65507)
+
+    assert prober.size == 65507
+    assert prober.done
+
+
+def test_prober_lowers_the_probe_after_losses():
+    prober = PathMTUProber(base_size=1200, max_size=9000)
+    prober.next_probe()
+    prober.on_probe_lost()
+
+    # The same size is tried again until it is lost MAX_PROBES times
+    assert prober.next_probe() == 9000
+    for _ in range(MAX_PROBES - 1):
+        prober.on_probe_lost()
+        prober.next_probe()
+
+    assert prober.probe_size == (1200 + 8999 + 1) // 2
+    assert prober.size == 1200
+
+
+def test_prober_converges_to_the_path_mtu():
+    path_mtu = 1472
+    prober = PathMTUProber(base_size=1200, max_size=65507)
+    while True:
+        size = prober.next_probe()
+        if size is None:
+            break
+        if size <= path_mtu:
+            prober.on_probe_acked(size)
+        else:
+            prober.on_probe_lost(too_big=True)
+
+    assert path_mtu - 32 < prober.size <= path_mtu
+
+
+def test_prober_starts_over_below_a_package_too_big():
+    prober = PathMTUProber(base_size=1200, max_size=65507)
+    prober.next_probe()
+    prober.on_probe_acked(65507)
+
+    prober.on_packet_too_big(65507)
+
+    assert prober.size == 1200
+    assert not prober.done
+    # Halving the interval, not trying the size right below the one rejected
+    assert prober.next_probe() == (1200 + 65506 + 1) // 2
+
+
+def test_prober_falls_back_on_a_black_hole():
+    prober = PathMTUProber(base_size=1200, max_size=9000)
+    prober.next_probe()
+    prober.on_probe_acked(9000)
+
+    prober.on_black_hole()
+
+    assert prober.size == 1200
+    assert prober.max_size == 8999
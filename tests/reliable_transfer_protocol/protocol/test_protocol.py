@@ -0,0 +1,50 @@
+import socket
+
+import pytest
+
+from reliable_socket.protocol import Request, Response, FRAME_LENGTH, MAX_FRAME_SIZE, \
+    OP_DOWNLOAD_RANGE, STATUS_OK, STATUS_NOT_FOUND
+
+
+def test_request_round_trips_in_one_frame():
+    sender, receiver = socket.socketpair()
+    request = Request(OP_DOWNLOAD_RANGE, 'archivo.bin', 10, 20,
+                      {"stripe": 1, "stripes": 4, "compression": ["zlib"]})
+    response = Response(STATUS_OK, 1 << 40, 5, {"crc": 123})
+    # Both frames in a single write, the receiver splits them by their length
+    sender.sendall(request.to_bytes() + response.to_bytes())
+    received = Request.recv(receiver)
+    assert (received.op, received.name, received.size, received.offset, received.options) == \
+        (OP_DOWNLOAD_RANGE, 'archivo.bin', 10, 20, request.options)
+    received = Response.recv(receiver)
+    assert received.ok
+    assert (received.size, received.offset, received.options) == (1 << 40, 5, {"crc": 123})
+    sender.close()
+    receiver.close()
+
+
+def test_response_message():
+    response = Response.from_body(Response(STATUS_NOT_FOUND, options={"msg": "no"}).body())
+    assert not response.ok
+    assert response.message == "no"
+    assert Response(STATUS_OK).message == ""
+
+
+def test_oversized_frame_is_rejected():
+    sender, receiver = socket.socketpair()
+    sender.sendall(FRAME_LENGTH.pack(MAX_FRAME_SIZE + 1))
+    with pytest.raises(ValueError):
+        Request.recv(receiver)
+    sender.close()
+    receiver.close()
+
+
+@pytest.mark.parametrize('body', [b'', b'\x01' * 10, Request(OP_DOWNLOAD_RANGE, 'archivo.bin').body()[:25]])
+def test_truncated_request_is_rejected(body):
+    with pytest.raises(ValueError):
+        Request.from_body(body)
+
+
+def test_truncated_response_is_rejected():
+    with pytest.raises(ValueError):
+        Response.from_body(Response(STATUS_OK).body()[:-1])
@@ -0,0 +1,68 @@
+import os
+import zlib
+
+from reliable_socket.resume import PartialFile, prefix_matches
+
+
+def receive(partial, data, offset=0):
+    file = partial.open(offset)
+    file.write(data[offset:])
+    partial.on_write(len(data) - offset)
+
+
+def test_interrupted_transfer_resumes_from_the_committed_prefix(tmp_path):
+    path = str(tmp_path / 'f.bin')
+    data = os.urandom(1000)
+    partial = PartialFile(path, len(data))
+    receive(partial, data[:600])
+
+    assert not partial.finish()
+    assert not os.path.exists(path)
+
+    partial = PartialFile(path, len(data))
+
+    assert partial.committed == 600
+    assert partial.crc == zlib.crc32(data[:600])
+
+    receive(partial, data, partial.committed)
+
+    assert partial.finish()
+    with open(path, 'rb') as file:
+        assert file.read() == data
+    assert os.listdir(tmp_path) == ['f.bin']
+
+
+def test_nothing_to_resume_for_a_file_of_another_size(tmp_path):
+    path = str(tmp_path / 'f.bin')
+    partial = PartialFile(path, 1000)
+    receive(partial, b'x' * 600)
+    partial.close()
+
+    assert PartialFile(path, 2000).committed == 0
+
+
+def test_bytes_past_the_committed_prefix_are_dropped(tmp_path):
+    path = str(tmp_path / 'f.bin')
+    partial = PartialFile(path, 1000)
+    receive(partial, b'x' * 600)
+    partial.close()
+    # Written after the last checkpoint, before a crash
+    with open(path + '.part', 'ab') as part:
+        part.write(b'y' * 100)
+
+    partial = PartialFile(path, 1000)
+    receive(partial, b'x' * 1000, partial.committed)
+
+    assert partial.finish()
+    with open(path, 'rb') as file:
+        assert file.read() == b'x' * 1000
+
+
+def test_prefix_matches(tmp_path):
+    path = tmp_path / 'f.bin'
+    path.write_bytes(b'abcdef')
+
+    assert prefix_matches(str(path), 3, zlib.crc32(b'abc'))
+    assert not prefix_matches(str(path), 3, zlib.crc32(b'abd'))
+    assert not prefix_matches(str(path), 10, 0)
+    assert not prefix_matches(str(tmp_path / 'missing'), 3, 0)
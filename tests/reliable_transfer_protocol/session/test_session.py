@@ -0,0 +1,121 @@
+import os
+import socket
+from threading import Thread
+
+from reliable_socket.client import Client
+from reliable_socket.server import ServerWorker
+from reliable_socket.reliable_transfer_protocol import ReliableTCPSocket
+from reliable_socket.protocol import Request, FRAME_LENGTH, OP_UPLOAD_CHUNKS
+from reliable_socket.chunk_store import CHUNK_LIST_HEADER
+
+
+def start_server(storage):
+    """
+    Serves `storage` on a loopback port. Returns the port and the workers of the connections
+    """
+    listener = ReliableTCPSocket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen()
+    workers = []
+
+    def accept():
+        while True:
+            conn, (host, port) = listener.accept()
+            worker = ServerWorker(port, host, conn, storage)
+            workers.append(worker)
+            worker.start()
+
+    Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1], workers
+
+
+def test_session_moves_many_files_on_one_connection(tmp_path):
+    src, storage, dst = tmp_path / 'src', tmp_path / 'storage', tmp_path / 'dst'
+    for directory in (src, storage, dst):
+        directory.mkdir()
+    files = {f'f{i}.bin': os.urandom(1000 * i) for i in range(5)}
+    for name, data in files.items():
+        (src / name).write_bytes(data)
+    port, workers = start_server(str(storage))
+
+    with Client(str(src), None, '127.0.0.1', port) as client:
+        for name in files:
+            client.upload(name)
+        assert client.stat('f3.bin')[0] == 3000
+        assert client.stat('missing.bin') is None
+    with Client(str(dst), None, '127.0.0.1', port) as client:
+        for name in files:
+            client.download(name)
+
+    assert len(workers) == 2
+    for name, data in files.items():
+        assert (dst / name).read_bytes() == data
+
+
+def test_transfer_outside_a_session_opens_its_own(tmp_path):
+    (tmp_path / 'a.bin').write_bytes(b'a')
+    (tmp_path / 'b.bin').write_bytes(b'b')
+    storage = tmp_path / 'storage'
+    storage.mkdir()
+    port, workers = start_server(str(storage))
+
+    client = Client(str(tmp_path), 'a.bin', '127.0.0.1', port)
+    client.upload()
+    client.upload('b.bin')
+
+    assert len(workers) == 2
+    for worker in workers:
+        # Each one ends with the session of its connection
+        worker.join(5)
+        assert not worker.is_alive()
+    assert (storage / 'a.bin').read_bytes() == b'a'
+    assert (storage / 'b.bin').read_bytes() == b'b'
+
+
+def test_directory_is_synced_in_both_directions(tmp_path):
+    src, storage, dst = tmp_path / 'src', tmp_path / 'storage', tmp_path / 'dst'
+    (src / 'tree' / 'sub').mkdir(parents=True)
+    storage.mkdir()
+    files = {'tree/a.bin': os.urandom(10), 'tree/sub/b.bin': os.urandom(100 * 1024)}
+    for relative, data in files.items():
+        (src / relative).write_bytes(data)
+    port, workers = start_server(str(storage))
+
+    with Client(str(src), 'tree', '127.0.0.1', port) as client:
+        client.upload_dir()
+        client.upload_dir()
+    client = Client(str(dst), 'tree', '127.0.0.1', port)
+    client.download_dir()
+
+    for relative, data in files.items():
+        assert (storage / relative).read_bytes() == data
+        assert (dst / relative).read_bytes() == data
+
+
+def test_invalid_streams_only_end_their_session(tmp_path):
+    (tmp_path / 'a.bin').write_bytes(b'a')
+    storage = tmp_path / 'storage'
+    storage.mkdir()
+    port, workers = start_server(str(storage))
+    streams = [
+        # A frame too short for the header of a request
+        FRAME_LENGTH.pack(3) + b'abc',
+        # Far more chunks than a file of 100 bytes can have
+        Request(OP_UPLOAD_CHUNKS, 'a.bin', 100).to_bytes() + CHUNK_LIST_HEADER.pack(100, 1 << 30),
+    ]
+
+    for stream in streams:
+        with socket.create_connection(('127.0.0.1', port)) as conn:
+            conn.settimeout(5)
+            conn.sendall(stream)
+            # The worker closes the connection without answering
+            assert conn.recv(1) == b''
+
+    # The server still serves other sessions
+    with Client(str(tmp_path), None, '127.0.0.1', port) as client:
+        client.upload('a.bin')
+    assert len(workers) == 3
+    for worker in workers:
+        worker.join(5)
+        assert not worker.is_alive()
+    assert (storage / 'a.bin').read_bytes() == b'a'
@@ -0,0 +1,34 @@
+import os
+
+from reliable_socket.striping import split_ranges, StripedUploads
+
+
+def test_ranges_cover_the_file_aligned_to_chunks():
+    ranges = split_ranges(10 * 1024 + 1, 4, 1024)
+
+    assert ranges == [(0, 3072), (3072, 3072), (6144, 3072), (9216, 1025)]
+
+
+def test_small_files_take_fewer_ranges():
+    assert split_ranges(1500, 4, 1024) == [(0, 1024), (1024, 476)]
+    assert split_ranges(10, 4, 1024) == [(0, 10)]
+    assert split_ranges(0, 4, 1024) == []
+
+
+def test_upload_is_moved_in_place_once_every_range_arrived(tmp_path):
+    path = str(tmp_path / 'f.bin')
+    data = os.urandom(3000)
+    uploads = StripedUploads()
+    ranges = split_ranges(len(data), 2, 1024)
+
+    completed = []
+    for offset, count in reversed(ranges):
+        fd = uploads.open(path, len(data))
+        os.pwrite(fd, data[offset:offset + count], offset)
+        os.close(fd)
+        completed.append(uploads.on_range(path, len(data), offset, count))
+
+    assert completed == [False, True]
+    with open(path, 'rb') as file:
+        assert file.read() == data
+    assert os.listdir(tmp_path) == ['f.bin']
@@ -0,0 +1,33 @@
+import time
+from threading import Event
+
+from reliable_socket.timers import TimerService
+
+
+def test_timers_run_in_deadline_order():
+    service = TimerService()
+    fired = []
+    done = Event()
+    now = time.time()
+
+    service.call_at(now + 0.03, fired.append, 3)
+    service.call_at(now + 0.01, fired.append, 1)
+    service.call_at(now + 0.02, fired.append, 2)
+    service.call_at(now + 0.04, done.set)
+
+    assert done.wait(1)
+    assert fired == [1, 2, 3]
+
+
+def test_cancelled_timer_does_not_run():
+    service = TimerService()
+    fired = []
+    done = Event()
+
+    handle = service.call_later(0.01, fired.append, 1)
+    service.call_later(0.02, done.set)
+    handle.cancel()
+
+    assert done.wait(1)
+    assert fired == []
+    assert len(service) == 0
@@ -0,0 +1,28 @@
+from reliable_socket.utils import ByteQueue
+
+
+def test_byte_queue_read_across_chunks():
+    queue = ByteQueue()
+    queue.append(b'abc')
+    queue.append(b'')
+    queue.append(b'defg')
+
+    assert len(queue) == 7
+    assert queue.read(2) == b'ab'
+    assert queue.read(4) == b'cdef'
+    assert queue.read(10) == b'g'
+    assert len(queue) == 0
+    assert queue.read(10) == b''
+
+
+def test_byte_queue_read_into():
+    queue = ByteQueue()
+    queue.append(b'hello ')
+    queue.append(b'world')
+    buffer = bytearray(8)
+
+    assert queue.read_into(buffer) == 8
+    assert buffer == b'hello wo'
+    assert queue.read_into(buffer, 2) == 2
+    assert buffer[:2] == b'rl'
+    assert queue.read(5) == b'd'
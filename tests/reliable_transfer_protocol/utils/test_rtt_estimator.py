@@ -0,0 +1,37 @@
+import pytest
+
+from reliable_socket.utils import RTTEstimator
+
+
+def test_rtt_first_sample():
+    estimator = RTTEstimator(1, 0.2, 60)
+    estimator.sample(0.5)
+
+    assert estimator.srtt == 0.5
+    assert estimator.rttvar == 0.25
+    assert estimator.rto == 1.5
+
+
+def test_rtt_bounds():
+    estimator = RTTEstimator(1, 0.2, 60)
+    estimator.sample(0.001)
+
+    assert estimator.rto == 0.2
+
+    for _ in range(20):
+        estimator.backoff()
+
+    assert estimator.rto == 60
+
+
+def test_rtt_backoff_reset_by_sample():
+    estimator = RTTEstimator(1, 0.2, 60)
+    estimator.sample(0.1)
+    estimator.backoff()
+    estimator.backoff()
+
+    assert estimator.rto == pytest.approx(0.3 * 4)
+
+    estimator.sample(0.1)
+
+    assert estimator.rto < 0.3
@@ -1,4 +1,8 @@
-from reliable_socket.utils import UDPPacket
+import pytest
+
+from reliable_socket.utils import (UDPPacket, chunked, pack_options, unpack_options, to_ranges,
+                                   pack_sack_blocks, unpack_sack_blocks, OPTION_SACK,
+                                   OPTION_SACK_PERMITTED)
 
 
 def test_udp_comparators():
@@ -8,3 +12,68 @@ def test_udp_comparators():
     assert x < y
 
     assert min([x, y]) == x
+
+
+def test_udp_package_round_trip():
+    payload = b'some data'
+    x = UDPPacket.create_data(3, 2, payload)
+
+    assert b''.join(x.to_buffers()) == x.to_bytes()
+    assert len(x.to_bytes()) == UDPPacket.HEADER_SIZE + len(payload)
+
+    y = UDPPacket.from_bytes(x.to_bytes())
+
+    assert y == x
+    assert y.is_data()
+    assert isinstance(y.payload, memoryview)
+
+
+def test_short_datagram_is_not_a_package():
+    with pytest.raises(ValueError):
+        UDPPacket.from_bytes(b'x' * (UDPPacket.HEADER_SIZE - 1))
+
+
+def test_chunked_does_not_copy():
+    data = bytes(range(10))
+    chunks = list(chunked(data, 4))
+
+    assert [bytes(c) for c in chunks] == [data[0:4], data[4:8], data[8:10]]
+    assert all(c.obj is data for c in chunks)
+
+
+def test_udp_package_flags():
+    x = UDPPacket.create_synack()
+
+    assert x.flags == UDPPacket.flags_to_int(syn=True, ack=True)
+    assert x.flags_dict == UDPPacket.flag_dict(syn=True, ack=True)
+    assert UDPPacket(0, 0, UDPPacket.flag_dict(syn=True, ack=True)) == x
+    assert x.is_synack() and not x.is_syn() and not x.is_ack()
+
+
+def test_udp_package_header_follows_ack_n():
+    x = UDPPacket.create_ack(0, 1)
+    x.to_bytes()
+    x.ack_n = 2
+
+    assert UDPPacket.from_bytes(x.to_bytes()).ack_n == 2
+
+
+def test_udp_package_options():
+    x = UDPPacket.create_ack(0, 3, {OPTION_SACK: pack_sack_blocks([(5, 6), (9, 9)])})
+    y = UDPPacket.from_bytes(x.to_bytes())
+
+    assert y.is_ack()
+    assert unpack_sack_blocks(y.options[OPTION_SACK]) == [(5, 6), (9, 9)]
+    assert OPTION_SACK_PERMITTED in UDPPacket.create_syn({OPTION_SACK_PERMITTED: b''}).options
+    assert UDPPacket.create_syn().options == {}
+
+
+def test_unknown_and_malformed_options_are_ignored():
+    payload = pack_options({99: b'abc', OPTION_SACK_PERMITTED: b''}) + b'\x05\xff'
+
+    assert set(unpack_options(payload)) == {99, OPTION_SACK_PERMITTED}
+
+
+def test_to_ranges():
+    assert to_ranges([9, 5, 6, 12, 10]) == [(5, 6), (9, 10), (12, 12)]
+    assert to_ranges([]) == []